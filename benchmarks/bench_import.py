@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+
+# PFx Brick package import time benchmark
+#
+# Measures the time taken by a fresh interpreter to import the package and
+# checks that the hidapi library, the ICD constants and the lookup
+# dictionaries are not loaded until they are needed.  Exits with a non-zero
+# status if a check fails or the import takes longer than the budget.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ('import pfxbrick', ['hid', 'pfxbrick.pfx', 'pfxbrick.pfxbrick']),
+    ('from pfxbrick import PFxAction', ['hid', 'pfxbrick.pfxbrick']),
+    ('from pfxbrick import PFxBrick', ['hid']),
+]
+
+PROBE = '''
+import sys, time
+t0 = time.perf_counter()
+%s
+t1 = time.perf_counter()
+print(t1 - t0)
+print(','.join(m for m in %r if m in sys.modules and not type(sys.modules[m]).__name__.startswith('_Lazy')))
+'''
+
+def run_case(stmt, not_loaded, repeat):
+    times = []
+    loaded = []
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, '-c', PROBE % (stmt, not_loaded)], env=env,
+                             stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout.splitlines()
+        times.append(float(out[0]) * 1000.0)
+        loaded = [m for m in out[1].split(',') if m]
+    return statistics.median(times), loaded
+
+def main():
+    parser = argparse.ArgumentParser(description='PFx Brick import time benchmark')
+    parser.add_argument('-n', '--repeat', type=int, default=20, help='number of interpreter runs per case')
+    parser.add_argument('-b', '--budget', type=float, default=5.0, help='maximum median time in ms for a plain package import')
+    args = parser.parse_args()
+    ok = True
+    for idx, (stmt, not_loaded) in enumerate(CASES):
+        ms, loaded = run_case(stmt, not_loaded, args.repeat)
+        print('%-36s %8.2f ms' % (stmt, ms))
+        if loaded:
+            print('  FAIL: eagerly loaded %s' % (', '.join(loaded)))
+            ok = False
+        if idx == 0 and ms > args.budget:
+            print('  FAIL: exceeds budget of %.2f ms' % (args.budget))
+            ok = False
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+
+# PFx Brick benchmark suite
+#
+# Measures transport round trips, codec rates, directory and file transfer
+# performance against an emulated PFx Brick (or a real one with --serial)
+# plus package import time.  Results are printed and optionally saved as
+# JSON.  With --compare, results are checked against a saved baseline and
+# the exit status is non-zero if any benchmark regressed by more than the
+# tolerance.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# the hand-indexed configuration layout kept by the codec tests
+sys.path.insert(1, os.path.join(ROOT, 'tests'))
+
+import pfxbrick
+from pfxbrick import PFxBrick, PFxAction, PFxConfig, PFxFile
+from pfxbrick.pfx import *
+from pfxbrick.pfxconfig import read_codec, write_codec
+from pfxbrick.pfxemulator import PFxEmulator
+from pfxbrick.pfxmsg import cmd_get_icd_rev
+from bench_import import run_case
+from test_pfxconfig import legacy_from_bytes, legacy_to_bytes
+
+FILE_SIZES = (1024, 16384, 262144)
+
+
+def timed(fn, count):
+    # best of 3 runs, in seconds per call
+    best = None
+    for run in range(3):
+        t0 = time.perf_counter()
+        for i in range(count):
+            fn()
+        t = (time.perf_counter() - t0) / count
+        best = t if best is None else min(best, t)
+    return best
+
+def bench_transport(brick, results, quick):
+    n = 200 if quick else 2000
+    t = timed(lambda: cmd_get_icd_rev(brick.hid, True), n)
+    results['usb_transaction_rtt'] = {'value': t * 1e6, 'unit': 'us', 'better': 'lower'}
+    # 64 empty (no-op) test actions, one round trip each or as one batch
+    action = PFxAction()
+    def serial():
+        for i in range(64):
+            brick.test_action(action)
+    def batched():
+        with brick.batch():
+            serial()
+    n = 5 if quick else 50
+    results['actions_64'] = {'value': timed(serial, n) * 1e3, 'unit': 'ms', 'better': 'lower'}
+    results['actions_64_batched'] = {'value': timed(batched, n) * 1e3, 'unit': 'ms', 'better': 'lower'}
+
+def bench_codecs(results, quick):
+    n = 2000 if quick else 20000
+    action = PFxAction().set_motor_speed([1], 50).light_on([1, 2])
+    msg = [0] + list(action.to_bytes())
+    a = PFxAction()
+    results['action_encode'] = {'value': 1.0 / timed(action.to_bytes, n), 'unit': 'ops/s', 'better': 'higher'}
+    results['action_decode'] = {'value': 1.0 / timed(lambda: a.from_bytes(msg), n), 'unit': 'ops/s', 'better': 'higher'}
+    config = PFxConfig()
+    cmsg = [0] + list(read_codec.encode(config))
+    results['config_encode'] = {'value': 1.0 / timed(config.to_bytes, n), 'unit': 'ops/s', 'better': 'higher'}
+    results['config_decode'] = {'value': 1.0 / timed(lambda: config.from_bytes(cmsg), n), 'unit': 'ops/s', 'better': 'higher'}
+    # the hand-indexed conversion which PFxConfigCodec replaced, for reference
+    results['config_encode_legacy'] = {'value': 1.0 / timed(lambda: legacy_to_bytes(config), n), 'unit': 'ops/s', 'better': 'higher'}
+    results['config_decode_legacy'] = {'value': 1.0 / timed(lambda: legacy_from_bytes(config, cmsg), n), 'unit': 'ops/s', 'better': 'higher'}
+    configs = [PFxConfig() for i in range(100)]
+    buf = write_codec.encode_many(configs)
+    m = max(1, n // 100)
+    results['config_encode_many'] = {'value': 100.0 / timed(lambda: write_codec.encode_many(configs), m), 'unit': 'configs/s', 'better': 'higher'}
+    results['config_decode_many'] = {'value': 100.0 / timed(lambda: write_codec.decode_many(buf), m), 'unit': 'configs/s', 'better': 'higher'}
+    fmsg = [0xC5, 0, 0, 7, 0, 1, 0, 0, 0, 4] + [0] * 14 + list(b'horn.wav') + [0] * 32
+    f = PFxFile()
+    results['file_decode'] = {'value': 1.0 / timed(lambda: f.from_bytes(fmsg), n), 'unit': 'ops/s', 'better': 'higher'}
+
+def bench_files(brick, results, quick, tmpdir, overwrite=False):
+    sizes = FILE_SIZES[:2] if quick else FILE_SIZES
+    # the benchmark files use IDs 0xF0 and up, which must not replace user files
+    brick.refresh_file_dir()
+    used = ['0x%02X' % (0xF0 + i) for i in range(len(sizes)) if brick.filedir.get_file_dir_entry(0xF0 + i) is not None]
+    if used and not overwrite:
+        print('Skipping the file benchmarks, file IDs %s are in use (use --overwrite to replace them)' % (', '.join(used)))
+        return
+    for i, size in enumerate(sizes):
+        fn = os.path.join(tmpdir, 'bench%d.bin' % (i))
+        with open(fn, 'wb') as f:
+            f.write(os.urandom(size))
+        fid = 0xF0 + i
+        brick.refresh_file_dir()
+        if brick.filedir.get_file_dir_entry(fid) is not None:
+            brick.remove_file(fid)
+        t0 = time.perf_counter()
+        brick.put_file(fid, fn, show_progress=False)
+        t = time.perf_counter() - t0
+        results['upload_%dk' % (size // 1024)] = {'value': size / t / 1024, 'unit': 'kB/s', 'better': 'higher'}
+        t0 = time.perf_counter()
+        brick.get_file(fid, os.path.join(tmpdir, 'copy%d.bin' % (i)), show_progress=False)
+        t = time.perf_counter() - t0
+        results['download_%dk' % (size // 1024)] = {'value': size / t / 1024, 'unit': 'kB/s', 'better': 'higher'}
+    t = timed(brick.refresh_file_dir, 5 if quick else 20)
+    results['refresh_file_dir'] = {'value': t * 1e3, 'unit': 'ms', 'better': 'lower'}
+    for i in range(len(sizes)):
+        brick.remove_file(0xF0 + i)
+
+def bench_import(results, quick):
+    ms, loaded = run_case('import pfxbrick', [], 5 if quick else 20)
+    results['import_package'] = {'value': ms, 'unit': 'ms', 'better': 'lower'}
+    ms, loaded = run_case('from pfxbrick import PFxBrick', [], 5 if quick else 20)
+    results['import_pfxbrick'] = {'value': ms, 'unit': 'ms', 'better': 'lower'}
+
+def compare(results, baseline, tolerance):
+    ok = True
+    print('\n%-24s %14s %14s %9s' % ('benchmark', 'baseline', 'current', 'change'))
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['value']
+        change = (r['value'] - old) / old if old else 0.0
+        worse = change > tolerance if r['better'] == 'lower' else change < -tolerance
+        flag = '  REGRESSION' if worse else ''
+        print('%-24s %14.2f %14.2f %+8.1f%%%s' % (name, old, r['value'], change * 100.0, flag))
+        ok = ok and not worse
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='PFx Brick benchmark suite')
+    parser.add_argument('-s', '--serial', default=None, help='benchmark the connected PFx Brick with this serial number instead of an emulated one')
+    parser.add_argument('--overwrite', action='store_true', help='replace files with the IDs used by the file benchmarks (0xF0 and up) on the PFx Brick')
+    parser.add_argument('-q', '--quick', action='store_true', help='fewer iterations and smaller files')
+    parser.add_argument('-o', '--output', default=None, help='save the results as JSON to this file')
+    parser.add_argument('-c', '--compare', default=None, help='compare with a baseline JSON file')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.10, help='allowed relative regression when comparing')
+    args = parser.parse_args()
+
+    brick = PFxBrick()
+    if args.serial is not None:
+        if not brick.open(args.serial):
+            sys.exit(1)
+    else:
+        brick.open(device=PFxEmulator('BE4C4B00'))
+    results = {}
+    bench_transport(brick, results, args.quick)
+    bench_codecs(results, args.quick)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bench_files(brick, results, args.quick, tmpdir, args.overwrite)
+    brick.close()
+    bench_import(results, args.quick)
+
+    for name, r in results.items():
+        print('%-24s %14.2f %s' % (name, r['value'], r['unit']))
+    report = {
+        'meta': {
+            'version': pfxbrick.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'target': args.serial if args.serial is not None else 'emulator',
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
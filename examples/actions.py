@@ -3,9 +3,9 @@
 # PFx Brick example script to demonstrate multiple scripted actions
 
 import hid
-import time
 import random
 from pfxbrick import PFxBrick, PFxAction
+from pfxbrick.pfxsequencer import PFxSequencer
 from pfxbrick.pfx import *
 
 brick = PFxBrick()
@@ -18,26 +18,27 @@ max_speed = 100
 brick.test_action(PFxAction().repeat_audio_file(audiofile))
 brick.test_action(PFxAction().set_volume(75))
 
-# ramp up the motor speed gradually to max_speed
+# build a timeline which ramps the motor speed gradually up to max_speed
+# and back down to 0% while showing a random light pattern every 0.1 sec
+seq = PFxSequencer(brick)
 for x in range(max_speed):
-    brick.test_action(PFxAction().set_motor_speed([1], x))
-    # show a random light pattern
+    t = x * 0.1
+    seq.add(t, PFxAction().set_motor_speed([1], x))
     y = random.randint(1,8)
-    brick.test_action(PFxAction().light_toggle([y]))
-    time.sleep(0.1)
-
-# ramp down the motor speed gradually to 0%
-
+    seq.add(t, PFxAction().light_toggle([y]))
 for x in range(max_speed):
-    brick.test_action(PFxAction().set_motor_speed([1], max_speed-x-1))
-    # show a random light pattern
+    t = (max_speed + x) * 0.1
+    seq.add(t, PFxAction().set_motor_speed([1], max_speed-x-1))
     y = random.randint(1,8)
-    brick.test_action(PFxAction().light_toggle([y]))
-    time.sleep(0.1)
+    seq.add(t, PFxAction().light_toggle([y]))
+
+# play the timeline with drift compensated timing
+stats = seq.run()
+print(stats)
 
 # stop motor and turn off audio and lights
 brick.test_action(PFxAction().stop_motor([1]))
 brick.test_action(PFxAction().stop_audio_file(audiofile))
-brick.test_action(PFxAction().light_off(range(1,9))
+brick.test_action(PFxAction().light_off(range(1,9)))
 
 brick.close()
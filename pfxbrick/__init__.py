@@ -3,14 +3,42 @@
 import os
 
 __project__ = 'pfxbrick'
-__version__ = '0.6.2'
+__version__ = '0.7.0'
 
 VERSION = __project__ + '-' + __version__
 
 script_dir = os.path.dirname(__file__)
 
-from .pfxbrick import PFxBrick, find_bricks
-from .pfxaction import PFxAction
-from .pfxconfig import PFxConfig
-from .pfxfiles import PFxFile, PFxDir
+# Public classes and the module which defines them.  These are imported on
+# first use, so that importing the package stays cheap and the hidapi
+# library, the ICD constants and the lookup dictionaries are only loaded
+# when they are needed.
+_exports = {
+    'PFxBrick': 'pfxbrick',
+    'find_bricks': 'pfxbrick',
+    'PFxAction': 'pfxaction',
+    'PFxActionCache': 'pfxaction',
+    'PFxConfig': 'pfxconfig',
+    'PFxFile': 'pfxfiles',
+    'PFxDir': 'pfxfiles',
+}
 
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    import importlib
+    if name in _exports:
+        value = getattr(importlib.import_module('.' + _exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    try:
+        return importlib.import_module('.' + name, __name__)
+    except ModuleNotFoundError as e:
+        if e.name != __name__ + '.' + name:
+            raise
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -23,10 +23,28 @@
 #
 # PFx Brick configuration data helpers
 
+import struct
+from collections import OrderedDict
 from pfxbrick.pfx import *
-import pfxbrick.pfxdict as pd
 from pfxbrick.pfxhelpers import *
 
+pd = lazy_import('pfxbrick.pfxdict')
+
+# 16 unsigned bytes, in EVT_ACT_* byte index order
+_ACTION_STRUCT = struct.Struct('16B')
+
+def _action_field(index):
+    """
+    Builds a property which reads and writes one byte of the action data.
+    """
+    def getter(self):
+        return self._data[index]
+    def setter(self, value):
+        if not 0 <= value <= 0xFF:
+            raise ValueError("Action field value %r is out of range (0 - 255)" % (value))
+        self._data[index] = value
+    return property(getter, setter)
+
 
 class PFxAction:
     """
@@ -70,23 +88,27 @@ class PFxAction:
         soundParam2 (:obj:`int`): Sound parameter 2
 
     """
+    __slots__ = ('_data',)
+
+    command = _action_field(EVT_ACT_COMMAND)
+    motorActionId = _action_field(EVT_ACT_MOTOR_ACTION_ID)
+    motorParam1 = _action_field(EVT_ACT_MOTOR_PARAM1)
+    motorParam2 = _action_field(EVT_ACT_MOTOR_PARAM2)
+    lightFxId = _action_field(EVT_ACT_LIGHT_FX_ID)
+    lightOutputMask = _action_field(EVT_ACT_LIGHT_OUTPUT_MASK)
+    lightPFOutputMask = _action_field(EVT_ACT_LIGHT_PF_OUTPUT_MASK)
+    lightParam1 = _action_field(EVT_ACT_LIGHT_PARAM1)
+    lightParam2 = _action_field(EVT_ACT_LIGHT_PARAM2)
+    lightParam3 = _action_field(EVT_ACT_LIGHT_PARAM3)
+    lightParam4 = _action_field(EVT_ACT_LIGHT_PARAM4)
+    lightParam5 = _action_field(EVT_ACT_LIGHT_PARAM5)
+    soundFxId = _action_field(EVT_ACT_SOUND_FX_ID)
+    soundFileId = _action_field(EVT_ACT_SOUND_FILE_ID)
+    soundParam1 = _action_field(EVT_ACT_SOUND_PARAM1)
+    soundParam2 = _action_field(EVT_ACT_SOUND_PARAM2)
+
     def __init__(self):
-        self.command = 0
-        self.motorActionId = 0
-        self.motorParam1 = 0
-        self.motorParam2 = 0
-        self.lightFxId = 0
-        self.lightOutputMask = 0
-        self.lightPFOutputMask = 0
-        self.lightParam1 = 0
-        self.lightParam2 = 0
-        self.lightParam3 = 0
-        self.lightParam4 = 0
-        self.lightParam5 = 0
-        self.soundFxId = 0
-        self.soundFileId = 0
-        self.soundParam1 = 0
-        self.soundParam2 = 0
+        self._data = bytearray(_ACTION_STRUCT.size)
 
     def set_motor_speed(self, ch, speed, duration=None):
         """
@@ -330,68 +352,47 @@ class PFxAction:
         """
         Sets all the action data in this class to zero.
         """
-        self.command = 0
-        self.motorActionId = 0
-        self.motorParam1 = 0
-        self.motorParam2 = 0
-        self.lightFxId = 0
-        self.lightOutputMask = 0
-        self.lightPFOutputMask = 0
-        self.lightParam1 = 0
-        self.lightParam2 = 0
-        self.lightParam3 = 0
-        self.lightParam4 = 0
-        self.lightParam5 = 0
-        self.soundFxId = 0
-        self.soundFileId = 0
-        self.soundParam1 = 0
-        self.soundParam2 = 0        
+        self._data[:] = bytes(_ACTION_STRUCT.size)
 
     def from_bytes(self, msg):
         """
         Converts the message string bytes read from the PFx Brick into
         the corresponding data members of this class.
         """
-        self.command = msg[1]
-        self.motorActionId = msg[2]
-        self.motorParam1 = msg[3]
-        self.motorParam2 = msg[4]
-        self.lightFxId = msg[5]
-        self.lightOutputMask = msg[6]
-        self.lightPFOutputMask = msg[7]
-        self.lightParam1 = msg[8]
-        self.lightParam2 = msg[9]
-        self.lightParam3 = msg[10]
-        self.lightParam4 = msg[11]
-        self.lightParam5 = msg[12]
-        self.soundFxId = msg[13]
-        self.soundFileId = msg[14]
-        self.soundParam1 = msg[15]
-        self.soundParam2 = msg[16]
+        self._data[:] = _ACTION_STRUCT.pack(*msg[1:17])
         
     def to_bytes(self):
         """
         Converts the data members of this class to the message 
         string bytes which can be sent to the PFx Brick.
+
+        :returns: :obj:`bytes` the 16 byte action data structure
+        """
+        return bytes(self._data)
+
+    def __eq__(self, other):
+        if not isinstance(other, PFxAction):
+            return NotImplemented
+        return self._data == other._data
+
+    def __hash__(self):
+        """
+        Hashes the action by its current data content. Note that changing
+        an action after it has been used as a dictionary key or set member
+        will change its hash.
         """
-        msg = []
-        msg.append(self.command)
-        msg.append(self.motorActionId)
-        msg.append(self.motorParam1)
-        msg.append(self.motorParam2)
-        msg.append(self.lightFxId)
-        msg.append(self.lightOutputMask)
-        msg.append(self.lightPFOutputMask)
-        msg.append(self.lightParam1)
-        msg.append(self.lightParam2)
-        msg.append(self.lightParam3)
-        msg.append(self.lightParam4)
-        msg.append(self.lightParam5)
-        msg.append(self.soundFxId)
-        msg.append(self.soundFileId)
-        msg.append(self.soundParam1)
-        msg.append(self.soundParam2)
-        return msg
+        return hash(bytes(self._data))
+
+    def __copy__(self):
+        action = PFxAction()
+        action._data[:] = self._data
+        return action
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def __repr__(self):
+        return 'PFxAction(%s)' % (self._data.hex())
         
     def __str__(self):
         """
@@ -425,5 +426,89 @@ class PFxAction:
         sb.append('Sound Param 2     : [%02X]' % (self.soundParam2))
         s = '\n'.join(sb)
         return s
-        
-        
\ No newline at end of file
+
+
+def _freeze(x):
+    """
+    Converts builder arguments such as channel lists into hashable keys.
+    """
+    if isinstance(x, (list, tuple, range)):
+        return tuple(_freeze(v) for v in x)
+    return x
+
+
+class PFxActionCache:
+    """
+    Encoding cache for frequently sent actions.
+    
+    The first time an action is requested, it is built with the named
+    :py:class:`PFxAction` builder method and its encoded 16 byte payload
+    is remembered.  Subsequent requests with the same builder arguments
+    return the pre-encoded immutable payload directly, skipping the channel
+    mask, speed and duration conversions.  The payload can be passed to
+    :py:meth:`PFxBrick.test_action` in place of a :py:class:`PFxAction`.
+    
+    Builder methods can be called directly on the cache, e.g.::
+    
+        cache = PFxActionCache()
+        brick.test_action(cache.set_motor_speed([1], 50))
+        brick.test_action(cache.light_toggle([3]))
+    
+    The least recently used payloads are evicted once the cache holds
+    **maxsize** entries.
+
+    Attributes:
+        maxsize (:obj:`int`): maximum number of cached payloads
+
+        hits (:obj:`int`): number of requests served from the cache
+
+        misses (:obj:`int`): number of requests which required encoding
+    """
+    builders = ('set_motor_speed', 'stop_motor', 'light_on', 'light_off',
+        'light_toggle', 'set_brightness', 'combo_light_fx', 'light_fx',
+        'sound_fx', 'play_audio_file', 'stop_audio_file', 'repeat_audio_file',
+        'set_volume')
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._payloads = OrderedDict()
+
+    def encode(self, builder, *args, **kwargs):
+        """
+        Returns the encoded payload of an action built with a :py:class:`PFxAction` builder method.
+        
+        :param builder: :obj:`str` name of the builder method, e.g. 'set_motor_speed'
+        :param args: arguments passed to the builder method
+        :param kwargs: keyword arguments passed to the builder method
+        :returns: :obj:`bytes` 16 byte action payload
+        """
+        key = (builder, _freeze(args), tuple(sorted((k, _freeze(v)) for k, v in kwargs.items())))
+        payload = self._payloads.get(key)
+        if payload is not None:
+            self._payloads.move_to_end(key)
+            self.hits += 1
+            return payload
+        self.misses += 1
+        payload = getattr(PFxAction(), builder)(*args, **kwargs).to_bytes()
+        self._payloads[key] = payload
+        if len(self._payloads) > self.maxsize:
+            self._payloads.popitem(last=False)
+        return payload
+
+    def clear(self):
+        """
+        Removes all cached payloads and resets the hit/miss counters.
+        """
+        self._payloads.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def __getattr__(self, name):
+        if name in PFxActionCache.builders:
+            return lambda *args, **kwargs: self.encode(name, *args, **kwargs)
+        raise AttributeError("'PFxActionCache' object has no attribute '%s'" % (name))
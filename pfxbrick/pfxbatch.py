@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick command batching
+
+from pfxbrick.pfx import *
+from pfxbrick.pfxhelpers import get_error_str
+from pfxbrick.pfxmsg import usb_pipeline, record_error, command_str
+
+
+def fs_dir_status(msg, res):
+    """
+    Returns the file system error code of a PFX_CMD_FILE_DIR request which
+    changes a directory entry.  The status is returned after the echoed
+    request code, in the same byte position as the ICD messages which
+    return directory entries.
+    
+    :returns: :obj:`int` error code, or 0 on success or for other messages
+    """
+    if msg[0] == PFX_CMD_FILE_DIR and msg[1] >= PFX_DIR_REQ_ADD_AUDIO_FILE_ID and res[2] > 62:
+        return res[2]
+    return 0
+
+
+class PFxBatch:
+    """
+    Queue of ICD messages which change the PFx Brick, sent together in a
+    pipelined burst.
+    
+    A batch is created with :py:meth:`PFxBrick.batch` and used as a context
+    manager.  While it is active, :py:meth:`PFxBrick.set_action`,
+    :py:meth:`PFxBrick.set_action_by_address`, :py:meth:`PFxBrick.test_action`,
+    :py:meth:`PFxBrick.send_event`, :py:meth:`PFxBrick.trigger`,
+    :py:meth:`PFxBrick.set_config`, :py:meth:`PFxBrick.set_name`,
+    :py:meth:`PFxBrick.set_file_attributes`, :py:meth:`PFxBrick.set_file_user_data`
+    and :py:meth:`PFxBrick.rename_file` queue their messages instead of
+    waiting for a response each.  The queue is sent when the ``with`` block
+    exits, and is discarded if the block raises an exception.
+
+    .. code-block:: python
+
+      with brick.batch():
+          for address in range(0x40):
+              brick.set_action_by_address(address, PFxAction())
+          brick.set_name('Layout 1')
+
+    A queued message which writes the same LUT address, file attribute,
+    name or configuration as an earlier queued message replaces it, so
+    only the last value is sent.  Test actions and events are never
+    replaced, and the messages queued before and after one are sent in
+    that order, so an event fires the action stored when it was queued.
+    All other methods, including reads, are performed immediately and are
+    therefore not ordered with respect to the queued messages.
+
+    Errors are collected for the whole burst and printed together.
+
+    Attributes:
+        sent (:obj:`int`): number of messages sent by this batch
+
+        superseded (:obj:`int`): number of queued messages replaced by a later message
+
+        errors ([:obj:`str`]): descriptions of the messages which failed
+    """
+    def __init__(self, brick):
+        self.brick = brick
+        self.sent = 0
+        self.superseded = 0
+        self.errors = []
+        # [msg, [done]] entries in sending order, the index of the entry
+        # holding the last message queued for each key, and the length of
+        # the queue when the last message without a key was queued
+        self._queue = []
+        self._keyed = {}
+        self._barrier = 0
+        self._depth = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, key, msg, done=None):
+        """
+        Queues an ICD message.
+        
+        :param key: identifies what the message writes, it replaces an earlier message with the same key unless a message without a key was queued since. None if the message must always be sent.
+        :param msg: the ICD message
+        :param done: optional function called with the response (0 if none was received) when the message has been sent
+        """
+        if key is None:
+            self._barrier = len(self._queue) + 1
+        else:
+            i = self._keyed.get(key)
+            if i is not None and i >= self._barrier:
+                # the replaced message's done function receives the response
+                # of the message which replaced it, before its own
+                entry = self._queue[i]
+                entry[0] = msg
+                if done is not None:
+                    entry[1].append(done)
+                self.superseded += 1
+                return
+            self._keyed[key] = len(self._queue)
+        self._queue.append([msg, [] if done is None else [done]])
+
+    def _take(self):
+        entries = self._queue
+        self._queue = []
+        self._keyed = {}
+        self._barrier = 0
+        return entries
+
+    def flush(self):
+        """
+        Sends the queued messages and collects their responses.
+        
+        :returns: :obj:`boolean` True if every message succeeded
+        """
+        entries = self._take()
+        if not entries:
+            return True
+        results = usb_pipeline(self.brick.hid, [msg for msg, dones in entries])
+        errors = []
+        for (msg, dones), res in zip(entries, results):
+            if not res:
+                errors.append('%s: no valid response' % (command_str(msg[0])))
+            else:
+                code = fs_dir_status(msg, res)
+                if code:
+                    record_error(self.brick.hid, code)
+                    errors.append('%s: [%02X] %s' % (command_str(msg[0]), code, get_error_str(code)))
+            for done in dones:
+                done(res)
+        self.sent += len(entries)
+        if errors:
+            print("%d of %d batched messages failed:" % (len(errors), len(entries)))
+            for e in errors:
+                print("  %s" % (e))
+            self.errors.extend(errors)
+        return not errors
+
+    def discard(self):
+        """
+        Removes the queued messages without sending them.  Each queued
+        message's completion function is called with 0, as if no response
+        had been received, so that state updated when the message was
+        queued is invalidated.
+        """
+        for msg, dones in self._take():
+            for done in dones:
+                done(0)
+
+    def __enter__(self):
+        self._depth += 1
+        self.brick._batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # nested with blocks share the outermost batch
+        self._depth -= 1
+        if self._depth == 0:
+            self.brick._batch = None
+            if exc_type is None:
+                self.flush()
+            else:
+                self.discard()
+        return False
@@ -24,15 +24,88 @@
 
 # PFx Brick python API
 
-import hid
+import time
+import weakref
+import zlib
+from collections import OrderedDict
 from pfxbrick.pfx import *
-from pfxbrick.pfxconfig import PFxConfig
+from pfxbrick.pfxconfig import PFxConfig, read_codec
 from pfxbrick.pfxaction import PFxAction
-from pfxbrick.pfxfiles import PFxDir, PFxFile, fs_copy_file_to, fs_copy_file_from
+from pfxbrick.pfxfiles import PFxDir, PFxFile, fs_copy_file_to, fs_copy_file_from, fs_remove_file, fs_format, fs_error_check
+from pfxbrick.pfxmonitor import PFxState, STATE_SZ
+from pfxbrick.pfxirmonitor import PFxIRMessage, IR_RAW_SZ
+from pfxbrick.pfxnotify import PFxNotificationReader
+from pfxbrick.pfxbatch import PFxBatch, fs_dir_status
 from pfxbrick.pfxmsg import *
+from pfxbrick.pfxdecode import *
 from pfxbrick.pfxhelpers import *
 
 
+# Host-side copies of the configuration and event/action LUT of every
+# PFx Brick seen during this process, keyed by USB serial number.  These
+# copies are validated against the PFx Brick with the PFX_CMD_VERIFY_CONFIG
+# and PFX_CMD_VERIFY_EVENT_LUT messages before being re-used.
+_brick_cache = {}
+
+# Every PFx Brick opened during this process, used by the metrics exporter
+open_bricks = weakref.WeakSet()
+
+# Lifetimes in seconds of the PFx Brick properties which are read on demand,
+# None for properties which cannot change while a session is open
+FIELD_TTL = {
+    'product_id': None,
+    'serial_no': None,
+    'product_desc': None,
+    'firmware_ver': None,
+    'firmware_build': None,
+    'icd_rev': None,
+    'status': 1.0,
+    'error': 1.0,
+    'name': 10.0,
+}
+
+# Time in seconds after which a property which could not be read is read
+# again, if its lifetime in FIELD_TTL is longer or it never expires
+FIELD_RETRY = 1.0
+
+# Properties filled by a single PFX_CMD_GET_STATUS transaction
+STATUS_FIELDS = ('product_id', 'serial_no', 'product_desc', 'firmware_ver', 'firmware_build', 'status', 'error')
+
+
+class _PFxField:
+    """
+    Property of a :py:class:`PFxBrick` which is read from the PFx Brick when
+    first accessed, and read again once it is older than its lifetime in
+    :py:attr:`PFxBrick.field_ttl`.  Assigning a value stores it as if it
+    had just been read.  If it cannot be read, the last value (or the
+    default) is returned and it is not read again for FIELD_RETRY seconds.
+    """
+    def __init__(self, fetch, default=''):
+        self.fetch = fetch
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, brick, owner=None):
+        if brick is None:
+            return self
+        entry = brick._fields.get(self.name)
+        if brick.is_open and brick._field_expired(self.name, entry):
+            try:
+                self.fetch(brick)
+            except (OSError, ValueError) as e:
+                print("Error reading %s from PFx Brick: %s" % (self.name, str(e)))
+                brick._fetch_failed(self.name)
+            entry = brick._fields.get(self.name)
+        if entry is None:
+            return self.default
+        return entry[0]
+
+    def __set__(self, brick, value):
+        brick._fields[self.name] = (value, time.monotonic())
+
+
 def find_bricks(show_list=False):
     """
     Enumerate and optionally print a list PFx Bricks currently connected to the USB bus.
@@ -40,6 +113,7 @@ def find_bricks(show_list=False):
     :param boolean show_list: optionally print a list of enumerated PFx Bricks
     :returns: [:obj:`str`] a list of PFx Brick serial numbers
     """
+    import hid
     numBricks = 0
     serials = []
     for dev in hid.enumerate():
@@ -101,16 +175,34 @@ class PFxBrick:
         config (:obj:`PFxConfig`): child class to store configuration and settings
 
         filedir (:obj:`PFxDir`): child class to store the file system directory
+
+        preload_addresses ([:obj:`int`]): spare event/action LUT addresses used by :py:meth:`preload_action`
+
+        field_ttl ({:obj:`str`: :obj:`float`}): lifetimes in seconds of the properties read on demand, None if they never expire
+
+    The product, serial number, firmware, ICD revision, status and name
+    properties are read from the PFx Brick when they are first accessed
+    during a session and cached.  A single PFX_CMD_GET_STATUS transaction
+    fills all the status properties.  Properties which can change (status,
+    error and name) are read again when accessed after their lifetime in
+    :py:attr:`field_ttl` has passed.  Calling :py:meth:`get_status`,
+    :py:meth:`get_icd_rev` or :py:meth:`get_name` always reads them, and
+    :py:meth:`peek` returns the last value read without communicating with
+    the PFx Brick.
     """
+    product_id = _PFxField(lambda brick: brick.get_status())
+    serial_no = _PFxField(lambda brick: brick.get_status())
+    product_desc = _PFxField(lambda brick: brick.get_status())
+    firmware_ver = _PFxField(lambda brick: brick.get_status())
+    firmware_build = _PFxField(lambda brick: brick.get_status())
+    icd_rev = _PFxField(lambda brick: brick.get_icd_rev(True))
+    status = _PFxField(lambda brick: brick.get_status(), 0)
+    error = _PFxField(lambda brick: brick.get_status(), 0)
+    name = _PFxField(lambda brick: brick.get_name())
+
     def __init__(self):
-        self.product_id = ""
-        self.serial_no = ""
-        self.product_desc = ""
-        self.firmware_ver = ""
-        self.firmware_build = ""
-        self.icd_rev = ""
-        self.status = 0
-        self.error = 0
+        self._fields = {}
+        self.field_ttl = dict(FIELD_TTL)
         self.usb_vid = PFX_USB_VENDOR_ID
         self.usb_pid = PFX_USB_PRODUCT_ID
         self.usb_manu_str = ''
@@ -118,20 +210,29 @@ class PFxBrick:
         self.usb_serno_str = ''
         self.hid = None
         self.is_open = False    
-        self.name = ''
         
         self.config = PFxConfig()
         self.filedir = PFxDir()
+        self.preload_addresses = [EVT_TEST_EVENT + ch for ch in range(4)]
+        self._cache = {}
+        self._preloaded = OrderedDict()
+        self._reader = None
+        self._batch = None
         
-    def open(self, ser_no=None):
+    def open(self, ser_no=None, device=None):
         """
         Opens a USB communication session with a PFx Brick. If multiple PFx Bricks are
         connected, then a serial number must be specified to connect to a unique PFx Brick.
 
         :param ser_no: optional serial number to specify a particular PFx Brick if multiple connected
+        :param device: optional device object with the hidapi device interface to use instead of USB, e.g. a :py:class:`PFxEmulator`
         :returns: boolean indicating open session result
         """
-        if not self.is_open:
+        if not self.is_open and device is not None:
+            device.open(PFX_USB_VENDOR_ID, PFX_USB_PRODUCT_ID, ser_no)
+            self._attach(device)
+        elif not self.is_open:
+            import hid
             numBricks = 0
             serials = []
             for dev in hid.enumerate():
@@ -147,21 +248,109 @@ class PFxBrick:
                 elif numBricks > 1 and ser_no is None:
                     print("There are multiple PFx Bricks connected. Therefore a serial number is required to specify which PFx Brick to connect to.")
                 else:
-                    self.hid = hid.device()
-                    self.hid.open(PFX_USB_VENDOR_ID, PFX_USB_PRODUCT_ID, ser_no)
-                    self.usb_manu_str = self.hid.get_manufacturer_string()
-                    self.usb_prod_str = self.hid.get_product_string()
-                    self.usb_serno_str = self.hid.get_serial_number_string()
-                    self.is_open = True
+                    h = hid.device()
+                    h.open(PFX_USB_VENDOR_ID, PFX_USB_PRODUCT_ID, ser_no)
+                    self._attach(h)
         return self.is_open
+
+    def _attach(self, device):
+        self.hid = device
+        self._fields = {}
+        self.usb_manu_str = self.hid.get_manufacturer_string()
+        self.usb_prod_str = self.hid.get_product_string()
+        self.usb_serno_str = self.hid.get_serial_number_string()
+        self._cache = _brick_cache.setdefault(self.usb_serno_str, {})
+        self.is_open = True
+        open_bricks.add(self)
             
     def close(self):
         """
         Closes a USB communication session with a PFx Brick.
         """
         if self.is_open:
-            self.hid.close()
+            try:
+                self.stop_notifications()
+            except (OSError, ValueError):
+                # the device is already gone
+                pass
+            hdev = self.hid
+            # wait for a transaction in progress in another thread, which
+            # would otherwise find the device closed or the handle gone
+            with hdev_lock(hdev):
+                hdev.close()
+                self.hid = None
+                self.is_open = False
+            release_device(hdev)
+            open_bricks.discard(self)
         
+    def _send(self, key, msg, done=None):
+        # queue the message if a batch is active, otherwise perform it now
+        if self._batch is not None:
+            self._batch.add(key, msg, done)
+            return
+        res = usb_transaction(self.hid, msg)
+        if res and fs_dir_status(msg, res):
+            fs_error_check(fs_dir_status(msg, res), self.hid)
+        if done is not None:
+            done(res)
+
+    def _field_expired(self, name, entry):
+        if entry is None:
+            return True
+        ttl = self.field_ttl.get(name)
+        if len(entry) > 2:
+            # the last read failed
+            ttl = FIELD_RETRY if ttl is None else min(ttl, FIELD_RETRY)
+        return ttl is not None and time.monotonic() - entry[1] > ttl
+
+    def _fetch_failed(self, *names):
+        # keep the last value, marked so that it is read again after FIELD_RETRY
+        now = time.monotonic()
+        for name in names:
+            entry = self._fields.get(name)
+            value = entry[0] if entry is not None else getattr(type(self), name).default
+            self._fields[name] = (value, now, False)
+
+    def peek(self, name, default=None):
+        """
+        Returns the last value read of a property which is read on demand,
+        without communicating with the PFx Brick.  This is safe to call
+        when the PFx Brick has been disconnected.
+
+        :param name: :obj:`str` name of the property, e.g. 'name'
+        :param default: value returned if the property has not been read
+        :returns: the last value read, or default
+        """
+        entry = self._fields.get(name)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def expire_fields(self, *names):
+        """
+        Marks properties read on demand as stale, so that they are read from
+        the PFx Brick again when next accessed.
+
+        :param names: :obj:`str` names of the properties, e.g. 'name', or all properties if none are given
+        """
+        if not names:
+            self._fields = {}
+        for name in names:
+            self._fields.pop(name, None)
+
+    def batch(self):
+        """
+        Returns a :py:class:`PFxBatch` context manager which queues messages
+        that change the PFx Brick and sends them together when the ``with``
+        block exits, avoiding a round trip for every call.  Superseded
+        writes to the same LUT address, setting or file are dropped.
+
+        :returns: :obj:`PFxBatch` the active batch, or a new one
+        """
+        if self._batch is not None:
+            return self._batch
+        return PFxBatch(self)
+
     def get_icd_rev(self, silent=False):
         """
         Requests the version of Interface Control Document (ICD)
@@ -170,32 +359,49 @@ class PFxBrick:
         this class and also returned.
         
         :param boolean silent: flag to optionally silence the status LED blink
+        :returns: :obj:`str` ICD revision number, or None if it could not be read
         """    
         res = cmd_get_icd_rev(self.hid, silent)
-        self.icd_rev = uint16_tover(res[1], res[2])
-        return self.icd_rev
+        if res:
+            icd_rev = uint16_tover(*decode_icd_rev(res))
+            self.icd_rev = icd_rev
+            return icd_rev
+        self._fetch_failed('icd_rev')
+        return None
         
-    def get_status(self):
+    def get_status(self, max_age=None):
         """
         Requests the top level operational status of the PFx Brick
         using the PFX_CMD_GET_STATUS ICD message.  The resulting
         status data is stored in this class and can be queried
         with typical class member access methods or the print_status method.
+
+        :param max_age: :obj:`float` optional age in seconds up to which a previously read status is re-used instead of being read again
+        :returns: :obj:`boolean` True if the status was read
         """
+        if max_age is not None:
+            entry = self._fields.get('status')
+            if entry is not None and len(entry) == 2 and time.monotonic() - entry[1] <= max_age:
+                return True
         res = cmd_get_status(self.hid)
         if res:
-            self.status = res[1]
-            self.error = res[2]
-            self.product_id = uint16_tostr(res[7], res[8])
-            self.serial_no = uint32_tostr(res[9], res[10], res[11], res[12])
-            self.product_desc = bytes(res[13:37]).decode("utf-8")
-            self.firmware_ver = uint16_tover(res[37], res[38])
-            self.firmware_build = uint16_tostr(res[39], res[40])
+            status, error, pid, serno, desc, ver_major, ver_minor, build = decode_status(res)
+            self.status = status
+            self.error = error
+            self.product_id = '%04X' % (pid)
+            self.serial_no = '%08X' % (serno)
+            self.product_desc = desc.decode("utf-8")
+            self.firmware_ver = uint16_tover(ver_major, ver_minor)
+            self.firmware_build = '%04X' % (build)
+            return True
+        self._fetch_failed(*STATUS_FIELDS)
+        return False
                      
     def print_status(self):
         """
         Prints the top level operational status information retrieved
-        by a previous call to the get_status method.
+        by a previous call to the get_status method, reading it first if
+        it has not been read or has expired.
         """
         print("USB vendor ID         : %04X" % (self.usb_vid))
         print("USB product ID        : %04X" % (self.usb_pid))
@@ -207,14 +413,116 @@ class PFxBrick:
         print("Status                : %02X %s" %(self.status, get_status_str(self.status)))
         print("Errors                : %02X %s" %(self.error, get_error_str(self.error)))    
         
+    def verify_config(self):
+        """
+        Checks whether the host's cached copy of the PFx Brick configuration
+        still matches the configuration stored in the PFx Brick using the
+        PFX_CMD_VERIFY_CONFIG ICD message. The CRC32 checksum of the cached
+        copy is sent to the PFx Brick which compares it with its own.
+        
+        :returns: True if the cached copy is valid, False if it is stale or no copy has been cached
+        """
+        cached = self._cache.get('config')
+        if cached is None:
+            return False
+        res = cmd_verify_config(self.hid, zlib.crc32(bytes(cached[1:])))
+        if res:
+            return res[1] == PFX_ERR_VERIFY_PASS
+        return False
+
+    def get_current_state(self):
+        """
+        Retrieves the current operating state of the PFx Brick, i.e. the
+        motor speeds, light brightness and audio state, using the
+        PFX_CMD_GET_CURRENT_STATE ICD message.
+        
+        :returns: :obj:`PFxState` the current state, or None if it could not be read
+        """
+        res = cmd_get_current_state(self.hid)
+        if res:
+            return PFxState(time.monotonic(), bytes(res[1:1+STATE_SZ]))
+        return None
+
+    def get_last_ir_msg(self):
+        """
+        Retrieves the last IR message received by the PFx Brick using the
+        PFX_CMD_GET_LAST_IR_MSG ICD message.
+        
+        :returns: :obj:`PFxIRMessage` the last message, or None if it could not be read
+        """
+        res = cmd_get_last_ir_msg(self.hid)
+        if res:
+            return PFxIRMessage(time.monotonic(), res[1], res[2:2+IR_RAW_SZ])
+        return None
+
+    def set_notifications(self, mask):
+        """
+        Selects which events the PFx Brick reports with unsolicited
+        PFX_MSG_NOTIFICATION messages using the PFX_CMD_SET_NOTIFICATIONS
+        ICD message.
+        
+        :param mask: :obj:`int` PFX_NOTIFICATION_* bits, include PFX_NOTIFICATION_TO_USB to receive them over USB
+        :returns: :obj:`boolean` True if the brick accepted the request
+        """
+        res = cmd_set_notifications(self.hid, mask)
+        return bool(res)
+
+    def start_notifications(self, mask, callback=None):
+        """
+        Enables USB notifications and starts a background reader which
+        separates them from command responses. Notifications are passed to
+        callback from the reader thread as :py:class:`PFxNotification` objects.
+        Use :py:meth:`notification_queue` to receive them in an asyncio event loop.
+        
+        :param mask: :obj:`int` PFX_NOTIFICATION_* event bits to report
+        :param callback: optional function called with every notification
+        :returns: :obj:`PFxNotificationReader` the running reader
+        """
+        if self._reader is None:
+            self._reader = PFxNotificationReader(self.hid)
+            self._reader.start()
+        if callback is not None:
+            self._reader.subscribe(callback)
+        self.set_notifications(mask | PFX_NOTIFICATION_TO_USB)
+        return self._reader
+
+    def notification_queue(self, loop=None):
+        """
+        Returns an asyncio queue receiving every notification. 
+        :py:meth:`start_notifications` must be called first.
+        
+        :param loop: the asyncio event loop the queue belongs to, by default the running event loop
+        :returns: :obj:`asyncio.Queue` queue of :py:class:`PFxNotification`
+        """
+        return self._reader.asyncio_queue(loop)
+
+    def stop_notifications(self):
+        """
+        Disables notifications and stops the background reader.
+        """
+        if self._reader is not None:
+            try:
+                self.set_notifications(0)
+            finally:
+                self._reader.stop()
+                self._reader = None
+
     def get_config(self):
         """
         Retrieves configuration settings from the PFx Brick using 
         the PFX_CMD_GET_CONFIG ICD message. The configuration data
         is stored in the :obj:`PFxBrick.config` class member variable.
+        
+        If the configuration of this PFx Brick has been read before
+        (in this or an earlier session), the cached copy is validated
+        with :py:meth:`verify_config` and re-used if it still matches.
         """
+        if self.verify_config():
+            self.config.from_bytes(self._cache['config'])
+            return
         res = cmd_get_config(self.hid)
         if res:
+            self._cache['config'] = list(res)
             self.config.from_bytes(res)
     
     def print_config(self):
@@ -234,8 +542,27 @@ class PFxBrick:
         the configuration and written back. This ensures that any
         configuration settings which are not desired to be changed
         are left in the same state.
-        """
-        res = cmd_set_config(self.hid, self.config.to_bytes())
+        
+        Changes to the configuration are tracked against the settings last
+        read from or written to the PFx Brick.  If no setting has changed,
+        nothing is sent to the PFx Brick.  The written settings are cached
+        so that a following :py:meth:`get_config` only needs to verify them.
+        """
+        if not self.config.is_dirty():
+            return
+        msg = msg_set_config(self.config.to_bytes())
+        # the written settings in the PFX_CMD_GET_CONFIG layout, cached for
+        # re-use by get_config once the PFx Brick has accepted them
+        written = [0] + list(read_codec.encode(self.config))
+        self._cache.pop('config', None)
+        self.config.mark_clean()
+        def done(res):
+            if res:
+                self._cache['config'] = written
+            else:
+                self._cache.pop('config', None)
+                self.config.mark_dirty()
+        self._send('config', msg, done)
         
     def get_name(self):
         """
@@ -243,11 +570,15 @@ class PFxBrick:
         the PFX_CMD_GET_NAME ICD message. The name is stored in
         the name class variable as a UTF-8 string.
         
-        :returns: :obj:`str` user defined name
+        :returns: :obj:`str` user defined name, or None if it could not be read
         """
         res = cmd_get_name(self.hid)
         if res:
-            self.name = bytes(res[1:25]).decode("utf-8")
+            name = decode_name(res).decode("utf-8")
+            self.name = name
+            return name
+        self._fetch_failed('name')
+        return None
             
     def set_name(self, name):
         """
@@ -256,7 +587,10 @@ class PFxBrick:
         
         :param name: :obj:`str` new name to set (up to 24 character bytes, UTF-8)
         """
-        res = cmd_set_name(self.hid, name)
+        def done(res):
+            if res:
+                self.name = name
+        self._send('name', msg_set_name(name), done)
 
     def get_action_by_address(self, address):
         """
@@ -297,6 +631,8 @@ class PFxBrick:
             action = PFxAction()
             if res:
                 action.from_bytes(res)
+                if 'lut' in self._cache:
+                    self._cache['lut'][evtch_to_address(evtID, ch)] = list(res[:17])
             return action
         
     def set_action_by_address(self, address, action):
@@ -335,7 +671,69 @@ class PFxBrick:
             print("Requested action (id=%02X, ch=%02X) is out of range" % (evtID, ch))
             return None
         else:
-            res = cmd_set_event_action(self.hid, evtID, ch, action.to_bytes())
+            address = evtch_to_address(evtID, ch)
+            payload = action.to_bytes()
+            def done(res):
+                if res and 'lut' in self._cache:
+                    msg = [0]
+                    msg.extend(payload)
+                    self._cache['lut'][address] = msg
+                elif not res:
+                    # the slot no longer holds a known preloaded action
+                    for k, v in list(self._preloaded.items()):
+                        if v == address:
+                            del self._preloaded[k]
+            self._send(('lut', address), msg_set_event_action(evtID, ch, payload), done)
+            for k, v in list(self._preloaded.items()):
+                if v == address and k != payload:
+                    del self._preloaded[k]
+
+    def verify_event_lut(self):
+        """
+        Checks whether the host's cached copy of the event/action LUT
+        still matches the LUT stored in the PFx Brick using the
+        PFX_CMD_VERIFY_EVENT_LUT ICD message. The CRC32 checksum of the
+        cached copy is sent to the PFx Brick which compares it with its own.
+        
+        :returns: True if the cached copy is valid, False if it is stale or no copy has been cached
+        """
+        cached = self._cache.get('lut')
+        if cached is None:
+            return False
+        lut = []
+        for entry in cached:
+            lut.extend(entry[1:17])
+        res = cmd_verify_event_lut(self.hid, zlib.crc32(bytes(lut)))
+        if res:
+            return res[1] == PFX_ERR_VERIFY_PASS
+        return False
+
+    def get_event_lut(self):
+        """
+        Retrieves the complete event/action LUT from the PFx Brick.
+        
+        The LUT is read entry by entry with the PFX_CMD_GET_EVENT_ACTION
+        ICD message only if there is no cached copy or if the cached copy
+        fails validation with :py:meth:`verify_event_lut`.  Otherwise the
+        cached copy is returned at the cost of a single transaction.
+        
+        :returns: [:obj:`PFxAction`] list of actions indexed by LUT address (0 - 0x7F)
+        """
+        if not self.verify_event_lut():
+            lut = []
+            for address in range(EVT_LUT_MAX+1):
+                evt, ch = address_to_evtch(address)
+                res = cmd_get_event_action(self.hid, evt, ch)
+                if not res:
+                    return None
+                lut.append(list(res[:17]))
+            self._cache['lut'] = lut
+        actions = []
+        for entry in self._cache['lut']:
+            action = PFxAction()
+            action.from_bytes(entry)
+            actions.append(action)
+        return actions
 
     def test_action(self, action):
         """
@@ -343,10 +741,96 @@ class PFxBrick:
         used to "test" actions to see how they behave. The passed
         action is not stored in the event/action LUT.
         
-        :param action: :obj:`PFxAction` action data structure class
+        :param action: :obj:`PFxAction` action data structure class, or a pre-encoded :obj:`bytes` payload from :py:class:`PFxActionCache`
+        """
+        if isinstance(action, PFxAction):
+            action = action.to_bytes()
+        self._send(None, msg_test_action(action))
+
+    def send_event(self, evtID, ch):
+        """
+        Triggers the action stored in the event/action LUT for a particular
+        [eventID / IR channel] event using the PFX_CMD_SEND_EVENT ICD message.
+        The PFx Brick behaves as if the event had been received, e.g. from an
+        IR remote.
+        
+        :param evtID: :obj:`int` event ID LUT address component (0 - 0x20)
+        :param ch: :obj:`int` channel index LUT address component (0 - 3)
+        """
+        if ch > 3 or evtID > EVT_ID_MAX:
+            print("Requested event (id=%02X, ch=%02X) is out of range" % (evtID, ch))
+            return None
+        else:
+            self._send(None, msg_send_event(evtID, ch))
+
+    def preload_action(self, action):
+        """
+        Installs an action into a spare event/action LUT slot so that it can
+        later be triggered with a short :py:meth:`send_event` message instead
+        of sending the whole action with :py:meth:`test_action`.
+        
+        Spare slots are taken from :py:attr:`preload_addresses` (by default
+        the four channels of the EVT_ID_TEST_EVENT event).  When all slots are
+        in use, the slot of the oldest preloaded action is re-used.  An action
+        already held in a slot is not written again.
+        
+        :param action: :obj:`PFxAction` action data structure class, or a pre-encoded :obj:`bytes` payload
+        :returns: :obj:`int` LUT address of the slot holding the action
         """
-        res = cmd_test_action(self.hid, action.to_bytes())                            
+        if isinstance(action, PFxAction):
+            action = action.to_bytes()
+        else:
+            action = bytes(action)
+        if action in self._preloaded:
+            return self._preloaded[action]
+        used = set(self._preloaded.values())
+        free = [a for a in self.preload_addresses if a not in used]
+        if free:
+            address = free[0]
+        else:
+            old, address = self._preloaded.popitem(last=False)
+        lut = self._cache.get('lut')
+        if lut is None or bytes(lut[address][1:17]) != action:
+            a = PFxAction()
+            a.from_bytes(b'\0' + action)
+            self.set_action_by_address(address, a)
+        self._preloaded[action] = address
+        return address
+
+    def trigger(self, action):
+        """
+        Executes an action, using a short :py:meth:`send_event` message if the
+        action has been installed with :py:meth:`preload_action`, otherwise
+        sending the whole action with :py:meth:`test_action`.
+        
+        :param action: :obj:`PFxAction` action data structure class, or a pre-encoded :obj:`bytes` payload
+        """
+        if isinstance(action, PFxAction):
+            key = action.to_bytes()
+        else:
+            key = bytes(action)
+        address = self._preloaded.get(key)
+        if address is not None:
+            evt, ch = address_to_evtch(address)
+            self.send_event(evt, ch)
+        else:
+            self.test_action(action)                            
     
+    def get_free_space(self):
+        """
+        Reads the storage used and remaining capacity of the PFx Brick
+        file system into :obj:`PFxBrick.filedir` without reading the
+        individual file directory entries.
+
+        :returns: :obj:`boolean` True if the free space was read
+        """
+        res = cmd_get_free_space(self.hid)
+        if res:
+            self.filedir.bytesLeft, capacity = decode_free_space(res)
+            self.filedir.bytesUsed = capacity - self.filedir.bytesLeft
+            return True
+        return False
+
     def refresh_file_dir(self):
         """
         Reads the PFx Brick file system directory. This includes
@@ -354,21 +838,13 @@ class PFxBrick:
         Individual file directory entries are stored in the
         :obj:`PFxBrick.filedir.files` class variable.
         """
-        res = cmd_get_free_space(self.hid)
-        if res:
-            self.filedir.bytesLeft = uint32_toint(res[3:7])
-            capacity = uint32_toint(res[7:11])
-            self.filedir.bytesUsed = capacity - self.filedir.bytesLeft
+        self.get_free_space()
         res = cmd_get_num_files(self.hid)
         if res:
-            self.filedir.files = []
-            self.filedir.numFiles = uint16_toint(res[3:5])
-            for i in range(64):
-                res = cmd_get_dir_entry(self.hid, i+1)
-                d = PFxFile()
-                d.from_bytes(res)
-                if d.id < 0xFF:
-                    self.filedir.files.append(d)
+            self.filedir.numFiles = decode_file_count(res)
+            entries = [cmd_get_dir_entry(self.hid, i+1) for i in range(64)]
+            entries = [res for res in entries if res]
+            self.filedir.files = [d for d in PFxFile.list_from_bytes(entries) if d.id < 0xFF]
                 
     def put_file(self, fileID, fn, show_progress=True):
         """
@@ -400,6 +876,37 @@ class PFxBrick:
         """
         fs_remove_file(self.hid, fileID)
 
+    def set_file_attributes(self, fileID, attributes):
+        """
+        Sets the 16-bit attributes field of a file's directory entry.
+        
+        :param fileID: :obj:`int` the file ID of the file
+        :param attributes: :obj:`int` new attributes, e.g. PFX_SOUND_ATTR_* flags for an audio file
+        """
+        self._send(('attr', fileID), msg_set_file_attr(fileID, attributes))
+
+    def set_file_user_data(self, fileID, userData1=None, userData2=None):
+        """
+        Sets the 32-bit user defined data fields of a file's directory entry.
+        
+        :param fileID: :obj:`int` the file ID of the file
+        :param userData1: :obj:`int` optional new value of the first user data field
+        :param userData2: :obj:`int` optional new value of the second user data field
+        """
+        if userData1 is not None:
+            self._send(('user1', fileID), msg_set_file_user_data(fileID, 1, userData1))
+        if userData2 is not None:
+            self._send(('user2', fileID), msg_set_file_user_data(fileID, 2, userData2))
+
+    def rename_file(self, fileID, name):
+        """
+        Renames a file in the PFx Brick file system.
+        
+        :param fileID: :obj:`int` the file ID of the file
+        :param name: :obj:`str` new filename (up to 32 bytes, UTF-8)
+        """
+        self._send(('rename', fileID), msg_rename_file(fileID, name))
+
     def format_fs(self, quick=False):
         """
         Formats the PFx Brick file system, erasing all files.
@@ -413,5 +920,9 @@ class PFxBrick:
         Resets the PFx Brick configuration settings to factory defaults.
         """
         res = cmd_set_factory_defaults(self.hid)
+        self._cache.pop('config', None)
+        self._cache.pop('lut', None)
+        self._preloaded.clear()
+        self.config.mark_dirty()
         
         
\ No newline at end of file
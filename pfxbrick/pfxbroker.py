@@ -0,0 +1,531 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick broker daemon and client proxy device
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+from collections import deque
+
+from pfxbrick.pfx import *
+from pfxbrick.pfxmsg import usb_transaction
+
+# Frames exchanged over the socket start with a header of the operation,
+# the priority (requests) or status (replies) and a count.  The count is the
+# number of 64 byte reports for OP_TRANSACT and the payload length otherwise.
+FRAME_HDR = struct.Struct('>BBH')
+REPORT_SZ = 64
+OP_LIST = 0x4C
+OP_OPEN = 0x4F
+OP_TRANSACT = 0x54
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+PRIORITY_NORMAL = 0
+PRIORITY_EMERGENCY = 1
+
+DEFAULT_BROKER_PATH = os.environ.get('PFXBRICK_BROKER', os.path.join(tempfile.gettempdir(), 'pfxbrick-broker.sock'))
+
+
+def _recv_exact(sock, n):
+    b = bytearray()
+    while len(b) < n:
+        chunk = sock.recv(n - len(b))
+        if not chunk:
+            raise ConnectionError('PFx Brick broker connection closed')
+        b.extend(chunk)
+    return bytes(b)
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except OSError:
+        return False
+
+def send_frame(sock, op, flags, count, payload=b''):
+    sock.sendall(FRAME_HDR.pack(op, flags, count) + payload)
+
+def recv_frame(sock, reply=False):
+    op, flags, count = FRAME_HDR.unpack(_recv_exact(sock, FRAME_HDR.size))
+    # error replies carry a message rather than reports
+    reports = op == OP_TRANSACT and not (reply and flags != STATUS_OK)
+    n = count * REPORT_SZ if reports else count
+    return op, flags, count, _recv_exact(sock, n)
+
+
+class PFxBrokerRequest:
+    """
+    A batch of ICD messages from one client, performed by the broker without
+    messages of other clients in between (emergency messages excepted).
+
+    Attributes:
+        client (:obj:`int`): client connection the request belongs to
+
+        priority (:obj:`int`): PRIORITY_NORMAL or PRIORITY_EMERGENCY
+
+        reports ([:obj:`bytes`]): 64 byte ICD messages
+
+        responses ([:obj:`bytes`]): 64 byte responses, all zero where none was received
+
+        error (:obj:`str`): set if the PFx Brick could not be accessed
+    """
+    def __init__(self, client, priority, reports):
+        self.client = client
+        self.priority = priority
+        self.reports = reports
+        self.responses = []
+        self.error = None
+        self.done = threading.Event()
+
+
+class PFxBrokerScheduler:
+    """
+    Request queue of one PFx Brick.
+    
+    Emergency requests are served first in arrival order.  Other requests
+    are queued per client and served round robin, one request per client
+    in turn, so a client sending a long file transfer cannot starve other
+    clients.
+    """
+    def __init__(self):
+        self._cv = threading.Condition()
+        self._urgent = deque()
+        self._queues = {}
+        self._order = deque()
+        self._stopped = False
+
+    def put(self, req):
+        with self._cv:
+            if req.priority > PRIORITY_NORMAL:
+                self._urgent.append(req)
+            else:
+                q = self._queues.setdefault(req.client, deque())
+                if not q:
+                    self._order.append(req.client)
+                q.append(req)
+            self._cv.notify()
+
+    def get(self):
+        """
+        Waits for the next request to serve.
+
+        :returns: :obj:`PFxBrokerRequest` the request, or None once stopped
+        """
+        with self._cv:
+            while not self._urgent and not self._order and not self._stopped:
+                self._cv.wait()
+            if self._urgent:
+                return self._urgent.popleft()
+            if self._stopped:
+                return None
+            client = self._order.popleft()
+            q = self._queues[client]
+            req = q.popleft()
+            if q:
+                self._order.append(client)
+            else:
+                del self._queues[client]
+            return req
+
+    def get_urgent(self):
+        """
+        :returns: :obj:`PFxBrokerRequest` a waiting emergency request, or None
+        """
+        with self._cv:
+            if self._urgent:
+                return self._urgent.popleft()
+        return None
+
+    def pending(self):
+        """
+        :returns: :obj:`int` number of requests waiting
+        """
+        with self._cv:
+            return len(self._urgent) + sum(len(q) for q in self._queues.values())
+
+    def stop(self):
+        with self._cv:
+            self._stopped = True
+            self._cv.notify_all()
+
+
+class _PFxBrokerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        broker = self.server.broker
+        client = id(self)
+        serial = None
+        while True:
+            try:
+                op, priority, count, payload = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            if op == OP_LIST:
+                reply = json.dumps(list(broker.bricks)).encode('utf-8')
+                send_frame(self.request, OP_LIST, STATUS_OK, len(reply), reply)
+            elif op == OP_OPEN:
+                serial = payload.decode('utf-8') or None
+                if serial is None and len(broker.bricks) == 1:
+                    serial = list(broker.bricks)[0]
+                brick = broker.bricks.get(serial)
+                if brick is None:
+                    serial = None
+                    reply = b'PFx Brick not found'
+                    send_frame(self.request, OP_OPEN, STATUS_ERROR, len(reply), reply)
+                else:
+                    reply = json.dumps({
+                        'manufacturer': brick.usb_manu_str,
+                        'product': brick.usb_prod_str,
+                        'serial': brick.usb_serno_str}).encode('utf-8')
+                    send_frame(self.request, OP_OPEN, STATUS_OK, len(reply), reply)
+            elif op == OP_TRANSACT and serial is not None:
+                reports = [payload[i:i+REPORT_SZ] for i in range(0, len(payload), REPORT_SZ)]
+                req = PFxBrokerRequest(client, priority, reports)
+                broker.submit(serial, req)
+                req.done.wait()
+                if req.error is not None:
+                    reply = req.error.encode('utf-8')
+                    send_frame(self.request, OP_TRANSACT, STATUS_ERROR, len(reply), reply)
+                else:
+                    send_frame(self.request, OP_TRANSACT, STATUS_OK, len(req.responses), b''.join(req.responses))
+            else:
+                reply = b'invalid request'
+                send_frame(self.request, op, STATUS_ERROR, len(reply), reply)
+
+
+class _PFxBrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class PFxBroker:
+    """
+    Local daemon which owns PFx Bricks and shares them with client processes.
+    
+    A USB HID device can only be used safely by one :py:class:`PFxBrick`
+    session at a time.  The broker keeps one session open to each PFx Brick
+    and performs the ICD messages clients send over a Unix domain socket,
+    so that monitoring, show control and provisioning processes can use
+    the same PFx Brick without reopening it or interleaving partial
+    transactions.  Clients use a :py:class:`PFxBrokerDevice` as the
+    device of a normal :py:class:`PFxBrick` session.
+
+    Each PFx Brick has a worker thread served by a :py:class:`PFxBrokerScheduler`.
+    A request may contain several ICD messages which are performed back to
+    back.  Emergency requests are performed before any waiting request, and
+    between the messages of a request already in progress.
+
+    PFX_MSG_NOTIFICATION reports are handled in the broker process and are
+    not forwarded to clients.
+
+    Attributes:
+        path (:obj:`str`): path of the Unix domain socket
+
+        bricks ({:obj:`str`: :obj:`PFxBrick`}): PFx Brick sessions keyed by serial number
+
+        served ({:obj:`str`: :obj:`int`}): number of ICD messages performed for each PFx Brick
+    """
+    def __init__(self, serials=None, path=DEFAULT_BROKER_PATH, devices=None):
+        from pfxbrick.pfxbrick import PFxBrick, find_bricks
+        self.path = path
+        self.bricks = {}
+        self.served = {}
+        self._schedulers = {}
+        self._workers = []
+        self._server = None
+        self._thread = None
+        if devices is not None:
+            for device in devices:
+                brick = PFxBrick()
+                brick.open(device=device)
+                self.bricks[brick.usb_serno_str] = brick
+        else:
+            if serials is None:
+                serials = find_bricks()
+            for serial in serials:
+                brick = PFxBrick()
+                if brick.open(serial):
+                    self.bricks[serial] = brick
+
+    def submit(self, serial, req):
+        """
+        Queues a request for a PFx Brick.
+        
+        :param serial: :obj:`str` serial number of the PFx Brick
+        :param req: :obj:`PFxBrokerRequest` the request
+        """
+        self._schedulers[serial].put(req)
+
+    def _perform(self, serial, req):
+        hdev = self.bricks[serial].hid
+        try:
+            for report in req.reports:
+                res = usb_transaction(hdev, list(report))
+                req.responses.append(bytes(res[:REPORT_SZ]).ljust(REPORT_SZ, b'\0') if res else bytes(REPORT_SZ))
+                self.served[serial] += 1
+                if req.priority == PRIORITY_NORMAL:
+                    urgent = self._schedulers[serial].get_urgent()
+                    while urgent is not None:
+                        self._perform(serial, urgent)
+                        urgent = self._schedulers[serial].get_urgent()
+        except (OSError, ValueError) as e:
+            req.error = 'PFx Brick %s not accessible: %s' % (serial, str(e))
+        except Exception as e:
+            # keep the worker serving other requests
+            req.error = 'PFx Brick %s request failed: %s' % (serial, str(e))
+            print("Error performing PFx Brick broker request: %s" % (str(e)))
+        finally:
+            # the client is waiting for the request whatever happened
+            req.done.set()
+
+    def _run(self, serial):
+        scheduler = self._schedulers[serial]
+        req = scheduler.get()
+        while req is not None:
+            self._perform(serial, req)
+            req = scheduler.get()
+
+    def start(self):
+        """
+        Starts serving clients on the socket in background threads.
+
+        :returns: :obj:`boolean` False if another broker is already serving the socket, or the path exists and is not a socket
+        """
+        if self._server is not None:
+            return True
+        if os.path.lexists(self.path):
+            if not _is_socket(self.path):
+                print("%s exists and is not a socket" % (self.path))
+                return False
+            try:
+                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                s.connect(self.path)
+                s.close()
+                print("A PFx Brick broker is already running on %s" % (self.path))
+                return False
+            except OSError:
+                # stale socket left by a broker which did not exit cleanly
+                os.unlink(self.path)
+        for serial in self.bricks:
+            self._schedulers[serial] = PFxBrokerScheduler()
+            self.served[serial] = 0
+            t = threading.Thread(target=self._run, args=(serial,), daemon=True)
+            t.start()
+            self._workers.append(t)
+        self._server = _PFxBrokerServer(self.path, _PFxBrokerHandler)
+        self._server.broker = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self, close=True):
+        """
+        Stops serving clients and removes the socket.
+
+        :param close: :obj:`boolean` also close the PFx Brick sessions
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
+            if _is_socket(self.path):
+                os.unlink(self.path)
+        for scheduler in self._schedulers.values():
+            scheduler.stop()
+        for t in self._workers:
+            t.join()
+        self._schedulers = {}
+        self._workers = []
+        if close:
+            for brick in self.bricks.values():
+                brick.close()
+
+
+class PFxBrokerDevice:
+    """
+    Client side proxy with the hidapi device interface which performs ICD
+    messages through a :py:class:`PFxBroker`.
+    
+    Use it as the device of a :py:class:`PFxBrick` session:
+
+    .. code-block:: python
+
+      brick = PFxBrick()
+      brick.open('890F3024', device=PFxBrokerDevice())
+
+    Messages written are sent to the broker together when the first
+    response is read, so a burst of writes followed by reads is performed
+    as one request.
+
+    Attributes:
+        path (:obj:`str`): path of the broker's Unix domain socket
+
+        priority (:obj:`int`): PRIORITY_NORMAL, or PRIORITY_EMERGENCY to have messages performed ahead of other clients
+    """
+    def __init__(self, path=DEFAULT_BROKER_PATH, priority=PRIORITY_NORMAL):
+        self.path = path
+        self.priority = priority
+        self._sock = None
+        self._info = {}
+        self._pending = []
+        self._responses = deque()
+
+    def _connect(self):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(self.path)
+        except OSError:
+            self._sock.close()
+            self._sock = None
+            raise
+
+    def _request(self, op, flags, count, payload=b''):
+        if self._sock is None:
+            raise ValueError('not open')
+        send_frame(self._sock, op, flags, count, payload)
+        rop, status, count, reply = recv_frame(self._sock, reply=True)
+        if status != STATUS_OK:
+            raise OSError(reply.decode('utf-8'))
+        return count, reply
+
+    def list(self):
+        """
+        :returns: [:obj:`str`] serial numbers of the PFx Bricks owned by the broker
+        """
+        opened = self._sock is not None
+        if not opened:
+            self._connect()
+        try:
+            count, reply = self._request(OP_LIST, 0, 0)
+        finally:
+            if not opened:
+                self.close()
+        return json.loads(reply.decode('utf-8'))
+
+    def open(self, vendor_id=PFX_USB_VENDOR_ID, product_id=PFX_USB_PRODUCT_ID, serial_number=None):
+        self._connect()
+        serial = bytes(serial_number or '', 'utf-8')
+        try:
+            count, reply = self._request(OP_OPEN, 0, len(serial), serial)
+        except OSError:
+            self.close()
+            raise
+        self._info = json.loads(reply.decode('utf-8'))
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._pending = []
+        self._responses.clear()
+
+    def get_manufacturer_string(self):
+        return self._info.get('manufacturer')
+
+    def get_product_string(self):
+        return self._info.get('product')
+
+    def get_serial_number_string(self):
+        return self._info.get('serial')
+
+    def write(self, buf):
+        if self._sock is None:
+            raise ValueError('not open')
+        self._pending.append(bytes(buf[1:1+REPORT_SZ]).ljust(REPORT_SZ, b'\0'))
+        return len(buf)
+
+    def flush(self):
+        """
+        Sends the messages written so far to the broker and waits for the responses.
+        """
+        if self._pending:
+            reports, self._pending = self._pending, []
+            count, reply = self._request(OP_TRANSACT, self.priority, len(reports), b''.join(reports))
+            for i in range(count):
+                self._responses.append(reply[i*REPORT_SZ:(i+1)*REPORT_SZ])
+
+    def read(self, max_length, timeout_ms=0):
+        if not self._responses:
+            self.flush()
+        if self._responses:
+            res = self._responses.popleft()
+            if res[0] != 0:
+                return list(res[:max_length])
+        return []
+
+
+def broker_bricks(path=DEFAULT_BROKER_PATH):
+    """
+    Lists the PFx Bricks shared by a :py:class:`PFxBroker`.
+
+    :param path: :obj:`str` path of the broker's Unix domain socket
+    :returns: [:obj:`str`] serial numbers, empty if no broker is running
+    """
+    try:
+        return PFxBrokerDevice(path).list()
+    except (OSError, ValueError):
+        return []
+
+
+def main(argv=None):
+    """
+    Entry point of the pfxbrick-broker console command.
+    """
+    import argparse
+    import signal
+    parser = argparse.ArgumentParser(prog='pfxbrick-broker', description='Shares USB connected PFx Bricks with other processes over a Unix domain socket.')
+    parser.add_argument('-s', '--serial', action='append', default=None, help='serial number of a PFx Brick to share, may be repeated (default all)')
+    parser.add_argument('--socket', default=DEFAULT_BROKER_PATH, help='socket path (default %(default)s)')
+    parser.add_argument('--emulate', type=int, default=0, metavar='N', help='share N emulated PFx Bricks instead of USB')
+    args = parser.parse_args(argv)
+    devices = None
+    if args.emulate:
+        from pfxbrick.pfxemulator import PFxEmulator
+        devices = [PFxEmulator('E%07X' % (i)) for i in range(args.emulate)]
+    broker = PFxBroker(args.serial, args.socket, devices)
+    if not broker.bricks:
+        print("No PFx Bricks to share")
+        return 1
+    if not broker.start():
+        return 1
+    print("Sharing %s on %s" % (', '.join(broker.bricks), broker.path))
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    broker.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
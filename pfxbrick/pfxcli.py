@@ -0,0 +1,392 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick command line tool
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+# JSON lines are written to the real stdout, while messages printed by the
+# library go to stderr so that they cannot corrupt the output
+_out = sys.stdout
+_out_lock = threading.Lock()
+
+
+def emit(record):
+    """
+    Writes one JSON line to the output.
+    """
+    with _out_lock:
+        _out.write(json.dumps(record) + '\n')
+        _out.flush()
+
+
+def parse_int(s):
+    """
+    Parses a decimal or 0x prefixed hexadecimal integer.
+    """
+    return int(s, 0)
+
+
+def open_fleet(args):
+    """
+    Opens the PFx Bricks selected by the command line arguments.
+    
+    :returns: (:obj:`PFxFleet`, :obj:`boolean`) fleet of the open PFx Bricks and whether all of them could be opened
+    """
+    from pfxbrick.pfxbrick import PFxBrick, find_bricks
+    from pfxbrick.pfxfleet import PFxFleet
+    fleet = PFxFleet([], max_workers=args.jobs)
+    if args.emulate:
+        from pfxbrick.pfxemulator import PFxEmulator
+        for i in range(args.emulate):
+            brick = PFxBrick()
+            brick.open(device=PFxEmulator('E%07X' % (i)))
+            fleet.bricks[brick.usb_serno_str] = brick
+        return fleet, True
+    ok = True
+    if args.broker is not None:
+        from pfxbrick.pfxbroker import PFxBrokerDevice, broker_bricks
+        serials = args.serial
+        if args.all or not serials:
+            serials = broker_bricks(args.broker)
+        for serial in serials:
+            brick = PFxBrick()
+            try:
+                brick.open(serial, device=PFxBrokerDevice(args.broker))
+                fleet.bricks[serial] = brick
+            except OSError as e:
+                emit({'serial': serial, 'ok': False, 'error': str(e)})
+                ok = False
+        return fleet, ok
+    serials = args.serial
+    if args.all or not serials:
+        serials = find_bricks()
+    for serial in serials:
+        brick = PFxBrick()
+        if brick.open(serial):
+            fleet.bricks[serial] = brick
+        else:
+            emit({'serial': serial, 'ok': False, 'error': 'unable to open'})
+            ok = False
+    return fleet, ok
+
+
+def run(fleet, fn):
+    """
+    Calls fn(brick) for every PFx Brick of the fleet in parallel and emits
+    the returned dictionary of each as a JSON line.
+    
+    :returns: :obj:`boolean` True if every call succeeded
+    """
+    ok = True
+    def call(brick):
+        try:
+            record = {'serial': brick.usb_serno_str, 'ok': True}
+            record.update(fn(brick) or {})
+        except Exception as e:
+            record = {'serial': brick.usb_serno_str, 'ok': False, 'error': str(e)}
+        emit(record)
+        return record['ok']
+    for result in fleet.map(call).values():
+        ok = ok and result is True
+    return ok
+
+
+def cmd_ls(fleet, args):
+    def ls(brick):
+        return {'product': brick.usb_prod_str, 'name': brick.name.rstrip('\0')}
+    return run(fleet, ls)
+
+
+def cmd_status(fleet, args):
+    from pfxbrick.pfxhelpers import get_status_str, get_error_str
+    def status(brick):
+        if not brick.get_status():
+            raise IOError('no response to status request')
+        brick.get_free_space()
+        return {
+            'product_id': brick.product_id, 'product_desc': brick.product_desc.rstrip('\0'),
+            'serial_no': brick.serial_no, 'firmware': brick.firmware_ver, 'build': brick.firmware_build,
+            'icd_rev': brick.icd_rev, 'status': brick.status, 'status_str': get_status_str(brick.status),
+            'error': brick.error, 'error_str': get_error_str(brick.error),
+            'bytes_free': brick.filedir.bytesLeft, 'bytes_used': brick.filedir.bytesUsed}
+    return run(fleet, status)
+
+
+def cmd_config(fleet, args):
+    from pfxbrick.pfxconfig import config_values, set_config_value, write_codec
+    if args.action == 'get':
+        def get(brick):
+            brick.get_config()
+            values = config_values(brick.config)
+            if args.keys:
+                for k in args.keys:
+                    if k not in values:
+                        raise ValueError('unknown setting %s' % (k))
+                values = {k: values[k] for k in args.keys}
+            return {'config': values}
+        return run(fleet, get)
+    changes = []
+    for kv in args.keys:
+        k, sep, v = kv.partition('=')
+        if not sep:
+            print('Settings must be given as KEY=VALUE: %s' % (kv))
+            return False
+        changes.append((k, parse_int(v)))
+    def set(brick):
+        brick.get_config()
+        for k, v in changes:
+            if not set_config_value(brick.config, k, v):
+                raise ValueError('unknown setting %s' % (k))
+        # keep only what the configuration layout can hold, so the changes
+        # and values reported are those written to the PFx Brick
+        write_codec.decode(brick.config, brick.config.to_bytes())
+        changed = brick.config.dirty_fields()
+        values = config_values(brick.config)
+        brick.set_config()
+        return {'changed': changed, 'values': {k: values[k] for k, v in changes}}
+    return run(fleet, set)
+
+
+def cmd_lut(fleet, args):
+    from pfxbrick.pfxfleet import PFxSnapshot
+    if args.action == 'dump':
+        def dump(brick):
+            actions = brick.get_event_lut()
+            if actions is None:
+                raise IOError('unable to read the event/action LUT')
+            return {'lut': [a.to_bytes().hex() for a in actions]}
+        return run(fleet, dump)
+    if args.file is None:
+        print('A LUT file is required')
+        return False
+    # one LUT per line as written by lut dump, keyed by serial number.  A
+    # LUT without a serial number is loaded into every other PFx Brick.
+    luts = {}
+    with open(args.file) as f:
+        for line in f:
+            if line.strip():
+                d = json.loads(line)
+                if 'lut' in d:
+                    luts[d.get('serial')] = d
+    def load(brick):
+        entry = luts.get(brick.usb_serno_str, luts.get(None))
+        if entry is None:
+            raise LookupError('no LUT for serial number %s in %s' % (brick.usb_serno_str, args.file))
+        snap = PFxSnapshot(brick.usb_serno_str, lut=[bytes.fromhex(a) for a in entry['lut']])
+        fleet.restore(brick, snap)
+        return {}
+    return run(fleet, load)
+
+
+def file_crc32(fn):
+    crc = 0
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def cmd_put(fleet, args):
+    def put(brick):
+        brick.refresh_file_dir()
+        if brick.filedir.get_file_dir_entry(args.id) is not None:
+            brick.remove_file(args.id)
+        brick.put_file(args.id, args.file, show_progress=False)
+        return {'id': args.id, 'file': args.file}
+    return run(fleet, put)
+
+
+def cmd_get(fleet, args):
+    many = len(fleet.bricks) > 1
+    def get(brick):
+        brick.refresh_file_dir()
+        f = brick.filedir.get_file_dir_entry(args.id)
+        if f is None:
+            raise LookupError('file %d not found' % (args.id))
+        name = '%s-%s' % (brick.usb_serno_str, f.name) if many else f.name
+        fn = os.path.join(args.dir, name)
+        brick.get_file(args.id, fn, show_progress=False)
+        return {'id': args.id, 'file': fn, 'size': f.size}
+    return run(fleet, get)
+
+
+def cmd_sync(fleet, args):
+    files = {}
+    for spec in args.files:
+        fid, sep, fn = spec.partition('=')
+        if not sep:
+            print('Files must be given as ID=PATH: %s' % (spec))
+            return False
+        files[parse_int(fid)] = (fn, os.path.getsize(fn), file_crc32(fn))
+    def sync(brick):
+        brick.refresh_file_dir()
+        copied, removed = [], []
+        for fid, (fn, size, crc) in sorted(files.items()):
+            f = brick.filedir.get_file_dir_entry(fid)
+            if f is not None and f.size == size and f.crc32 == crc and f.name == os.path.basename(fn):
+                continue
+            if f is not None:
+                brick.remove_file(fid)
+            brick.put_file(fid, fn, show_progress=False)
+            copied.append(fid)
+        if args.prune:
+            for f in brick.filedir.files:
+                if f.id not in files:
+                    brick.remove_file(f.id)
+                    removed.append(f.id)
+        return {'copied': copied, 'removed': removed}
+    return run(fleet, sync)
+
+
+def cmd_backup(fleet, args):
+    def backup(brick):
+        from pfxbrick.pfxfleet import PFxSnapshot
+        fleet.snapshots[brick.usb_serno_str] = PFxSnapshot.from_brick(brick, lut=not args.no_lut)
+        return {}
+    ok = run(fleet, backup)
+    fleet.save(args.file)
+    return ok
+
+
+def cmd_restore(fleet, args):
+    from pfxbrick.pfxfleet import PFxSnapshot
+    fleet.load(args.file)
+    def restore(brick):
+        serial = args.golden if args.golden is not None else brick.usb_serno_str
+        if serial not in fleet.snapshots:
+            raise LookupError('no snapshot for %s' % (serial))
+        snap = fleet.snapshots[serial]
+        if args.golden is not None and not args.with_name:
+            # every PFx Brick keeps its own name
+            snap = PFxSnapshot(snap.serial_no, None, snap.config, snap.lut)
+        fleet.restore(brick, snap)
+        return {'from': serial}
+    return run(fleet, restore)
+
+
+def cmd_monitor(fleet, args):
+    from pfxbrick.pfxmonitor import PFxStateMonitor
+    monitors = []
+    for serial, brick in fleet.bricks.items():
+        def changed(state, previous, serial=serial):
+            emit({'serial': serial, 't': state.t, 'motor_speeds': state.motor_speeds,
+                  'light_brightness': state.light_brightness, 'volume': state.volume,
+                  'audio_files': state.audio_files})
+        monitor = PFxStateMonitor(brick, min_interval=args.interval)
+        monitor.subscribe(changed)
+        monitor.start()
+        monitors.append(monitor)
+    try:
+        if args.duration is not None:
+            time.sleep(args.duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for monitor in monitors:
+        monitor.stop()
+    return True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pfxbrick', description='Command line tool for USB connected PFx Bricks. Results are written as JSON lines.')
+    parser.add_argument('-a', '--all', action='store_true', help='use every connected PFx Brick (default if no serial numbers are given)')
+    parser.add_argument('-s', '--serial', action='append', default=[], help='serial number of a PFx Brick to use, may be repeated')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='maximum number of PFx Bricks accessed in parallel')
+    parser.add_argument('--broker', nargs='?', const='', default=None, metavar='SOCKET', help='use the PFx Bricks shared by a pfxbrick-broker daemon')
+    parser.add_argument('--emulate', type=int, default=0, metavar='N', help='use N emulated PFx Bricks instead of USB')
+    sub = parser.add_subparsers(dest='command', metavar='command')
+    sub.required = True
+
+    p = sub.add_parser('ls', help='list PFx Bricks')
+    p.set_defaults(func=cmd_ls)
+    p = sub.add_parser('status', help='show status, firmware and free space')
+    p.set_defaults(func=cmd_status)
+    p = sub.add_parser('config', help='read or change configuration settings')
+    p.add_argument('action', choices=['get', 'set'])
+    p.add_argument('keys', nargs='*', help='settings to get, or KEY=VALUE settings to set')
+    p.set_defaults(func=cmd_config)
+    p = sub.add_parser('lut', help='dump or load the event/action LUT')
+    p.add_argument('action', choices=['dump', 'load'])
+    p.add_argument('file', nargs='?', help='JSON LUT file to load, e.g. the output of lut dump')
+    p.set_defaults(func=cmd_lut)
+    p = sub.add_parser('put', help='copy a file to the PFx Bricks')
+    p.add_argument('id', type=parse_int, help='file ID')
+    p.add_argument('file', help='host file')
+    p.set_defaults(func=cmd_put)
+    p = sub.add_parser('get', help='copy a file from the PFx Bricks')
+    p.add_argument('id', type=parse_int, help='file ID')
+    p.add_argument('dir', nargs='?', default='.', help='host directory')
+    p.set_defaults(func=cmd_get)
+    p = sub.add_parser('sync', help='copy files which differ to the PFx Bricks')
+    p.add_argument('files', nargs='+', help='ID=PATH files')
+    p.add_argument('--prune', action='store_true', help='remove files which are not listed')
+    p.set_defaults(func=cmd_sync)
+    p = sub.add_parser('backup', help='save name, configuration and LUT to a JSON file')
+    p.add_argument('file')
+    p.add_argument('--no-lut', action='store_true', help='do not save the event/action LUT')
+    p.set_defaults(func=cmd_backup)
+    p = sub.add_parser('restore', help='restore from a backup JSON file')
+    p.add_argument('file')
+    p.add_argument('--golden', default=None, help='restore the configuration and LUT of every PFx Brick from the backup of this serial number')
+    p.add_argument('--with-name', action='store_true', help='with --golden, also give every PFx Brick the name of the golden PFx Brick')
+    p.set_defaults(func=cmd_restore)
+    p = sub.add_parser('monitor', help='report changes of the current state')
+    p.add_argument('--interval', type=float, default=0.05, help='polling interval in seconds')
+    p.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    p.set_defaults(func=cmd_monitor)
+    return parser
+
+
+def main(argv=None):
+    """
+    Entry point of the pfxbrick console command.
+    """
+    global _out
+    args = build_parser().parse_args(argv)
+    if args.broker == '':
+        from pfxbrick.pfxbroker import DEFAULT_BROKER_PATH
+        args.broker = DEFAULT_BROKER_PATH
+    _out = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        fleet, opened = open_fleet(args)
+        try:
+            ok = args.func(fleet, args) and opened
+        finally:
+            fleet.close()
+    finally:
+        sys.stdout = _out
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
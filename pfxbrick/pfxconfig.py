@@ -23,10 +23,13 @@
 # 
 # PFx Brick configuration data helpers
  
+import struct
 from pfxbrick.pfx import *
-import pfxbrick.pfxdict as pd
-from pfxbrick.pfxhelpers import set_with_bit
- 
+from pfxbrick.pfxhelpers import set_with_bit, lazy_import
+
+pd = lazy_import('pfxbrick.pfxdict')
+
+
 class PFxSettings:
     """
     General settings container class. A member of PFxConfig
@@ -268,112 +271,81 @@ class PFxConfig:
         self.motors = [PFxMotor(), PFxMotor(), PFxMotor(), PFxMotor()]
         self.lights = PFxLights()
         self.audio = PFxAudio()
+
+    # Changes are tracked against a snapshot of the settings encoded in the
+    # PFX_CMD_SET_CONFIG layout, so only changes which would be written to
+    # the PFx Brick count.  After from_bytes the snapshot is made from the
+    # payload read when it is first needed.
+    _snapshot = None
+    _read = None
+
+    def _clean_payload(self):
+        if self._read is not None:
+            self._snapshot = write_codec.encode(read_codec.decode(PFxConfig(), self._read))
+            self._read = None
+        return self._snapshot
+
+    def mark_clean(self, payload=None):
+        """
+        Takes a snapshot of all settings, e.g. after they were read from
+        or written to the PFx Brick.  This is done automatically by
+        :py:meth:`from_bytes` and :py:meth:`PFxBrick.set_config`.
+
+        :param payload: :obj:`bytes` the settings encoded by :py:meth:`to_bytes`, if already known
+        """
+        self._snapshot = payload if payload is not None else write_codec.encode(self)
+        self._read = None
+
+    def mark_dirty(self):
+        """
+        Discards the snapshot so that all settings are considered changed.
+        """
+        self._snapshot = None
+        self._read = None
+
+    def dirty_fields(self):
+        """
+        Returns the settings which changed since the last snapshot as
+        dotted paths, e.g. 'lights.startupBrightness' or 'motors[1].accel'.
+        Changes which are not written to the PFx Brick, e.g. bits outside
+        a setting's mask, are ignored.
+
+        :returns: [:obj:`str`] list of changed setting paths
+        """
+        old = self._clean_payload()
+        if old is None:
+            return [name for name, bits in CONFIG_FIELDS]
+        payload = write_codec.encode(self)
+        if payload == old:
+            return []
+        return [name for name, bits in CONFIG_FIELDS
+                if any((payload[offset] ^ old[offset]) & mask for offset, mask in bits)]
+
+    def is_dirty(self):
+        """
+        :returns: True if any setting changed since the last snapshot
+        """
+        old = self._clean_payload()
+        return old is None or write_codec.encode(self) != old
         
     def from_bytes(self, msg):
         """
         Converts the message string bytes read from the PFx Brick into
         the corresponding data members of this class.
         """
-        self.lights.startupBrightness[0] = msg[1]
-        self.lights.startupBrightness[1] = msg[2]
-        self.lights.startupBrightness[2] = msg[3]
-        self.lights.startupBrightness[3] = msg[4]
-        self.lights.startupBrightness[4] = msg[5]
-        self.lights.startupBrightness[5] = msg[6]
-        self.settings.notchCount = msg[7]    
-        self.settings.notchBounds[0] = msg[8]
-        self.settings.notchBounds[1] = msg[9]
-        self.settings.notchBounds[2] = msg[10]
-        self.settings.notchBounds[3] = msg[11]
-        self.settings.notchBounds[4] = msg[12]
-        self.settings.notchBounds[5] = msg[13]
-        self.settings.notchBounds[6] = msg[14]
-        self.settings.irAutoOff = msg[26]
-        self.settings.bleAutoOff = msg[27]
-        self.settings.bleMotorWhenDisconnect = msg[28]
-        self.settings.bleAdvertPower = msg[29]
-        self.settings.bleSessionPower = msg[30]
-        self.lights.startupBrightness[6] = msg[31]
-        self.lights.startupBrightness[7] = msg[32]
-        self.lights.pfBrightnessA = msg[33]
-        self.lights.pfBrightnessB = msg[34]
-        self.audio.bass = msg[35]
-        self.audio.treble = msg[36]
-        self.settings.statusLED = int(msg[37] & PFX_CFG_STATLED_MASK)
-        self.settings.volumeBeep = int(msg[37] & PFX_CFG_VOLBEEP_MASK)
-        self.settings.autoPowerDown = int(msg[37] & PFX_CFG_POWERSAVE_MASK)
-        self.settings.lockoutMode = int(msg[37] & PFX_CFG_LOCK_MODE_MASK)
-        self.audio.audioDRC = int(msg[37] & PFX_CFG_AUDIO_DRC_MASK)
-        self.motors[0].from_config_byte(msg[38])
-        self.motors[0].from_speed_bytes(msg[39:44])
-        self.motors[1].from_config_byte(msg[44])
-        self.motors[1].from_speed_bytes(msg[45:50])
-        self.motors[2].from_config_byte(msg[50])
-        self.motors[2].from_speed_bytes(msg[51:56])
-        self.motors[3].from_config_byte(msg[56])
-        self.motors[3].from_speed_bytes(msg[57:62])
-        self.audio.defaultVolume = msg[62]
-        self.lights.defaultBrightness = msg[63]
+        payload = bytes(msg[1:1 + CONFIG_PAYLOAD_SZ])
+        read_codec.decode(self, payload)
+        self._snapshot = None
+        self._read = payload
 
     def to_bytes(self):
         """
         Converts the data members of this class to the message 
         string bytes which can be sent to the PFx Brick.
+
+        :returns: :obj:`bytes` configuration data for the PFX_CMD_SET_CONFIG message
         """
-        msg = []
-        msg.append(self.settings.notchCount)  
-        msg.append(self.settings.notchBounds[0])
-        msg.append(self.settings.notchBounds[1])
-        msg.append(self.settings.notchBounds[2])
-        msg.append(self.settings.notchBounds[3])
-        msg.append(self.settings.notchBounds[4])
-        msg.append(self.settings.notchBounds[5])
-        msg.append(self.settings.notchBounds[6])
-        msg.extend([0] * 11)
-        msg.append(self.settings.irAutoOff)
-        msg.append(self.settings.bleAutoOff)
-        msg.append(self.settings.bleMotorWhenDisconnect)
-        msg.append(self.settings.bleAdvertPower)
-        msg.append(self.settings.bleSessionPower)
-        msg.append(self.audio.bass)
-        msg.append(self.audio.treble)
-        v = 0
-        if self.settings.statusLED == PFX_CFG_STATLED_OFF:
-            v |= PFX_CFG_STATLED_OFF
-        else:
-            v |= PFX_CFG_STATLED_ON
-        if self.settings.volumeBeep == PFX_CFG_VOLBEEP_ON:
-            v |= PFX_CFG_VOLBEEP_ON
-        else:
-            v |= PFX_CFG_VOLBEEP_OFF
-        v |= self.settings.autoPowerDown
-        v |= self.settings.lockoutMode
-        if self.audio.audioDRC == PFX_CFG_AUDIO_DRC_ON:
-            v |= PFX_CFG_AUDIO_DRC_ON
-        else:
-            v |= PFX_CFG_AUDIO_DRC_OFF
-        msg.append(v)
-        msg.append(self.motors[0].to_config_byte())
-        msg.extend(self.motors[0].to_speed_bytes())
-        msg.append(self.motors[1].to_config_byte())
-        msg.extend(self.motors[1].to_speed_bytes())
-        msg.append(self.motors[2].to_config_byte())
-        msg.extend(self.motors[2].to_speed_bytes())
-        msg.append(self.motors[3].to_config_byte())
-        msg.extend(self.motors[3].to_speed_bytes())
-        msg.append(self.audio.defaultVolume)
-        msg.append(self.lights.defaultBrightness)
-        msg.append(self.lights.startupBrightness[0])
-        msg.append(self.lights.startupBrightness[1])
-        msg.append(self.lights.startupBrightness[2])
-        msg.append(self.lights.startupBrightness[3])
-        msg.append(self.lights.startupBrightness[4])
-        msg.append(self.lights.startupBrightness[5])
-        msg.append(self.lights.startupBrightness[6])
-        msg.append(self.lights.startupBrightness[7])
-        msg.append(self.lights.pfBrightnessA)
-        msg.append(self.lights.pfBrightnessB)
-        return msg
+        return write_codec.encode(self)
          
     def __str__(self):
         sb = []
@@ -385,4 +357,274 @@ class PFxConfig:
             sb.append(str(motor))
         s = '\n'.join(sb)
         return s
-        
\ No newline at end of file
+
+
+# Configuration data layout.  Each entry describes one setting with its
+# byte offset in the PFX_CMD_GET_CONFIG response payload, its byte offset
+# in the PFX_CMD_SET_CONFIG message payload, its attribute path within
+# PFxConfig, an optional bit mask and whether the masked bits are a boolean.
+CONFIG_LAYOUT = [
+    (0, 53, ('lights', 'startupBrightness', 0), None, False),
+    (1, 54, ('lights', 'startupBrightness', 1), None, False),
+    (2, 55, ('lights', 'startupBrightness', 2), None, False),
+    (3, 56, ('lights', 'startupBrightness', 3), None, False),
+    (4, 57, ('lights', 'startupBrightness', 4), None, False),
+    (5, 58, ('lights', 'startupBrightness', 5), None, False),
+    (6, 0, ('settings', 'notchCount'), None, False),
+    (7, 1, ('settings', 'notchBounds', 0), None, False),
+    (8, 2, ('settings', 'notchBounds', 1), None, False),
+    (9, 3, ('settings', 'notchBounds', 2), None, False),
+    (10, 4, ('settings', 'notchBounds', 3), None, False),
+    (11, 5, ('settings', 'notchBounds', 4), None, False),
+    (12, 6, ('settings', 'notchBounds', 5), None, False),
+    (13, 7, ('settings', 'notchBounds', 6), None, False),
+    (25, 19, ('settings', 'irAutoOff'), None, False),
+    (26, 20, ('settings', 'bleAutoOff'), None, False),
+    (27, 21, ('settings', 'bleMotorWhenDisconnect'), None, False),
+    (28, 22, ('settings', 'bleAdvertPower'), None, False),
+    (29, 23, ('settings', 'bleSessionPower'), None, False),
+    (30, 59, ('lights', 'startupBrightness', 6), None, False),
+    (31, 60, ('lights', 'startupBrightness', 7), None, False),
+    (32, 61, ('lights', 'pfBrightnessA'), None, False),
+    (33, 62, ('lights', 'pfBrightnessB'), None, False),
+    (34, 24, ('audio', 'bass'), None, False),
+    (35, 25, ('audio', 'treble'), None, False),
+    (36, 26, ('settings', 'statusLED'), PFX_CFG_STATLED_MASK, False),
+    (36, 26, ('settings', 'volumeBeep'), PFX_CFG_VOLBEEP_MASK, False),
+    (36, 26, ('settings', 'autoPowerDown'), PFX_CFG_POWERSAVE_MASK, False),
+    (36, 26, ('settings', 'lockoutMode'), PFX_CFG_LOCK_MODE_MASK, False),
+    (36, 26, ('audio', 'audioDRC'), PFX_CFG_AUDIO_DRC_MASK, False),
+]
+for _i in range(4):
+    CONFIG_LAYOUT.extend([
+        (37 + 6*_i, 27 + 6*_i, ('motors', _i, 'invert'), PFX_CFG_MOTOR_INVERT, True),
+        (37 + 6*_i, 27 + 6*_i, ('motors', _i, 'torqueComp'), PFX_CFG_MOTOR_TRQCOMP, True),
+        (37 + 6*_i, 27 + 6*_i, ('motors', _i, 'tlgMode'), PFX_CFG_MOTOR_TLGMODE, True),
+        (38 + 6*_i, 28 + 6*_i, ('motors', _i, 'vmin'), None, False),
+        (39 + 6*_i, 29 + 6*_i, ('motors', _i, 'vmid'), None, False),
+        (40 + 6*_i, 30 + 6*_i, ('motors', _i, 'vmax'), None, False),
+        (41 + 6*_i, 31 + 6*_i, ('motors', _i, 'accel'), None, False),
+        (42 + 6*_i, 32 + 6*_i, ('motors', _i, 'decel'), None, False),
+    ])
+CONFIG_LAYOUT.extend([
+    (61, 51, ('audio', 'defaultVolume'), None, False),
+    (62, 52, ('lights', 'defaultBrightness'), None, False),
+])
+
+# size of the configuration payload in both directions
+CONFIG_PAYLOAD_SZ = 63
+
+
+def _config_accessors(path):
+    """
+    Builds getter and setter functions for a setting at an attribute path.
+    """
+    def parent(config):
+        obj = config
+        for p in path[:-1]:
+            if isinstance(p, int):
+                obj = obj[p]
+            else:
+                obj = getattr(obj, p)
+        return obj
+    key = path[-1]
+    if isinstance(key, int):
+        def getter(config):
+            return parent(config)[key]
+        def setter(config, value):
+            parent(config)[key] = value
+    else:
+        def getter(config):
+            return getattr(parent(config), key)
+        def setter(config, value):
+            setattr(parent(config), key, value)
+    return getter, setter
+
+
+def config_path_str(path):
+    """
+    Formats a CONFIG_LAYOUT attribute path as a dotted string, e.g. 'motors[1].accel'.
+    """
+    s = ''
+    for p in path:
+        if isinstance(p, int):
+            s += '[%d]' % (p)
+        elif s:
+            s += '.' + p
+        else:
+            s = p
+    return s
+
+
+def config_values(config):
+    """
+    Returns every setting of a configuration keyed by its dotted path.
+    
+    :param config: :obj:`PFxConfig` configuration
+    :returns: {:obj:`str`: value} dictionary of settings in CONFIG_LAYOUT order
+    """
+    values = {}
+    for e in CONFIG_LAYOUT:
+        getter, setter = _config_accessors(e[2])
+        values[config_path_str(e[2])] = getter(config)
+    return values
+
+
+def set_config_value(config, key, value):
+    """
+    Changes one setting of a configuration by its dotted path.
+    
+    :param config: :obj:`PFxConfig` configuration
+    :param key: :obj:`str` dotted path of the setting, as used by :py:func:`config_values`
+    :param value: new value, converted to :obj:`boolean` for on/off settings
+    :returns: :obj:`boolean` True if the setting exists
+    """
+    for e in CONFIG_LAYOUT:
+        if config_path_str(e[2]) == key:
+            getter, setter = _config_accessors(e[2])
+            setter(config, bool(value) if e[4] else value)
+            return True
+    return False
+
+
+def _config_expr(path):
+    """
+    Formats a CONFIG_LAYOUT attribute path as a Python expression on config.
+    """
+    s = 'config'
+    for p in path:
+        if isinstance(p, int):
+            s += '[%d]' % (p)
+        else:
+            s += '.' + p
+    return s
+
+
+class PFxConfigCodec:
+    """
+    Binary codec between :py:class:`PFxConfig` and one of the two PFx Brick
+    configuration data layouts described by CONFIG_LAYOUT.
+
+    The layout table is compiled into a single struct.Struct which unpacks
+    or packs every setting byte in one call, with reserved bytes skipped on
+    decoding and zero filled on encoding.  The settings are read and
+    assigned by an encode and a decode function generated from the table,
+    so no per-setting accessor functions are called.  The module provides the
+    instances :py:data:`read_codec` for PFX_CMD_GET_CONFIG responses and
+    :py:data:`write_codec` for PFX_CMD_SET_CONFIG messages.  Decoding the
+    output of :py:meth:`encode` with the same codec always restores the
+    same settings.
+
+    Attributes:
+        struct (:obj:`struct.Struct`): precompiled codec for one configuration payload
+    """
+    def __init__(self, column):
+        offsets = sorted(set(e[column] for e in CONFIG_LAYOUT))
+        fmt = '>'
+        pos = 0
+        for offset in offsets:
+            if offset > pos:
+                fmt += '%dx' % (offset - pos)
+            fmt += 'B'
+            pos = offset + 1
+        if pos < CONFIG_PAYLOAD_SZ:
+            fmt += '%dx' % (CONFIG_PAYLOAD_SZ - pos)
+        self.struct = struct.Struct(fmt)
+        index = {offset: i for i, offset in enumerate(offsets)}
+        # objects holding the settings are looked up once per call
+        parents = {}
+        for e in CONFIG_LAYOUT:
+            parents.setdefault(e[2][:-1], 'p%d' % (len(parents)))
+        head = ['    %s = %s' % (name, _config_expr(path)) for path, name in parents.items()]
+        slots = [[] for offset in offsets]
+        assign = []
+        for e in CONFIG_LAYOUT:
+            path, mask, boolean = e[2], e[3], e[4]
+            key = path[-1]
+            target = '%s[%d]' % (parents[path[:-1]], key) if isinstance(key, int) else '%s.%s' % (parents[path[:-1]], key)
+            v = 'v%d' % (index[e[column]])
+            if mask is None:
+                slots[index[e[column]]].append('(%s & 0xFF)' % (target))
+                assign.append('    %s = %s' % (target, v))
+            elif boolean:
+                slots[index[e[column]]].append('(%d if %s else 0)' % (mask, target))
+                assign.append('    %s = (%s & %d) != 0' % (target, v, mask))
+            else:
+                slots[index[e[column]]].append('(%s & %d)' % (target, mask))
+                assign.append('    %s = %s & %d' % (target, v, mask))
+        names = ', '.join('v%d' % (i) for i in range(len(offsets)))
+        src = ['def encode(config):'] + head
+        src.append('    return pack(%s)' % (', '.join(' | '.join(exprs) for exprs in slots)))
+        src.append('def assign(config, values):')
+        src.append('    %s, = values' % (names))
+        src.extend(head + assign)
+        namespace = {'pack': self.struct.pack}
+        exec(compile('\n'.join(src) + '\n', '<PFxConfigCodec>', 'exec'), namespace)
+        self._encode = namespace['encode']
+        self._assign = namespace['assign']
+
+    def decode(self, config, buf, offset=0):
+        """
+        Sets the settings of a :py:class:`PFxConfig` from a configuration payload.
+        
+        :param config: :obj:`PFxConfig` configuration to update
+        :param buf: configuration payload as :obj:`bytes` or a list of byte values
+        :param offset: :obj:`int` position of the payload within **buf**
+        :returns: :obj:`PFxConfig` the updated configuration
+        """
+        if not isinstance(buf, (bytes, bytearray, memoryview)):
+            buf = bytes(buf[offset:offset + CONFIG_PAYLOAD_SZ])
+            offset = 0
+        self._assign(config, self.struct.unpack_from(buf, offset))
+        return config
+
+    def encode(self, config):
+        """
+        Converts the settings of a :py:class:`PFxConfig` into a configuration payload.
+        
+        :param config: :obj:`PFxConfig` configuration to convert
+        :returns: :obj:`bytes` configuration payload
+        """
+        return self._encode(config)
+
+    def decode_many(self, buf):
+        """
+        Decodes a buffer of back-to-back configuration payloads.
+        
+        :param buf: :obj:`bytes` concatenated configuration payloads
+        :returns: [:obj:`PFxConfig`] list of decoded configurations
+        """
+        assign = self._assign
+        configs = []
+        for values in self.struct.iter_unpack(buf):
+            config = PFxConfig()
+            assign(config, values)
+            configs.append(config)
+        return configs
+
+    def encode_many(self, configs):
+        """
+        Encodes many configurations into one buffer of back-to-back payloads.
+        
+        :param configs: [:obj:`PFxConfig`] configurations to encode
+        :returns: :obj:`bytes` concatenated configuration payloads
+        """
+        return b''.join(map(self._encode, configs))
+
+
+read_codec = PFxConfigCodec(0)
+write_codec = PFxConfigCodec(1)
+
+def _config_fields():
+    fields = {}
+    for e in CONFIG_LAYOUT:
+        path = e[2]
+        name = config_path_str(path[:3] if path[0] == 'motors' else path[:2])
+        fields.setdefault(name, []).append((e[1], 0xFF if e[3] is None else e[3]))
+    order = ['settings', 'lights', 'audio'] + ['motors[%d]' % (i) for i in range(4)]
+    return sorted(fields.items(), key=lambda f: (order.index(f[0].rpartition('.')[0]), f[0]))
+
+# Settings reported by PFxConfig.dirty_fields in the order they are
+# reported, each with the (offset, mask) of its bits in the
+# PFX_CMD_SET_CONFIG payload
+CONFIG_FIELDS = _config_fields()
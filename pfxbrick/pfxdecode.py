@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick ICD response decoders
+
+import struct
+from array import array
+
+# Precompiled layouts of the fields in ICD response reports.  All multi-byte
+# fields are big endian and offsets include the leading response code byte.
+
+# PFX_CMD_GET_ICD_REV: ICD version major, minor
+ICD_REV_STRUCT = struct.Struct('>xBB')
+
+# PFX_CMD_GET_STATUS: status, error, product ID, serial number, product
+# descriptor, firmware version major, minor, firmware build
+STATUS_STRUCT = struct.Struct('>xBB4xHI24sBBH')
+
+# PFX_CMD_GET_NAME: user defined name
+NAME_STRUCT = struct.Struct('>x24s')
+
+# PFX_CMD_FILE_DIR, PFX_DIR_REQ_GET_FREE_SPACE: bytes free, capacity
+FREE_SPACE_STRUCT = struct.Struct('>3xII')
+
+# PFX_CMD_FILE_DIR, PFX_DIR_REQ_GET_FILE_COUNT: number of files
+FILE_COUNT_STRUCT = struct.Struct('>3xH')
+
+# PFX_CMD_FILE_DIR, PFX_DIR_REQ_GET_DIR_ENTRY_*: file ID, size, first
+# sector, attributes, user data 1, user data 2, CRC32, name.  Padded to the
+# full report length so that consecutive reports can be decoded together.
+DIR_ENTRY_STRUCT = struct.Struct('>3xBIHHIII32s8x')
+
+# PFX_CMD_GET_EVENT_ACTION: 16 action bytes, padded to the report length
+LUT_ENTRY_STRUCT = struct.Struct('>x16s47x')
+
+REPORT_SZ = 64
+
+
+def decode_icd_rev(res):
+    return ICD_REV_STRUCT.unpack_from(bytes(res))
+
+def decode_status(res):
+    return STATUS_STRUCT.unpack_from(bytes(res))
+
+def decode_name(res):
+    return NAME_STRUCT.unpack_from(bytes(res))[0]
+
+def decode_free_space(res):
+    return FREE_SPACE_STRUCT.unpack_from(bytes(res))
+
+def decode_file_count(res):
+    return FILE_COUNT_STRUCT.unpack_from(bytes(res))[0]
+
+def decode_dir_entry(res):
+    return DIR_ENTRY_STRUCT.unpack_from(bytes(res))
+
+def _reports(responses):
+    # join responses into one buffer of whole reports
+    buf = bytearray()
+    for res in responses:
+        b = bytes(res[:REPORT_SZ])
+        buf.extend(b)
+        buf.extend(bytes(REPORT_SZ - len(b)))
+    return buf
+
+def decode_dir_entries(responses):
+    """
+    Decodes many directory entry responses at once.
+    
+    :param responses: directory entry response reports
+    :returns: (ids, sizes, first sectors, attributes, user data 1, user data 2, CRC32s, names)
+        with an :obj:`array` for each numeric field and a list of raw name bytes
+    """
+    ids, sizes, sectors, attrs = array('B'), array('L'), array('H'), array('H')
+    ud1, ud2, crcs, names = array('L'), array('L'), array('L'), []
+    for e in DIR_ENTRY_STRUCT.iter_unpack(_reports(responses)):
+        ids.append(e[0])
+        sizes.append(e[1])
+        sectors.append(e[2])
+        attrs.append(e[3])
+        ud1.append(e[4])
+        ud2.append(e[5])
+        crcs.append(e[6])
+        names.append(e[7])
+    return ids, sizes, sectors, attrs, ud1, ud2, crcs, names
+
+def decode_lut_entries(responses):
+    """
+    Decodes many event/action LUT responses at once.
+    
+    :param responses: PFX_CMD_GET_EVENT_ACTION response reports
+    :returns: :obj:`array` of unsigned bytes holding 16 action bytes per response
+    """
+    actions = array('B')
+    for e in LUT_ENTRY_STRUCT.iter_unpack(_reports(responses)):
+        actions.frombytes(e[0])
+    return actions
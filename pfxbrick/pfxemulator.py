@@ -0,0 +1,562 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick emulator
+
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+import pfxbrick.pfx as pfx
+from pfxbrick.pfx import *
+from pfxbrick.pfxconfig import PFxConfig, read_codec, write_codec, CONFIG_PAYLOAD_SZ
+from pfxbrick.pfxdecode import STATUS_STRUCT, DIR_ENTRY_STRUCT
+from pfxbrick.pfxmonitor import STATE_SZ
+
+# product descriptor and flash size by product ID, from the PFX_*_PN,
+# PFX_*_DESC and PFX_*_FLASH_SZ constants
+products = {}
+for k, v in vars(pfx).items():
+    if k.endswith('_PN') and hasattr(pfx, k[:-3] + '_DESC'):
+        products[v] = (getattr(pfx, k[:-3] + '_DESC'), getattr(pfx, k[:-3] + '_FLASH_SZ', 0))
+
+
+class PFxClock:
+    """
+    Real time clock used by emulators to wait for their simulated timing.
+    """
+    def now(self):
+        return time.monotonic()
+
+    def sleep_until(self, t):
+        dt = t - time.monotonic()
+        if dt > 0:
+            time.sleep(dt)
+
+
+class PFxVirtualClock:
+    """
+    Virtual clock which advances instantly instead of waiting.
+    
+    Emulators using a virtual clock run as fast as the host can drive them,
+    while the clock keeps the time the real hardware would have taken.
+    Each emulator should have its own virtual clock unless the host drives
+    the emulators sharing it from a single thread.
+
+    Attributes:
+        t (:obj:`float`): current virtual time in seconds
+    """
+    def __init__(self, t=0.0):
+        self.t = t
+        self._lock = threading.Lock()
+
+    def now(self):
+        return self.t
+
+    def sleep_until(self, t):
+        with self._lock:
+            if t > self.t:
+                self.t = t
+
+
+class PFxTiming:
+    """
+    Firmware and flash memory timing model of a PFx Brick.
+
+    Attributes:
+        usb_latency (:obj:`float`): USB round trip time of one message in seconds
+
+        sector_erase (:obj:`float`): time to erase one flash sector in seconds
+
+        page_program (:obj:`float`): time to program one flash page in seconds
+
+        page_size (:obj:`int`): flash page size in bytes
+    """
+    def __init__(self, usb_latency=0.002, sector_erase=0.045, page_program=0.0008, page_size=256):
+        self.usb_latency = usb_latency
+        self.sector_erase = sector_erase
+        self.page_program = page_program
+        self.page_size = page_size
+
+
+# messages which access the flash memory and must wait while it is busy,
+# and those which are rejected with PFX_ERR_TRANSFER_BUSY_WAIT instead
+# when the emulator is set to reply busy
+_FLASH_CMDS = (PFX_CMD_FILE_OPEN, PFX_CMD_FILE_CLOSE, PFX_CMD_FILE_READ, PFX_CMD_FILE_WRITE,
+               PFX_CMD_FILE_DIR, PFX_CMD_FILE_REMOVE, PFX_CMD_FILE_FORMAT_FS)
+_BUSY_REPLY_CMDS = (PFX_CMD_FILE_OPEN, PFX_CMD_FILE_CLOSE, PFX_CMD_FILE_REMOVE, PFX_CMD_FILE_FORMAT_FS)
+
+
+class PFxEmulatedFile:
+    """
+    File stored in the emulated PFx Brick file system.
+    """
+    def __init__(self, id, name, size, firstSector, sectors):
+        self.id = id
+        self.name = name
+        self.size = size
+        self.firstSector = firstSector
+        self.sectors = sectors
+        self.attributes = 0
+        self.userData1 = 0
+        self.userData2 = 0
+        self.crc32 = 0
+        self.written = 0
+        self.data = bytearray()
+
+
+class PFxEmulator:
+    """
+    Emulated PFx Brick which behaves like a hidapi USB HID device.
+    
+    The emulator implements the ICD messages used by this package, including
+    the configuration, name, event/action LUT and file system messages, so
+    that a :py:class:`PFxBrick` can be used without hardware by passing an
+    emulator to :py:meth:`PFxBrick.open`::
+    
+        brick = PFxBrick()
+        brick.open(device=PFxEmulator())
+    
+    Without a timing model, every message is answered immediately.  With a
+    :py:class:`PFxTiming` model, every message takes the USB latency and the
+    file system messages wait for flash sector erases and page programs in
+    progress.  Files are erased when created, and programmed a page at a
+    time as data is written.  If **busy_reply** is set, file open, close,
+    remove and format messages arriving while the flash is busy are rejected
+    with PFX_ERR_TRANSFER_BUSY_WAIT rather than delayed.
+    
+    The simulated time is kept by **clock**.  The default real time clock
+    makes the emulator as slow as the hardware.  With a
+    :py:class:`PFxVirtualClock`, the emulator runs at full speed and the
+    :py:attr:`elapsed` time predicts how long the hardware would take, so
+    hundreds of emulators can be run in one process, e.g. to estimate
+    provisioning times::
+    
+        emulators = [PFxEmulator('%08X' % (i), PFX_PFXBRICK_16MB_PN, timing=PFxTiming(),
+                                 clock=PFxVirtualClock(), keep_data=False) for i in range(200)]
+        for emulator in emulators:
+            brick = PFxBrick()
+            brick.open(device=emulator)
+            brick.put_file(1, 'sounds.wav', show_progress=False)
+            brick.close()
+        print(max(emulator.elapsed for emulator in emulators))
+
+    Attributes:
+        serial_no (:obj:`str`): USB serial number, 8 hex digits
+
+        product_id (:obj:`int`): product ID, one of the PFX_*_PN values
+
+        product_desc (:obj:`str`): product descriptor for the product ID
+
+        flash_size (:obj:`int`): file system capacity in bytes for the product ID
+
+        firmware_ver (:obj:`int`): 16-bit firmware version
+
+        config (:obj:`bytearray`): configuration payload in PFX_CMD_GET_CONFIG order
+
+        name (:obj:`bytes`): user defined name
+
+        lut ([:obj:`bytearray`]): 16 action bytes for each event/action LUT address
+
+        files (:obj:`OrderedDict`): :py:class:`PFxEmulatedFile` objects by file ID
+
+        actions ([:obj:`bytes`]): actions received with PFX_CMD_TEST_ACTION
+
+        state (:obj:`bytearray`): current state payload reported by PFX_CMD_GET_CURRENT_STATE
+
+        last_ir (:obj:`bytearray`): LUT address and raw bytes of the last IR message, reported by PFX_CMD_GET_LAST_IR_MSG
+
+        timing (:obj:`PFxTiming`): timing model, None to answer immediately
+
+        clock (:obj:`PFxClock`): clock keeping the simulated time
+
+        busy_reply (:obj:`boolean`): reject messages with PFX_ERR_TRANSFER_BUSY_WAIT while the flash is busy
+
+        keep_data (:obj:`boolean`): store file contents, otherwise only sizes and CRC32s are kept and reads return zeros
+
+        connected (:obj:`boolean`): whether the emulator is plugged in, see :py:meth:`unplug`
+
+        transactions (:obj:`int`): number of messages received
+
+        busy_waits (:obj:`int`): number of messages rejected or delayed because the flash was busy
+
+        busy_time (:obj:`float`): total time messages were delayed because the flash was busy
+    """
+    def __init__(self, serial_no='00000001', product_id=PFX_PFXBRICK_4MB_PN, firmware_ver=0x0134, name='',
+                 timing=None, clock=None, busy_reply=False, keep_data=True):
+        self.serial_no = serial_no
+        self.product_id = product_id
+        self.product_desc, self.flash_size = products.get(product_id, ('PFx Brick', PFX_PFXBRICK_GENERIC_FLASH_SZ))
+        self.firmware_ver = firmware_ver
+        self.timing = timing
+        self.clock = clock if clock is not None else PFxClock()
+        self.busy_reply = busy_reply
+        self.keep_data = keep_data
+        self.is_open = False
+        self.connected = True
+        self.transactions = 0
+        self.busy_waits = 0
+        self.busy_time = 0.0
+        self._start = self.clock.now()
+        self._t = self._start
+        self._ready = self._start
+        self._out = self._start
+        self._flash_busy = self._start
+        self._page_fill = 0
+        self._responses = deque()
+        self._handlers = {
+            PFX_CMD_GET_STATUS: self._get_status,
+            PFX_CMD_GET_ICD_REV: self._get_icd_rev,
+            PFX_CMD_SET_FACTORY_DEFAULTS: self._set_factory_defaults,
+            PFX_CMD_GET_CONFIG: self._get_config,
+            PFX_CMD_SET_CONFIG: self._set_config,
+            PFX_CMD_VERIFY_CONFIG: self._verify_config,
+            PFX_CMD_GET_CURRENT_STATE: self._get_current_state,
+            PFX_CMD_GET_LAST_IR_MSG: self._get_last_ir_msg,
+            PFX_CMD_GET_NAME: self._get_name,
+            PFX_CMD_SET_NAME: self._set_name,
+            PFX_CMD_VERIFY_EVENT_LUT: self._verify_event_lut,
+            PFX_CMD_GET_EVENT_ACTION: self._get_event_action,
+            PFX_CMD_SET_EVENT_ACTION: self._set_event_action,
+            PFX_CMD_TEST_ACTION: self._test_action,
+            PFX_CMD_SEND_EVENT: self._send_event,
+            PFX_CMD_FILE_OPEN: self._file_open,
+            PFX_CMD_FILE_CLOSE: self._file_close,
+            PFX_CMD_FILE_READ: self._file_read,
+            PFX_CMD_FILE_WRITE: self._file_write,
+            PFX_CMD_FILE_DIR: self._file_dir,
+            PFX_CMD_FILE_REMOVE: self._file_remove,
+            PFX_CMD_FILE_FORMAT_FS: self._file_format,
+        }
+        self.factory_reset()
+        self.name = bytes(name, 'utf-8')
+        self.format()
+
+    @property
+    def elapsed(self):
+        """
+        :obj:`float` simulated time in seconds since the emulator was created
+        """
+        return max(self.clock.now(), self._ready) - self._start
+
+    def _flash_op(self, duration):
+        self._flash_busy = max(self._t, self._flash_busy) + duration
+
+    def _erase(self, sectors):
+        if self.timing is not None:
+            self._flash_op(sectors * self.timing.sector_erase)
+
+    def _program(self, nbytes):
+        # program the flash a page at a time as the page buffer fills
+        if self.timing is not None:
+            self._page_fill += nbytes
+            pages = self._page_fill // self.timing.page_size
+            self._page_fill -= pages * self.timing.page_size
+            if pages:
+                self._flash_op(pages * self.timing.page_program)
+
+    def _flush(self):
+        if self.timing is not None and self._page_fill:
+            self._page_fill = 0
+            self._flash_op(self.timing.page_program)
+
+    def factory_reset(self):
+        """
+        Restores the factory default configuration, name and event/action LUT.
+        """
+        self.config = bytearray(read_codec.encode(PFxConfig()))
+        self.name = b''
+        self.lut = [bytearray(16) for i in range(128)]
+        self.actions = []
+        self.state = bytearray(STATE_SZ)
+        self.last_ir = bytearray(5)
+
+    def format(self):
+        """
+        Erases the file system.
+        """
+        self.files = OrderedDict()
+        self._open_files = {}
+        self._sectors = bytearray(self.flash_size // PFX_FLASH_SECTOR_SZ)
+        self._page_fill = 0
+
+    def unplug(self):
+        """
+        Disconnects the emulator from the host like unplugging the USB cable.
+        Reads and writes fail with OSError and the emulator cannot be opened
+        until :py:meth:`plug` is called.  Messages not yet answered are lost.
+        """
+        self.connected = False
+        self._responses.clear()
+
+    def plug(self):
+        """
+        Reconnects an unplugged emulator.  The host must open it again.
+        """
+        self.connected = True
+        self.is_open = False
+
+    # hidapi device interface
+
+    def open(self, vendor_id=PFX_USB_VENDOR_ID, product_id=PFX_USB_PRODUCT_ID, serial_number=None):
+        if not self.connected:
+            raise OSError('open failed')
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self._responses.clear()
+
+    def get_manufacturer_string(self):
+        return 'Fx Bricks'
+
+    def get_product_string(self):
+        return self.product_desc
+
+    def get_serial_number_string(self):
+        return self.serial_no
+
+    def write(self, buf):
+        if not self.is_open:
+            raise ValueError('not open')
+        if not self.connected:
+            raise OSError('write error')
+        msg = bytes(buf[1:65])
+        self.transactions += 1
+        handler = self._handlers.get(msg[0])
+        res = [msg[0] | 0x80] + [0] * 63
+        if self.timing is not None:
+            # each report takes half a round trip to cross the bus, so a
+            # message written before the previous response was read
+            # overlaps with it.  Messages are processed in order.
+            self._out = max(self.clock.now(), self._out) + self.timing.usb_latency / 2
+            self._t = max(self._out, self._t)
+        else:
+            self._t = max(self.clock.now(), self._ready)
+        if self.timing is not None and msg[0] in _FLASH_CMDS and self._t < self._flash_busy:
+            self.busy_waits += 1
+            if self.busy_reply and msg[0] in _BUSY_REPLY_CMDS:
+                res[1] = PFX_ERR_TRANSFER_BUSY_WAIT
+                handler = None
+            else:
+                self.busy_time += self._flash_busy - self._t
+                self._t = self._flash_busy
+        if handler is not None:
+            handler(msg, res)
+        if self.timing is not None:
+            self._ready = max(self._t, self._ready) + self.timing.usb_latency / 2
+        else:
+            self._ready = self._t
+        self._responses.append((self._ready, res))
+        return len(buf)
+
+    def read(self, max_length, timeout_ms=0):
+        if not self.is_open:
+            raise ValueError('not open')
+        if not self.connected:
+            raise OSError('read error')
+        if self._responses:
+            ready, res = self._responses.popleft()
+            self.clock.sleep_until(ready)
+            return res[:max_length]
+        return []
+
+    # ICD message handlers
+
+    def _get_status(self, msg, res):
+        b = bytearray(64)
+        desc = bytes(self.product_desc, 'utf-8')[:24].ljust(24, b'\0')
+        STATUS_STRUCT.pack_into(b, 0, PFX_STATUS_NORMAL, PFX_ERR_NONE, self.product_id, int(self.serial_no, 16),
+                                desc, self.firmware_ver >> 8, self.firmware_ver & 0xFF, 0)
+        res[1:] = b[1:]
+
+    def _get_icd_rev(self, msg, res):
+        res[1:3] = [0x03, 0x36]
+
+    def _set_factory_defaults(self, msg, res):
+        self.factory_reset()
+
+    def _get_config(self, msg, res):
+        res[1:1+CONFIG_PAYLOAD_SZ] = self.config
+
+    def _set_config(self, msg, res):
+        config = write_codec.decode(PFxConfig(), msg[1:1+CONFIG_PAYLOAD_SZ])
+        self.config = bytearray(read_codec.encode(config))
+
+    def _verify_config(self, msg, res):
+        crc = int.from_bytes(msg[1:5], 'big')
+        res[1] = PFX_ERR_VERIFY_PASS if crc == zlib.crc32(bytes(self.config)) else PFX_ERR_VERIFY_FAIL
+
+    def _get_current_state(self, msg, res):
+        res[1:1+STATE_SZ] = self.state
+
+    def _get_last_ir_msg(self, msg, res):
+        res[1:1+len(self.last_ir)] = self.last_ir
+
+    def _get_name(self, msg, res):
+        res[1:1+len(self.name)] = self.name
+
+    def _set_name(self, msg, res):
+        self.name = msg[1:25].rstrip(b'\0')
+
+    def _verify_event_lut(self, msg, res):
+        crc = int.from_bytes(msg[1:5], 'big')
+        res[1] = PFX_ERR_VERIFY_PASS if crc == zlib.crc32(b''.join(self.lut)) else PFX_ERR_VERIFY_FAIL
+
+    def _get_event_action(self, msg, res):
+        res[1:17] = self.lut[(msg[1] << 2) | msg[2]]
+
+    def _set_event_action(self, msg, res):
+        self.lut[(msg[1] << 2) | msg[2]] = bytearray(msg[3:19])
+
+    def _test_action(self, msg, res):
+        self.actions.append(msg[1:17])
+
+    def _send_event(self, msg, res):
+        self.actions.append(bytes(self.lut[(msg[1] << 2) | msg[2]]))
+
+    def _allocate(self, size):
+        # reserve a contiguous run of free sectors
+        n = max(1, -(-size // PFX_FLASH_SECTOR_SZ))
+        run = 0
+        for i, used in enumerate(self._sectors):
+            run = 0 if used else run + 1
+            if run == n:
+                first = i - n + 1
+                self._sectors[first:i+1] = b'\1' * n
+                return first, n
+        return None, 0
+
+    def _file_open(self, msg, res):
+        fid, mode = msg[1], msg[2]
+        if mode & PFX_FILE_ACC_CREATE:
+            if fid in self.files:
+                res[1] = PFX_ERR_FILE_NOT_UNIQUE
+                return
+            size = int.from_bytes(msg[3:7], 'big')
+            first, n = self._allocate(size)
+            if first is None:
+                res[1] = PFX_ERR_FILE_SYSTEM_FULL
+                return
+            name = msg[7:39].rstrip(b'\0').decode('utf-8', 'replace')
+            self.files[fid] = PFxEmulatedFile(fid, name, size, first, n)
+            self._erase(n)
+        elif fid not in self.files:
+            res[1] = PFX_ERR_FILE_NOT_FOUND
+            return
+        self._open_files[fid] = [mode, 0]
+
+    def _file_close(self, msg, res):
+        fid = msg[1]
+        handle = self._open_files.pop(fid, None)
+        if handle is None:
+            res[1] = PFX_ERR_FILE_INVALID
+            return
+        f = self.files[fid]
+        if handle[0] & PFX_FILE_ACC_WRITE:
+            f.size = f.written
+            self._flush()
+
+    def _file_write(self, msg, res):
+        fid, n = msg[1], msg[2]
+        handle = self._open_files.get(fid)
+        if handle is None or not handle[0] & PFX_FILE_ACC_WRITE:
+            res[1] = PFX_ERR_FILE_ACCESS_DENIED
+            return
+        f = self.files[fid]
+        if f.written + n > f.sectors * PFX_FLASH_SECTOR_SZ:
+            res[1] = PFX_ERR_FILE_TOO_BIG
+            return
+        data = msg[3:3+n]
+        if self.keep_data:
+            f.data.extend(data)
+        f.crc32 = zlib.crc32(data, f.crc32)
+        f.written += n
+        self._program(n)
+        res[1] = n
+
+    def _file_read(self, msg, res):
+        fid, n = msg[1], min(msg[2], 62)
+        handle = self._open_files.get(fid)
+        if handle is None or not handle[0] & PFX_FILE_ACC_READ:
+            res[1] = PFX_ERR_FILE_ACCESS_DENIED
+            return
+        f = self.files[fid]
+        if self.keep_data:
+            data = f.data[handle[1]:handle[1]+n]
+        else:
+            data = bytes(max(0, min(n, f.size - handle[1])))
+        handle[1] += len(data)
+        res[1] = len(data)
+        res[2:2+len(data)] = data
+
+    def _dir_entry(self, f, res):
+        b = bytearray(64)
+        if f is None:
+            b[3] = 0xFF
+        else:
+            DIR_ENTRY_STRUCT.pack_into(b, 0, f.id, f.size, f.firstSector, f.attributes, f.userData1,
+                                       f.userData2, f.crc32, bytes(f.name, 'utf-8')[:32])
+        res[3:] = b[3:]
+
+    def _file_dir(self, msg, res):
+        req = msg[1]
+        res[1] = req
+        if req == PFX_DIR_REQ_GET_FILE_COUNT:
+            res[3:5] = len(self.files).to_bytes(2, 'big')
+        elif req == PFX_DIR_REQ_GET_FREE_SPACE:
+            free = self._sectors.count(0) * PFX_FLASH_SECTOR_SZ
+            res[3:7] = free.to_bytes(4, 'big')
+            res[7:11] = self.flash_size.to_bytes(4, 'big')
+        elif req == PFX_DIR_REQ_GET_DIR_ENTRY_IDX:
+            files = list(self.files.values())
+            idx = msg[2] - 1
+            self._dir_entry(files[idx] if 0 <= idx < len(files) else None, res)
+        elif req == PFX_DIR_REQ_GET_DIR_ENTRY_ID:
+            self._dir_entry(self.files.get(msg[2]), res)
+        elif req in (PFX_DIR_REQ_SET_ATTR_ID, PFX_DIR_REQ_SET_USER_DATA1_ID, PFX_DIR_REQ_SET_USER_DATA2_ID, PFX_DIR_REQ_RENAME_FILE_ID):
+            f = self.files.get(msg[2])
+            if f is None:
+                res[2] = PFX_ERR_FILE_NOT_FOUND
+            elif req == PFX_DIR_REQ_SET_ATTR_ID:
+                f.attributes = int.from_bytes(msg[3:5], 'big')
+            elif req == PFX_DIR_REQ_SET_USER_DATA1_ID:
+                f.userData1 = int.from_bytes(msg[3:7], 'big')
+            elif req == PFX_DIR_REQ_SET_USER_DATA2_ID:
+                f.userData2 = int.from_bytes(msg[3:7], 'big')
+            else:
+                f.name = msg[3:35].rstrip(b'\0').decode('utf-8', 'replace')
+
+    def _file_remove(self, msg, res):
+        f = self.files.pop(msg[1], None)
+        if f is None:
+            res[1] = PFX_ERR_FILE_NOT_FOUND
+            return
+        self._sectors[f.firstSector:f.firstSector+f.sectors] = bytes(f.sectors)
+
+    def _file_format(self, msg, res):
+        if msg[4]:
+            self._erase(len(self._sectors))
+        else:
+            self._erase(self._sectors.count(1))
+        self.format()
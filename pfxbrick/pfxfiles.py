@@ -23,25 +23,50 @@
 #
 # PFx Brick file system helpers
 
-import hid
 import os
 from pfxbrick.pfx import *
 from pfxbrick.pfxhelpers import *
-from pfxbrick.pfxmsg import usb_transaction
+from pfxbrick.pfxmsg import usb_transaction, record_error
+from pfxbrick.pfxdecode import decode_dir_entry, decode_dir_entries
 
-def fs_error_check(res):
+def fs_error_check(res, hdev=None):
     """
     Convenience error status lookup function used by other file system functions.
     
     :param res: result status code byte returned by almost all file system ICD messages
+    :param hdev: optional USB HID session handle the error is counted against
     :returns: True if there is an error, False on success
     """
     if res > 62:
+        if hdev is not None:
+            record_error(hdev, res)
         print("File system error: [%02X] %s" % (res, get_error_str(res)))
         return True
     else:
         return False
 
+# Number of times a file system message is repeated while the PFx Brick
+# replies PFX_ERR_TRANSFER_BUSY_WAIT because its flash memory is busy.
+# This allows about a minute for a complete format to finish.
+FS_BUSY_RETRIES = 30000
+
+def fs_transaction(hdev, msg):
+    """
+    Sends a file system ICD message, repeating it while the PFx Brick is busy.
+    
+    :param hdev: USB HID session handle
+    :param msg: the ICD message
+    :returns: the response report
+    """
+    res = usb_transaction(hdev, msg)
+    retries = 0
+    while res and res[1] == PFX_ERR_TRANSFER_BUSY_WAIT and retries < FS_BUSY_RETRIES:
+        res = usb_transaction(hdev, msg)
+        retries += 1
+    if res and res[1] == PFX_ERR_TRANSFER_BUSY_WAIT:
+        print("File system error: [%02X] %s" % (res[1], get_error_str(res[1])))
+    return res
+
 def fs_format(hdev, quick=False):
     """
     Sends an ICD message to format the PFx Brick file system.
@@ -54,8 +79,8 @@ def fs_format(hdev, quick=False):
         msg.append(0)
     else:
         msg.append(1)
-    res = usb_transaction(hdev, msg)
-    fs_error_check(res[1])
+    res = fs_transaction(hdev, msg)
+    fs_error_check(res[1], hdev)
 
 def fs_remove_file(hdev, fid):
     """
@@ -66,8 +91,8 @@ def fs_remove_file(hdev, fid):
     """
     msg = [PFX_CMD_FILE_REMOVE]
     msg.append(fid)
-    res = usb_transaction(hdev, msg)
-    fs_error_check(res[1])
+    res = fs_transaction(hdev, msg)
+    fs_error_check(res[1], hdev)
 
 def fs_copy_file_to(hdev, fid, fn, show_progress=True):
     """
@@ -96,10 +121,10 @@ def fs_copy_file_to(hdev, fid, fn, show_progress=True):
             msg.append(b)
         for i in range(32-len(nd)):
             msg.append(0)
-        res = usb_transaction(hdev, msg)
+        res = fs_transaction(hdev, msg)
         
         if res:
-            if not fs_error_check(res[1]):
+            if not fs_error_check(res[1], hdev):
                 f = open(fn, 'rb')
                 nCount = 0
                 err = False
@@ -114,14 +139,14 @@ def fs_copy_file_to(hdev, fid, fn, show_progress=True):
                         for b in buf:
                             msg.append(b)
                         res = usb_transaction(hdev, msg)
-                        err = fs_error_check(res[1])
+                        err = fs_error_check(res[1], hdev)
                         if show_progress:
                             printProgressBar(nCount, nBytes, prefix = 'Copying:', suffix = 'Complete', length = 50)
                 f.close()
                 msg = [PFX_CMD_FILE_CLOSE]
                 msg.append(fid)
-                res = usb_transaction(hdev, msg)
-                fs_error_check(res[1])
+                res = fs_transaction(hdev, msg)
+                fs_error_check(res[1], hdev)
 
 def fs_copy_file_from(hdev, pfile, fn=None, show_progress=True):
     """
@@ -141,9 +166,9 @@ def fs_copy_file_from(hdev, pfile, fn=None, show_progress=True):
     msg = [PFX_CMD_FILE_OPEN]
     msg.append(pfile.id)
     msg.append(0x01) # READ mode
-    res = usb_transaction(hdev, msg)
+    res = fs_transaction(hdev, msg)
     if res:
-        if not fs_error_check(res[1]):
+        if not fs_error_check(res[1], hdev):
             nf = pfile.name
             if fn is not None:
                 nf = fn
@@ -158,7 +183,7 @@ def fs_copy_file_from(hdev, pfile, fn=None, show_progress=True):
                     nToRead = 62
                 msg.append(nToRead)
                 res = usb_transaction(hdev, msg)
-                err = fs_error_check(res[1])
+                err = fs_error_check(res[1], hdev)
                 if not err:
                     nCount += res[1]
                     b = bytes(res[2:2+res[1]])
@@ -168,8 +193,8 @@ def fs_copy_file_from(hdev, pfile, fn=None, show_progress=True):
             f.close()
             msg = [PFX_CMD_FILE_CLOSE]
             msg.append(pfile.id)
-            res = usb_transaction(hdev, msg)
-            fs_error_check(res[1])
+            res = fs_transaction(hdev, msg)
+            fs_error_check(res[1], hdev)
 
 class PFxFile:
     """
@@ -220,15 +245,35 @@ class PFxFile:
         Converts the message string bytes read from the PFx Brick into
         the corresponding data members of this class.
         """
-        self.id = msg[3]
-        self.size = uint32_toint(msg[4:8])
-        self.firstSector = uint16_toint(msg[8:10])
-        self.attributes = uint16_toint(msg[10:12])
-        self.userData1 = uint32_toint(msg[12:16])
-        self.userData2 = uint32_toint(msg[16:20])
-        self.crc32 = uint32_toint(msg[20:24])
-        sn = bytes(msg[24:56]).decode("utf-8")
-        self.name = sn.rstrip('\0')
+        self.set_fields(*decode_dir_entry(msg))
+
+    def set_fields(self, id, size, firstSector, attributes, userData1, userData2, crc32, name):
+        """
+        Sets the data members of this class from decoded directory entry fields.
+        """
+        self.id = id
+        self.size = size
+        self.firstSector = firstSector
+        self.attributes = attributes
+        self.userData1 = userData1
+        self.userData2 = userData2
+        self.crc32 = crc32
+        self.name = name.decode("utf-8").rstrip('\0')
+
+    @staticmethod
+    def list_from_bytes(responses):
+        """
+        Converts many directory entry messages read from the PFx Brick at once.
+
+        :param responses: directory entry response messages
+        :returns: [:obj:`PFxFile`] a directory entry for each message
+        """
+        files = []
+        for fields in zip(*decode_dir_entries(responses)):
+            f = PFxFile()
+            f.set_fields(*fields)
+            files.append(f)
+        return files
         
     def __str__(self):
         """
@@ -0,0 +1,348 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick fleet snapshot, diff and staged rollout
+
+import copy
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pfxbrick.pfx import *
+from pfxbrick.pfxbrick import PFxBrick, find_bricks
+from pfxbrick.pfxaction import PFxAction
+from pfxbrick.pfxconfig import PFxConfig, write_codec, config_values
+
+
+class PFxSnapshot:
+    """
+    Stored state of one PFx Brick.
+
+    Attributes:
+        serial_no (:obj:`str`): USB serial number of the PFx Brick
+
+        name (:obj:`str`): user defined name, None if not captured
+
+        config (:obj:`PFxConfig`): configuration settings, None if not captured
+
+        lut ([:obj:`bytes`]): 16 byte actions of the event/action LUT indexed by address, None if not captured
+    """
+    def __init__(self, serial_no='', name=None, config=None, lut=None):
+        self.serial_no = serial_no
+        self.name = name
+        self.config = config
+        self.lut = lut
+
+    @staticmethod
+    def from_brick(brick, lut=True):
+        """
+        Captures a snapshot from an open PFx Brick.
+        
+        :param brick: :obj:`PFxBrick` an open PFx Brick session
+        :param lut: :obj:`boolean` also capture the event/action LUT
+        :returns: :obj:`PFxSnapshot` the captured state
+        """
+        name = brick.get_name()
+        if name is not None:
+            name = name.rstrip('\0')
+        brick.get_config()
+        snap = PFxSnapshot(brick.usb_serno_str, name, copy.deepcopy(brick.config))
+        if lut:
+            actions = brick.get_event_lut()
+            if actions is not None:
+                snap.lut = [a.to_bytes() for a in actions]
+        return snap
+
+    def to_dict(self):
+        """
+        :returns: JSON compatible :obj:`dict` representation of the snapshot
+        """
+        d = {'serial_no': self.serial_no, 'name': self.name}
+        d['config'] = write_codec.encode(self.config).hex() if self.config is not None else None
+        d['lut'] = [a.hex() for a in self.lut] if self.lut is not None else None
+        return d
+
+    @staticmethod
+    def from_dict(d):
+        """
+        :param d: :obj:`dict` representation created with :py:meth:`to_dict`
+        :returns: :obj:`PFxSnapshot` the restored snapshot
+        """
+        snap = PFxSnapshot(d['serial_no'], d.get('name'))
+        if d.get('config') is not None:
+            snap.config = write_codec.decode(PFxConfig(), bytes.fromhex(d['config']))
+        if d.get('lut') is not None:
+            snap.lut = [bytes.fromhex(a) for a in d['lut']]
+        return snap
+
+
+def snapshot_diff(a, b):
+    """
+    Compares two snapshots field by field.  Parts which were not captured
+    in either snapshot (e.g. a golden profile with only a configuration)
+    are not compared.
+    
+    :param a: :obj:`PFxSnapshot` first snapshot
+    :param b: :obj:`PFxSnapshot` second snapshot, e.g. a golden profile
+    :returns: [(:obj:`str`, value, value)] list of (field, value in a, value in b) for every difference
+    """
+    diffs = []
+    if a.name is not None and b.name is not None and a.name != b.name:
+        diffs.append(('name', a.name, b.name))
+    if a.config is not None and b.config is not None:
+        va = config_values(a.config)
+        vb = config_values(b.config)
+        for k in va:
+            if va[k] != vb[k]:
+                diffs.append(('config.' + k, va[k], vb[k]))
+    if a.lut is not None and b.lut is not None:
+        for address, (x, y) in enumerate(zip(a.lut, b.lut)):
+            if x != y:
+                diffs.append(('lut[%02X]' % (address), x.hex(), y.hex()))
+    return diffs
+
+
+class PFxRolloutResult:
+    """
+    Outcome of a :py:meth:`PFxFleet.rollout`.
+
+    Attributes:
+        updated ([:obj:`str`]): serial numbers of PFx Bricks which were changed and verified
+
+        failed ([:obj:`str`]): serial numbers of PFx Bricks which failed to update or verify
+
+        rolled_back ([:obj:`str`]): serial numbers of PFx Bricks restored to their previous state
+
+        ok (:obj:`boolean`): True if every PFx Brick was updated
+    """
+    def __init__(self):
+        self.updated = []
+        self.failed = []
+        self.rolled_back = []
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __str__(self):
+        s = '%d updated, %d failed, %d rolled back' % (len(self.updated), len(self.failed), len(self.rolled_back))
+        return s
+
+
+class PFxFleet:
+    """
+    A group of USB connected PFx Bricks managed together.
+    
+    All operations run in parallel across the PFx Bricks, with at most
+    **max_workers** PFx Bricks being accessed at the same time.  An example
+    of rolling out a configuration change is as follows::
+    
+        fleet = PFxFleet()
+        fleet.snapshot()
+        fleet.save('fleet.json')
+        
+        def quiet(brick):
+            brick.config.settings.volumeBeep = PFX_CFG_VOLBEEP_OFF
+        
+        print(fleet.rollout(quiet, canary=1, batch_size=4))
+
+    Attributes:
+        bricks ({:obj:`str`: :obj:`PFxBrick`}): open PFx Brick sessions keyed by serial number
+
+        snapshots ({:obj:`str`: :obj:`PFxSnapshot`}): latest snapshots keyed by serial number
+
+        max_workers (:obj:`int`): maximum number of PFx Bricks accessed in parallel
+    """
+    def __init__(self, serials=None, max_workers=8):
+        if serials is None:
+            serials = find_bricks()
+        self.max_workers = max_workers
+        self.bricks = {}
+        self.snapshots = {}
+        for serial in serials:
+            brick = PFxBrick()
+            if brick.open(serial):
+                self.bricks[serial] = brick
+
+    def close(self):
+        """
+        Closes the sessions to all PFx Bricks of the fleet.
+        """
+        for brick in self.bricks.values():
+            brick.close()
+
+    def map(self, fn, serials=None):
+        """
+        Calls a function for PFx Bricks of the fleet in parallel.
+        
+        :param fn: function called with a :obj:`PFxBrick`
+        :param serials: [:obj:`str`] optional serial numbers to limit the call to
+        :returns: {:obj:`str`: result} results keyed by serial number, exceptions are returned as results
+        """
+        if serials is None:
+            serials = list(self.bricks)
+        def call(serial):
+            try:
+                return fn(self.bricks[serial])
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(call, serials))
+        return dict(zip(serials, results))
+
+    def snapshot(self, lut=True):
+        """
+        Captures the name, configuration and (optionally) event/action LUT of
+        every PFx Brick in parallel.
+        
+        :param lut: :obj:`boolean` also capture the event/action LUTs
+        :returns: {:obj:`str`: :obj:`PFxSnapshot`} snapshots keyed by serial number
+        """
+        results = self.map(lambda brick: PFxSnapshot.from_brick(brick, lut))
+        for serial, snap in results.items():
+            if isinstance(snap, PFxSnapshot):
+                self.snapshots[serial] = snap
+            else:
+                print("Unable to snapshot PFx Brick %s: %s" % (serial, str(snap)))
+        return self.snapshots
+
+    def save(self, fn):
+        """
+        Saves the snapshots to a JSON file.
+        
+        :param fn: :obj:`str` filename
+        """
+        with open(fn, 'w') as f:
+            json.dump({k: v.to_dict() for k, v in self.snapshots.items()}, f, indent=2)
+
+    def load(self, fn):
+        """
+        Loads snapshots from a JSON file created with :py:meth:`save`.
+        
+        :param fn: :obj:`str` filename
+        :returns: {:obj:`str`: :obj:`PFxSnapshot`} snapshots keyed by serial number
+        """
+        with open(fn) as f:
+            d = json.load(f)
+        self.snapshots = {k: PFxSnapshot.from_dict(v) for k, v in d.items()}
+        return self.snapshots
+
+    def diff(self, golden):
+        """
+        Compares every snapshot against a golden profile.
+        
+        :param golden: :obj:`PFxSnapshot` golden profile, or the serial number of a PFx Brick in the fleet
+        :returns: {:obj:`str`: [(:obj:`str`, value, value)]} differences keyed by serial number, PFx Bricks without differences are omitted
+        """
+        if not isinstance(golden, PFxSnapshot):
+            golden = self.snapshots[golden]
+        diffs = {}
+        for serial, snap in self.snapshots.items():
+            d = snapshot_diff(snap, golden)
+            if d:
+                diffs[serial] = d
+        return diffs
+
+    def restore(self, brick, snap):
+        """
+        Restores a PFx Brick to the state of a snapshot, writing only the
+        parts which differ.
+        
+        :param brick: :obj:`PFxBrick` an open PFx Brick session
+        :param snap: :obj:`PFxSnapshot` the state to restore
+        """
+        if snap.name is not None:
+            name = brick.get_name()
+            if name is None or name.rstrip('\0') != snap.name:
+                brick.set_name(snap.name)
+        if snap.config is not None:
+            brick.get_config()
+            if bytes(brick.config.to_bytes()) != bytes(snap.config.to_bytes()):
+                brick.config = copy.deepcopy(snap.config)
+                brick.config.mark_dirty()
+                brick.set_config()
+        if snap.lut is not None:
+            current = brick.get_event_lut()
+            for address, payload in enumerate(snap.lut):
+                if current is None or current[address].to_bytes() != payload:
+                    a = PFxAction()
+                    a.from_bytes(b'\0' + payload)
+                    brick.set_action_by_address(address, a)
+
+    def _verify(self, brick, expected):
+        actual = PFxSnapshot.from_brick(brick, lut=expected.lut is not None)
+        return not snapshot_diff(actual, expected)
+
+    def rollout(self, change, canary=1, batch_size=4, serials=None):
+        """
+        Applies a change to PFx Bricks of the fleet in waves.
+        
+        The first wave contains **canary** PFx Bricks and following waves
+        contain up to **batch_size** PFx Bricks, each wave running in parallel.
+        For every PFx Brick, the current state is captured, **change** is called
+        to modify :py:attr:`PFxBrick.config` (and optionally make other
+        changes), the configuration is written and the result is verified by
+        reading it back.  If any PFx Brick of a wave fails, every PFx Brick
+        changed so far is restored to its captured state and no further
+        waves are started.
+        
+        :param change: function called with a :obj:`PFxBrick` after its configuration has been read
+        :param canary: :obj:`int` number of PFx Bricks in the first wave
+        :param batch_size: :obj:`int` number of PFx Bricks in each following wave
+        :param serials: [:obj:`str`] optional serial numbers to limit the rollout to
+        :returns: :obj:`PFxRolloutResult` outcome of the rollout
+        """
+        if serials is None:
+            serials = list(self.bricks)
+        waves = []
+        if canary > 0:
+            waves.append(serials[:canary])
+        rest = serials[max(canary, 0):]
+        for i in range(0, len(rest), batch_size):
+            waves.append(rest[i:i+batch_size])
+
+        result = PFxRolloutResult()
+        before = {}
+        def update(brick):
+            snap = PFxSnapshot.from_brick(brick, lut=False)
+            before[snap.serial_no] = snap
+            change(brick)
+            expected = PFxSnapshot(snap.serial_no, None, copy.deepcopy(brick.config))
+            brick.set_config()
+            name = brick.peek('name', '').rstrip('\0')
+            if name != snap.name:
+                expected.name = name
+            return self._verify(brick, expected)
+
+        for wave in waves:
+            results = self.map(update, wave)
+            for serial in wave:
+                if results[serial] is True:
+                    result.updated.append(serial)
+                else:
+                    result.failed.append(serial)
+            if result.failed:
+                touched = [s for s in result.updated + result.failed if s in before]
+                self.map(lambda brick: self.restore(brick, before[brick.usb_serno_str]), touched)
+                result.rolled_back = touched
+                result.updated = []
+                break
+        return result
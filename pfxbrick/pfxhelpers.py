@@ -23,10 +23,41 @@
 #
 # PFx Brick data helpers
 
-import pfxbrick.pfxdict as pd
+import importlib
+import sys
+from bisect import bisect_right
 from pfxbrick.pfx import *
 
 
+class _LazyModule:
+    # importlib.util.LazyLoader is not thread safe before Python 3.12, so the
+    # module is imported under the import system's own locking on first use
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = importlib.import_module(self._name)
+            self._module = module
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % (self._name)
+
+
+def lazy_import(name):
+    """
+    Imports a module which is only loaded when one of its attributes is first used.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
+
+pd = lazy_import('pfxbrick.pfxdict')
+
+
 def set_with_bit(byte, mask):
     if (byte & mask) == mask:
         return True
@@ -74,7 +105,7 @@ def uint16_tover(msb, lsb):
     res = '%02X.%02X' % (msb, lsb)
     return res
     
-def motor_ch_str(x):
+def _motor_ch_str(x):
     s = []
     if x & EVT_MOTOR_OUTPUT_MASK:
         s.append('Motor Ch ')
@@ -89,7 +120,7 @@ def motor_ch_str(x):
     s = ''.join(s)
     return s
 
-def light_ch_str(x):
+def _light_ch_str(x):
     s = []
     if x:
         s.append('Ch')
@@ -102,14 +133,36 @@ def light_ch_str(x):
     s = ' '.join(s)
     return s
 
+# Channel strings for every possible channel mask byte and the mask bit of
+# each light channel, precomputed since they are used by every action
+# builder and PFxAction string conversion
+_MOTOR_CH_STR = tuple(_motor_ch_str(x) for x in range(256))
+_LIGHT_CH_STR = tuple(_light_ch_str(x) for x in range(256))
+_CH_MASK = (None,) + tuple(1 << i for i in range(8))
+
+def motor_ch_str(x):
+    return _MOTOR_CH_STR[x & 0xFF]
+
+def light_ch_str(x):
+    return _LIGHT_CH_STR[x & 0xFF]
+
 def ch_to_mask(ch):
     mask = 0
     for c in ch:
-        if c < 1 or c > 8:
-            print("Channel out of range")
+        if 1 <= c <= 8:
+            mask |= _CH_MASK[c]
         else:
-            mask = mask | (1 << (c-1))
+            print("Channel out of range")
     return mask
+
+def motor_ch_strs(xs):
+    return [_MOTOR_CH_STR[x & 0xFF] for x in xs]
+
+def light_ch_strs(xs):
+    return [_LIGHT_CH_STR[x & 0xFF] for x in xs]
+
+def ch_to_masks(chs):
+    return [ch_to_mask(ch) for ch in chs]
     
 
 def address_to_evtch(address):
@@ -122,40 +175,20 @@ def evtch_to_address(evt, ch):
     address |= (evt << 2) & EVT_EVENT_ID_MASK
     return address
     
+# Fixed duration thresholds: durations shorter than _DURATION_LIMITS[i]
+# (and not shorter than the previous limit) map to _DURATION_VALUES[i]
+_DURATION_LIMITS = (1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 300.0)
+_DURATION_VALUES = (EVT_SOUND_DUR_500MS, EVT_SOUND_DUR_1S, EVT_SOUND_DUR_1_5S,
+    EVT_SOUND_DUR_2S, EVT_SOUND_DUR_3S, EVT_SOUND_DUR_4S, EVT_SOUND_DUR_5S,
+    EVT_SOUND_DUR_10S, EVT_SOUND_DUR_15S, EVT_SOUND_DUR_20S, EVT_SOUND_DUR_30S,
+    EVT_SOUND_DUR_45S, EVT_SOUND_DUR_60S, EVT_SOUND_DUR_90S, EVT_SOUND_DUR_2M,
+    EVT_SOUND_DUR_5M)
+
 def duration_to_fixed_value(duration):
-    x = float(duration)
-    if x < 1.0:
-        return EVT_SOUND_DUR_500MS
-    elif x < 1.5:
-        return EVT_SOUND_DUR_1S
-    elif x < 2.0:
-        return EVT_SOUND_DUR_1_5S
-    elif x < 3.0:
-        return EVT_SOUND_DUR_2S
-    elif x < 4.0:
-        return EVT_SOUND_DUR_3S
-    elif x < 5.0:
-        return EVT_SOUND_DUR_4S
-    elif x < 10.0:
-        return EVT_SOUND_DUR_5S
-    elif x < 15.0:
-        return EVT_SOUND_DUR_10S
-    elif x < 20.0:
-        return EVT_SOUND_DUR_15S
-    elif x < 30.0:
-        return EVT_SOUND_DUR_20S
-    elif x < 45.0:
-        return EVT_SOUND_DUR_30S
-    elif x < 60.0:
-        return EVT_SOUND_DUR_45S
-    elif x < 90.0:
-        return EVT_SOUND_DUR_60S
-    elif x < 120.0:
-        return EVT_SOUND_DUR_90S
-    elif x < 300.0:
-        return EVT_SOUND_DUR_2M
-    else:
-        return EVT_SOUND_DUR_5M
+    return _DURATION_VALUES[bisect_right(_DURATION_LIMITS, float(duration))]
+
+def durations_to_fixed_values(durations):
+    return [_DURATION_VALUES[bisect_right(_DURATION_LIMITS, float(x))] for x in durations]
 
 def printProgressBar (iteration, total, prefix = '', suffix = '', decimals = 1, length = 100, fill = '█'):
     """
@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick IR traffic monitor
+
+import time
+from collections import deque
+from pfxbrick.pfx import *
+from pfxbrick.pfxhelpers import address_to_evtch, lazy_import
+
+pd = lazy_import('pfxbrick.pfxdict')
+
+# PFX_CMD_GET_LAST_IR_MSG response payload: the event/action LUT address
+# the message decoded to, followed by the raw IR message bytes.  The raw
+# message includes the Power Functions toggle bit, so successive presses
+# of the same remote button differ while retransmissions of one press do not.
+IR_RAW_SZ = 4
+
+
+class PFxIRMessage:
+    """
+    A decoded IR message received by the PFx Brick.
+
+    Attributes:
+        t (:obj:`float`): time.monotonic() time when the message was first seen
+
+        address (:obj:`int`): event/action LUT address the message decoded to
+
+        raw (:obj:`bytes`): raw IR message bytes
+    """
+    __slots__ = ('t', 'address', 'raw')
+
+    def __init__(self, t, address, raw):
+        self.t = t
+        self.address = address
+        self.raw = bytes(raw)
+
+    @property
+    def evtID(self):
+        """
+        :obj:`int` event ID of the message
+        """
+        return address_to_evtch(self.address)[0]
+
+    @property
+    def ch(self):
+        """
+        :obj:`int` IR channel of the message (0 - 3)
+        """
+        return address_to_evtch(self.address)[1]
+
+    def __eq__(self, other):
+        if not isinstance(other, PFxIRMessage):
+            return NotImplemented
+        return self.address == other.address and self.raw == other.raw
+
+    def __hash__(self):
+        return hash((self.address, self.raw))
+
+    def __str__(self):
+        evt = pd.evtid_dict[self.evtID] if self.evtID in pd.evtid_dict else 'Unknown'
+        s = '%10.3f  Ch %d  [%02X] %-24s %s' % (self.t, self.ch + 1, self.evtID, evt, self.raw.hex())
+        return s
+
+
+class PFxIRMonitor:
+    """
+    Streaming monitor of the IR traffic received by a PFx Brick.
+    
+    The monitor repeatedly queries the PFx Brick with the
+    PFX_CMD_GET_LAST_IR_MSG ICD message.  Since the brick reports the same
+    last message until a new one arrives, repeated reports are dropped and
+    only new messages are counted and returned.  The message already held
+    by the PFx Brick when monitoring starts is taken as the starting point
+    and is not reported.  Message rates are kept per
+    IR channel over a sliding time window, which is useful for diagnosing IR
+    congestion when several remotes share a layout.
+    
+    An example of using this class is as follows::
+    
+        monitor = PFxIRMonitor(brick)
+        for msg in monitor.stream(duration=30):
+            print(msg)
+        print(monitor.rates())
+
+    Attributes:
+        brick (:obj:`PFxBrick`): the monitored PFx Brick
+
+        interval (:obj:`float`): polling interval in seconds
+
+        window (:obj:`float`): time window in seconds used for the rate counters
+
+        counts ([:obj:`int`]): total number of messages received per IR channel
+
+        polls (:obj:`int`): number of polls made
+
+        last (:obj:`PFxIRMessage`): most recent message, None before the first poll
+    """
+    def __init__(self, brick, interval=0.01, window=10.0):
+        self.brick = brick
+        self.interval = interval
+        self.window = window
+        self.counts = [0] * 4
+        self.polls = 0
+        self.last = None
+        self._started = False
+        self._times = [deque() for ch in range(4)]
+
+    def poll(self):
+        """
+        Reads the last IR message once.
+        
+        :returns: :obj:`PFxIRMessage` the message if it is new, otherwise None
+        """
+        msg = self.brick.get_last_ir_msg()
+        self.polls += 1
+        if msg is None or msg == self.last:
+            return None
+        self.last = msg
+        if not self._started:
+            # received before monitoring started
+            self._started = True
+            return None
+        self.counts[msg.ch] += 1
+        self._times[msg.ch].append(msg.t)
+        return msg
+
+    def rates(self, now=None):
+        """
+        Returns the rate of new messages per IR channel over the last **window** seconds.
+        
+        :param now: :obj:`float` optional time.monotonic() reference time
+        :returns: [:obj:`float`] messages per second for IR channels 1-4
+        """
+        if now is None:
+            now = time.monotonic()
+        rates = []
+        for times in self._times:
+            while times and times[0] < now - self.window:
+                times.popleft()
+            rates.append(len(times) / self.window)
+        return rates
+
+    def stream(self, duration=None, count=None):
+        """
+        Generator which polls continuously and yields every new IR message.
+        
+        :param duration: :obj:`float` optional time in seconds to stop after
+        :param count: :obj:`int` optional number of messages to stop after
+        :returns: :obj:`PFxIRMessage` timestamped messages in order of arrival
+        """
+        end = None if duration is None else time.monotonic() + duration
+        n = 0
+        while end is None or time.monotonic() < end:
+            msg = self.poll()
+            if msg is not None:
+                yield msg
+                n += 1
+                if count is not None and n >= count:
+                    return
+            time.sleep(self.interval)
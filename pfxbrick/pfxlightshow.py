@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick light show compiler
+
+from pfxbrick.pfx import *
+from pfxbrick.pfxaction import PFxAction
+
+# bit masks of the PF outputs when used as light outputs
+_PF_OUTPUTS = {
+    'A': EVT_LIGHT_PF_OUTPUT_A,
+    'B': EVT_LIGHT_PF_OUTPUT_B,
+    'C': EVT_LIGHT_PF_OUTPUT_C,
+    'D': EVT_LIGHT_PF_OUTPUT_D
+}
+
+
+def light_state_fx(state):
+    """
+    Converts a light state into the light fx ID and 5 light parameters
+    of the action which produces it.
+    
+    :param state: True (on), False (off), :obj:`int` brightness (0 - 255) or (fx, [params]) tuple
+    :returns: (:obj:`int`, ...) tuple of the light fx ID followed by 5 parameters
+    """
+    if state is True:
+        return (EVT_LIGHTFX_ON_OFF_TOGGLE, 0, 0, 0, EVT_TRANSITION_ON, 0)
+    elif state is False:
+        return (EVT_LIGHTFX_ON_OFF_TOGGLE, 0, 0, 0, EVT_TRANSITION_OFF, 0)
+    elif isinstance(state, int):
+        x = min(max(state, 0), 255)
+        return (EVT_LIGHTFX_SET_BRIGHT, x, 0, 0, 0, 0)
+    fx, param = state
+    p = list(param)[:5]
+    p.extend([0] * (5 - len(p)))
+    return tuple([fx] + p)
+
+
+class PFxLightShow:
+    """
+    Keyframe light show compiler.
+    
+    Light states are specified as keyframes for individual light outputs
+    (1-8) and PF outputs used as lights ('A'-'D').  A state can be:
+    
+    * True or False to turn a light on or off
+    * an :obj:`int` brightness (0 - 255)
+    * a (fx, [params]) tuple of a light effect and its parameters, as used with :py:meth:`PFxAction.light_fx`
+    
+    The compiler drops keyframes which do not change the state of
+    their light output and combines all outputs changing to the same
+    state at the same time into a single action using the light output
+    masks.  An example of using this class for an 8 channel chase is::
+    
+        show = PFxLightShow()
+        for i in range(8):
+            show.add(i+1, i * 0.25, 255)
+            show.add(i+1, i * 0.25 + 0.25, 0)
+        events = show.compile()
+        PFxSequencer(brick, events).run()
+
+    Attributes:
+        keyframes ({ch: [(:obj:`float`, state)]}): keyframes for each output
+
+        initial ({ch: state}): optional known states of outputs before the show starts
+    """
+    def __init__(self, initial=None):
+        self.keyframes = {}
+        self.initial = {}
+        if initial is not None:
+            self.initial.update(initial)
+
+    def add(self, ch, t, state):
+        """
+        Adds a keyframe to the show.
+        
+        :param ch: light output (1-8) or PF output ('A'-'D')
+        :param t: :obj:`float` time in seconds from the start of the show
+        :param state: desired light state
+        :returns: :obj:`PFxLightShow` self
+        """
+        if ch not in _PF_OUTPUTS and (not isinstance(ch, int) or ch < 1 or ch > 8):
+            print("Light output %s out of range" % (str(ch)))
+            return self
+        self.keyframes.setdefault(ch, []).append((float(t), state))
+        return self
+
+    @property
+    def keyframe_count(self):
+        """
+        The total number of keyframes, i.e. the number of actions needed
+        if every keyframe were sent individually.
+        """
+        return sum(len(k) for k in self.keyframes.values())
+
+    def compile(self):
+        """
+        Compiles the keyframes into a minimal ordered timeline of actions.
+        
+        :returns: [(:obj:`float`, :obj:`PFxAction`)] timeline of actions, ready for :py:class:`PFxSequencer`
+        """
+        current = {}
+        for ch, state in self.initial.items():
+            current[ch] = light_state_fx(state)
+        changes = []
+        for ch, frames in self.keyframes.items():
+            for t, state in frames:
+                changes.append((t, ch, state))
+        # stable sort keeps keyframes added later at the same time last
+        changes.sort(key=lambda c: c[0])
+
+        events = []
+        i = 0
+        while i < len(changes):
+            t = changes[i][0]
+            groups = {}
+            order = []
+            while i < len(changes) and changes[i][0] == t:
+                ch, fx = changes[i][1], light_state_fx(changes[i][2])
+                # a later keyframe for the same output at the same time wins
+                for g in groups.values():
+                    g.discard(ch)
+                if current.get(ch) != fx:
+                    if fx not in groups:
+                        groups[fx] = set()
+                        order.append(fx)
+                    groups[fx].add(ch)
+                i += 1
+            for fx in order:
+                chs = groups[fx]
+                if not chs:
+                    continue
+                a = PFxAction()
+                a.lightFxId = fx[0]
+                a.lightParam1, a.lightParam2, a.lightParam3, a.lightParam4, a.lightParam5 = fx[1:]
+                for ch in chs:
+                    if ch in _PF_OUTPUTS:
+                        a.lightPFOutputMask |= _PF_OUTPUTS[ch]
+                    else:
+                        a.lightOutputMask |= 1 << (ch - 1)
+                    current[ch] = fx
+                events.append((t, a))
+        return events
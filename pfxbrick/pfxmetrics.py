@@ -0,0 +1,183 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick Prometheus metrics exporter
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pfxbrick.pfxmsg as pm
+from pfxbrick.pfxbrick import open_bricks
+from pfxbrick.pfxhelpers import lazy_import
+
+pd = lazy_import('pfxbrick.pfxdict')
+
+
+def label_str(labels):
+    """
+    Formats a dictionary of labels in Prometheus text exposition format.
+    """
+    s = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items())
+    return '{%s}' % (s)
+
+
+class PFxMetrics:
+    """
+    Collects Prometheus text format metrics for a set of PFx Bricks.
+    
+    Transport metrics are taken from the transaction statistics kept by
+    usb_transaction for every device: transaction counts, failures,
+    latency histograms and bytes transferred per PFX_CMD_* command, and
+    file system error counts per error code.  The status and error bytes
+    and the free flash are queried from each brick when the metrics are
+    rendered, at most once every **max_age** seconds.
+
+    Attributes:
+        bricks ([:obj:`PFxBrick`]): PFx Bricks to report, None to report every open PFx Brick
+
+        max_age (:obj:`float`): time in seconds the queried brick state is re-used for
+    """
+    def __init__(self, bricks=None, max_age=5.0):
+        self.bricks = bricks
+        self.max_age = max_age
+        self._queried = {}
+
+    def _query(self, brick):
+        t, up = self._queried.get(id(brick), (None, False))
+        now = time.monotonic()
+        if t is None or now - t > self.max_age:
+            up = brick.get_status() and brick.get_free_space()
+            if up:
+                brick.get_name()
+            self._queried[id(brick)] = (now, up)
+        return up
+
+    def render(self):
+        """
+        Renders the current metrics.
+        
+        :returns: :obj:`str` metrics in Prometheus text exposition format
+        """
+        bricks = self.bricks if self.bricks is not None else list(open_bricks)
+        families = {}
+        def add(name, kind, doc, labels, value, suffix=''):
+            if name not in families:
+                families[name] = ['# HELP %s %s' % (name, doc), '# TYPE %s %s' % (name, kind)]
+            families[name].append('%s%s%s %s' % (name, suffix, label_str(labels), repr(float(value))))
+        for brick in bricks:
+            if not brick.is_open:
+                continue
+            serial = brick.usb_serno_str
+            up = self._query(brick)
+            add('pfx_brick_up', 'gauge', 'Whether the PFx Brick responded to PFX_CMD_GET_STATUS', {'serial': serial, 'name': brick.peek('name', '')}, int(up))
+            if up:
+                add('pfx_brick_status', 'gauge', 'Status byte reported by PFX_CMD_GET_STATUS', {'serial': serial}, brick.status)
+                add('pfx_brick_error', 'gauge', 'Error byte reported by PFX_CMD_GET_STATUS', {'serial': serial}, brick.error)
+                add('pfx_brick_flash_free_bytes', 'gauge', 'Free file system space', {'serial': serial}, brick.filedir.bytesLeft)
+                add('pfx_brick_flash_used_bytes', 'gauge', 'Used file system space', {'serial': serial}, brick.filedir.bytesUsed)
+            stats = pm.device_stats(brick.hid)
+            for cmd, c in sorted(stats['commands'].items()):
+                labels = {'serial': serial, 'command': pm.command_str(cmd)}
+                count, failures, seconds, nout, nin, buckets = c
+                add('pfx_usb_transactions_total', 'counter', 'USB transactions per ICD command', labels, count)
+                add('pfx_usb_transaction_failures_total', 'counter', 'USB transactions without a valid response', labels, failures)
+                hist = ('pfx_usb_transaction_seconds', 'histogram', 'USB transaction round trip time')
+                for le, n in zip(pm.LATENCY_BUCKETS, buckets):
+                    add(*hist, dict(labels, le=repr(le)), n, '_bucket')
+                add(*hist, dict(labels, le='+Inf'), count, '_bucket')
+                add(*hist, labels, seconds, '_sum')
+                add(*hist, labels, count, '_count')
+                add('pfx_usb_bytes_total', 'counter', 'ICD message bytes transferred', dict(labels, direction='out'), nout)
+                add('pfx_usb_bytes_total', 'counter', 'ICD message bytes transferred', dict(labels, direction='in'), nin)
+            for code, n in sorted(stats['errors'].items()):
+                error = pd.err_dict[code] if code in pd.err_dict else 'Unknown'
+                add('pfx_fs_errors_total', 'counter', 'File system errors per error code', {'serial': serial, 'code': '%02X' % (code), 'error': error}, n)
+        lines = []
+        for name in families:
+            lines.extend(families[name])
+        return '\n'.join(lines) + '\n'
+
+
+class PFxMetricsServer:
+    """
+    Embedded HTTP server which exposes PFx Brick metrics to Prometheus.
+    
+    The metrics are served as text at http://host:port/metrics from a
+    background thread.  An example of using this class is as follows::
+    
+        server = PFxMetricsServer(port=9708)
+        server.start()
+        ...
+        server.stop()
+
+    Attributes:
+        metrics (:obj:`PFxMetrics`): the metrics collector
+
+        host (:obj:`str`): address the server listens on
+
+        port (:obj:`int`): port the server listens on
+    """
+    def __init__(self, bricks=None, host='127.0.0.1', port=9708, max_age=5.0):
+        self.metrics = PFxMetrics(bricks, max_age)
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def _handler(self):
+        metrics = self.metrics
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                pass
+        return Handler
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+        """
+        if self._server is None:
+            self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+            self.port = self._server.server_address[1]
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
@@ -0,0 +1,286 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick current state monitor
+
+import threading
+import time
+from array import array
+from pfxbrick.pfx import *
+
+# PFX_CMD_GET_CURRENT_STATE response payload: current speed of motor
+# channels A-D (hi-res speed byte format) in bytes 0-3, brightness of light
+# outputs 1-8 in bytes 4-11, audio volume in byte 12 and the file ID playing
+# on each audio channel in bytes 13-16
+STATE_SZ = 17
+
+
+def motor_speed_value(x):
+    """
+    Converts a hi-res motor speed byte into a signed speed.
+    
+    :param x: :obj:`int` speed byte
+    :returns: :obj:`int` motor speed (-100 to +100)
+    """
+    s = int(round((x & EVT_MOTOR_SPEED_HIRES_MASK) * 100.0 / 63.0))
+    if x & EVT_MOTOR_SPEED_HIRES_REV:
+        s = -s
+    return s
+
+
+class PFxState:
+    """
+    Compact record of the current operating state of a PFx Brick,
+    as reported by the PFX_CMD_GET_CURRENT_STATE ICD message.
+    
+    Attributes:
+        t (:obj:`float`): time.monotonic() time when the state was read
+
+        raw (:obj:`bytes`): state payload bytes
+    """
+    __slots__ = ('t', 'raw')
+
+    def __init__(self, t=0.0, raw=bytes(STATE_SZ)):
+        self.t = t
+        self.raw = bytes(raw)
+
+    @property
+    def motor_speeds(self):
+        """
+        [:obj:`int`] current speed of motor channels A-D (-100 to +100)
+        """
+        return [motor_speed_value(x) for x in self.raw[0:4]]
+
+    @property
+    def light_brightness(self):
+        """
+        [:obj:`int`] current brightness of light outputs 1-8 (0 - 255)
+        """
+        return list(self.raw[4:12])
+
+    @property
+    def volume(self):
+        """
+        :obj:`int` current audio volume (0 - 255)
+        """
+        return self.raw[12]
+
+    @property
+    def audio_files(self):
+        """
+        [:obj:`int`] file ID playing on each audio channel
+        """
+        return list(self.raw[13:17])
+
+    def __eq__(self, other):
+        if not isinstance(other, PFxState):
+            return NotImplemented
+        return self.raw == other.raw
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __str__(self):
+        sb = []
+        sb.append('Motor speeds          : %s' % (' '.join('%4d' % (x) for x in self.motor_speeds)))
+        sb.append('Light brightness      : %s' % (''.join('{:02X} '.format(x) for x in self.light_brightness)))
+        sb.append('Volume                : %d' % (self.volume))
+        sb.append('Audio files           : %s' % (''.join('{:02X} '.format(x) for x in self.audio_files)))
+        s = '\n'.join(sb)
+        return s
+
+
+class PFxStateHistory:
+    """
+    Fixed size ring buffer of :py:class:`PFxState` records.
+    
+    The records are stored in flat arrays rather than as individual objects,
+    so the memory used is fixed by the capacity.  Indexing returns records
+    from oldest (0) to newest (-1).
+
+    Attributes:
+        capacity (:obj:`int`): maximum number of records kept
+    """
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._t = array('d', bytes(8 * capacity))
+        self._raw = array('B', bytes(STATE_SZ * capacity))
+        self._next = 0
+        self._count = 0
+
+    def append(self, state):
+        """
+        Adds a record, replacing the oldest record when the buffer is full.
+        
+        :param state: :obj:`PFxState` record to add
+        """
+        i = self._next
+        self._t[i] = state.t
+        self._raw[i*STATE_SZ:(i+1)*STATE_SZ] = array('B', state.raw)
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._count
+        if idx < 0 or idx >= self._count:
+            raise IndexError('state history index out of range')
+        i = (self._next - self._count + idx) % self.capacity
+        return PFxState(self._t[i], self._raw[i*STATE_SZ:(i+1)*STATE_SZ].tobytes())
+
+    def __iter__(self):
+        for idx in range(self._count):
+            yield self[idx]
+
+
+class PFxStateMonitor:
+    """
+    Background monitor of the current operating state of a PFx Brick.
+    
+    The monitor polls the PFx Brick with the PFX_CMD_GET_CURRENT_STATE ICD
+    message from a background thread.  The polling interval adapts to
+    activity: it drops to **min_interval** whenever the state changes and
+    backs off gradually to **max_interval** while the state is unchanged.
+    Changed states are added to :py:attr:`history` and passed to every
+    subscribed callback as callback(state, previous_state).
+    
+    An example of using this class is as follows::
+    
+        def changed(state, previous):
+            print(state.motor_speeds)
+        
+        monitor = PFxStateMonitor(brick)
+        monitor.subscribe(changed)
+        monitor.start()
+        ...
+        monitor.stop()
+
+    Attributes:
+        brick (:obj:`PFxBrick`): the monitored PFx Brick
+
+        history (:obj:`PFxStateHistory`): ring buffer of state changes
+
+        state (:obj:`PFxState`): latest state read, None until the first poll
+
+        min_interval (:obj:`float`): polling interval in seconds while the state is changing
+
+        max_interval (:obj:`float`): longest polling interval in seconds while the state is unchanged
+
+        backoff (:obj:`float`): factor the polling interval grows by after each unchanged poll
+
+        polls (:obj:`int`): number of polls made
+
+        errors (:obj:`int`): number of polls which failed because the PFx Brick could not be accessed
+    """
+    def __init__(self, brick, min_interval=0.05, max_interval=1.0, backoff=1.5, history=1024):
+        self.brick = brick
+        self.history = PFxStateHistory(history)
+        self.state = None
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.polls = 0
+        self.errors = 0
+        self._callbacks = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, callback):
+        """
+        Registers a function called as callback(state, previous_state) on every state change.
+        """
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Removes a function registered with :py:meth:`subscribe`.
+        """
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def poll(self):
+        """
+        Reads the current state once, recording and announcing it if it changed.
+        
+        :returns: :obj:`boolean` True if the state changed
+        """
+        state = self.brick.get_current_state()
+        self.polls += 1
+        if state is None:
+            return False
+        previous = self.state
+        self.state = state
+        if previous is not None and previous.raw == state.raw:
+            return False
+        self.history.append(state)
+        for callback in list(self._callbacks):
+            # a failing callback must not stop the other callbacks or the monitor
+            try:
+                callback(state, previous)
+            except Exception as e:
+                print("Error in PFx Brick state monitor callback: %s" % (str(e)))
+        return True
+
+    def _run(self):
+        interval = self.min_interval
+        lost = False
+        while not self._stop.is_set():
+            try:
+                if not self.brick.is_open:
+                    raise ValueError('the PFx Brick is closed')
+                changed = self.poll()
+                lost = False
+            except (OSError, ValueError) as e:
+                # keep polling slowly, e.g. until a PFxWatchdog reopens the PFx Brick
+                self.errors += 1
+                if not lost:
+                    print("PFx Brick state monitor cannot access the PFx Brick: %s" % (str(e)))
+                lost = True
+                changed = False
+                interval = self.max_interval
+            if changed:
+                interval = self.min_interval
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+            self._stop.wait(interval)
+
+    def start(self):
+        """
+        Starts polling in a background thread.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background polling thread.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
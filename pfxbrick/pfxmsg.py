@@ -23,28 +23,158 @@
 #
 # PFx Brick message helpers
 
-import hid
-import platform
+import threading
+import time
+import pfxbrick.pfx as pfx
 from pfxbrick.pfx import *
+from pfxbrick.pfxhelpers import uint32_to_bytes
 
-def usb_transaction(hdev, msg):
+# PFX_CMD_* names of the ICD command codes, used in error reports and metrics
+command_names = {}
+for k, v in sorted(vars(pfx).items()):
+    if k.startswith('PFX_CMD_') and isinstance(v, int):
+        command_names.setdefault(v, k)
+
+def command_str(cmd):
+    """
+    Returns the PFX_CMD_* name of an ICD command code.
+    """
+    if cmd in command_names:
+        return command_names[cmd]
+    return '0x%02X' % (cmd)
+
+# USB HID devices must not be accessed by more than one thread at a time,
+# so every transaction holds a lock belonging to its device
+_hdev_locks = {}
+_hdev_locks_lock = threading.Lock()
+
+def hdev_lock(hdev):
+    lock = _hdev_locks.get(id(hdev))
+    if lock is None:
+        with _hdev_locks_lock:
+            lock = _hdev_locks.setdefault(id(hdev), threading.Lock())
+    return lock
+
+# Background readers which own the reading side of a device, and callbacks
+# for PFX_MSG_NOTIFICATION reports, both keyed by device
+readers = {}
+notification_listeners = {}
+
+def dispatch_notification(hdev, res):
+    for callback in list(notification_listeners.get(id(hdev), [])):
+        # a failing callback must not stop the other callbacks, the
+        # reader thread or the transaction which received the report
+        try:
+            callback(res)
+        except Exception as e:
+            print("Error in PFx Brick notification callback: %s" % (str(e)))
+
+# Transaction statistics for each device, keyed by device.  Each entry holds
+# per command [count, failures, seconds, bytes out, bytes in, bucket counts]
+# and per error code counts.  These are exported by pfxmetrics.
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1.0)
+transport_stats = {}
+
+def device_stats(hdev):
+    stats = transport_stats.get(id(hdev))
+    if stats is None:
+        stats = transport_stats.setdefault(id(hdev), {'commands': {}, 'errors': {}})
+    return stats
+
+def record_transaction(hdev, cmd, elapsed, nout, nin, ok):
+    commands = device_stats(hdev)['commands']
+    c = commands.get(cmd)
+    if c is None:
+        c = commands.setdefault(cmd, [0, 0, 0.0, 0, 0, [0] * len(LATENCY_BUCKETS)])
+    c[0] += 1
+    c[1] += 0 if ok else 1
+    c[2] += elapsed
+    c[3] += nout
+    c[4] += nin
+    for i, le in enumerate(LATENCY_BUCKETS):
+        if elapsed <= le:
+            c[5][i] += 1
+
+def record_error(hdev, code):
+    errors = device_stats(hdev)['errors']
+    errors[code] = errors.get(code, 0) + 1
+
+def release_device(hdev):
+    # forget the lock, statistics and notification state of a closed
+    # device, since the id of the device may be re-used by a new one
+    for d in (_hdev_locks, readers, notification_listeners, transport_stats):
+        d.pop(id(hdev), None)
+
+def usb_report(msg):
     # enforce non-numbered report pre-pending and report length
     # This ensures consistent operation on Windows, macOS, etc.
     # since Windows insists on matched report length/buffer size
     # and for all non-numbered reports to start with 0
-    msglen = len(msg)
     buf = [0]
     buf.extend(msg)
-    buf.extend([0] * (64 - msglen))
-    hdev.write(buf)
+    buf.extend([0] * (64 - len(msg)))
+    return buf
+
+def usb_response(hdev, reader, cmd):
+    if reader is not None:
+        return reader.get_response(cmd | 0x80)
     res = hdev.read(64)
+    # unsolicited notifications may arrive ahead of the response
+    while res and res[0] == PFX_MSG_NOTIFICATION:
+        dispatch_notification(hdev, res)
+        res = hdev.read(64)
+    return res
+
+def usb_transaction(hdev, msg):
+    if hdev is None:
+        raise ValueError('not open')
+    buf = usb_report(msg)
+    with hdev_lock(hdev):
+        reader = readers.get(id(hdev))
+        t0 = time.perf_counter()
+        hdev.write(buf)
+        res = usb_response(hdev, reader, msg[0])
+        ok = bool(res) and res[0] == msg[0] | 0x80
+        record_transaction(hdev, msg[0], time.perf_counter() - t0, len(msg), len(res) if res else 0, ok)
     if res:
-        if res[0] == msg[0] | 0x80:
+        if ok:
             return res
         else:
             print("Error reading valid response from PFx Brick")
     return 0
 
+# Number of messages written ahead of reading their responses by
+# usb_pipeline.  This stays well within the report buffers of the PFx Brick
+# and of the host HID drivers.
+PIPELINE_DEPTH = 8
+
+def usb_pipeline(hdev, msgs):
+    """
+    Performs several ICD messages, writing up to PIPELINE_DEPTH messages
+    before reading their responses, rather than waiting for each response
+    before writing the next message.
+
+    :param hdev: USB HID session handle
+    :param msgs: list of ICD messages
+    :returns: list with the response of each message, 0 where no valid response was received
+    """
+    if hdev is None:
+        raise ValueError('not open')
+    results = []
+    with hdev_lock(hdev):
+        reader = readers.get(id(hdev))
+        for i in range(0, len(msgs), PIPELINE_DEPTH):
+            window = msgs[i:i+PIPELINE_DEPTH]
+            t0 = time.perf_counter()
+            for msg in window:
+                hdev.write(usb_report(msg))
+            for msg in window:
+                res = usb_response(hdev, reader, msg[0])
+                ok = bool(res) and res[0] == msg[0] | 0x80
+                record_transaction(hdev, msg[0], time.perf_counter() - t0, len(msg), len(res) if res else 0, ok)
+                results.append(res if ok else 0)
+    return results
+
 def cmd_get_icd_rev(hdev, silent=False):
     msg = [PFX_CMD_GET_ICD_REV, PFX_GET_ICD_BYTE0, PFX_GET_ICD_BYTE1, PFX_GET_ICD_BYTE2, int(silent)]
     return usb_transaction(hdev, msg)
@@ -57,40 +187,99 @@ def cmd_get_config(hdev):
     msg = [PFX_CMD_GET_CONFIG]        
     return usb_transaction(hdev, msg)
 
-def cmd_set_config(hdev, cfgbytes):
+def msg_set_config(cfgbytes):
     msg = [PFX_CMD_SET_CONFIG]
     msg.extend(cfgbytes)
+    return msg
+
+def cmd_set_config(hdev, cfgbytes):
+    return usb_transaction(hdev, msg_set_config(cfgbytes))
+
+def cmd_verify_config(hdev, crc):
+    msg = [PFX_CMD_VERIFY_CONFIG]
+    msg.extend(uint32_to_bytes(crc))
+    return usb_transaction(hdev, msg)
+
+def cmd_get_current_state(hdev):
+    msg = [PFX_CMD_GET_CURRENT_STATE]
+    return usb_transaction(hdev, msg)
+
+def cmd_get_last_ir_msg(hdev):
+    msg = [PFX_CMD_GET_LAST_IR_MSG]
+    return usb_transaction(hdev, msg)
+
+def cmd_set_notifications(hdev, mask):
+    msg = [PFX_CMD_SET_NOTIFICATIONS, mask]
     return usb_transaction(hdev, msg)
 
 def cmd_get_name(hdev):
     msg = [PFX_CMD_GET_NAME]
     return usb_transaction(hdev, msg)
     
-def cmd_set_name(hdev, name):
+def msg_set_name(name):
     msg = [PFX_CMD_SET_NAME]
     mb = bytes(name, "utf-8")
     for x in mb:
         msg.append(int(x))
+    return msg
+
+def cmd_set_name(hdev, name):
+    return usb_transaction(hdev, msg_set_name(name))
+
+def cmd_verify_event_lut(hdev, crc):
+    msg = [PFX_CMD_VERIFY_EVENT_LUT]
+    msg.extend(uint32_to_bytes(crc))
     return usb_transaction(hdev, msg)
 
 def cmd_get_event_action(hdev, evtID, ch):
     msg = [PFX_CMD_GET_EVENT_ACTION, evtID, ch]
     return usb_transaction(hdev, msg)
 
-def cmd_set_event_action(hdev, evtID, ch, action):
+def msg_set_event_action(evtID, ch, action):
     msg = [PFX_CMD_SET_EVENT_ACTION, evtID, ch]
     msg.extend(action)
-    return usb_transaction(hdev, msg)
+    return msg
 
-def cmd_test_action(hdev, action):
+def cmd_set_event_action(hdev, evtID, ch, action):
+    return usb_transaction(hdev, msg_set_event_action(evtID, ch, action))
+
+def msg_test_action(action):
     msg = [PFX_CMD_TEST_ACTION]
     msg.extend(action)
-    return usb_transaction(hdev, msg)
+    return msg
+
+def cmd_test_action(hdev, action):
+    return usb_transaction(hdev, msg_test_action(action))
+    
+def msg_send_event(evtID, ch):
+    return [PFX_CMD_SEND_EVENT, evtID, ch]
+
+def cmd_send_event(hdev, evtID, ch):
+    return usb_transaction(hdev, msg_send_event(evtID, ch))
     
 def cmd_get_dir_entry(hdev, idx):
     msg = [PFX_CMD_FILE_DIR, PFX_DIR_REQ_GET_DIR_ENTRY_IDX, idx]
     return usb_transaction(hdev, msg)
 
+def cmd_get_dir_entry_id(hdev, fid):
+    msg = [PFX_CMD_FILE_DIR, PFX_DIR_REQ_GET_DIR_ENTRY_ID, fid]
+    return usb_transaction(hdev, msg)
+
+def msg_set_file_attr(fid, attr):
+    return [PFX_CMD_FILE_DIR, PFX_DIR_REQ_SET_ATTR_ID, fid, (attr >> 8) & 0xFF, attr & 0xFF]
+
+def msg_set_file_user_data(fid, field, value):
+    msg = [PFX_CMD_FILE_DIR, PFX_DIR_REQ_SET_USER_DATA2_ID if field == 2 else PFX_DIR_REQ_SET_USER_DATA1_ID, fid]
+    msg.extend(uint32_to_bytes(value))
+    return msg
+
+def msg_rename_file(fid, name):
+    msg = [PFX_CMD_FILE_DIR, PFX_DIR_REQ_RENAME_FILE_ID, fid]
+    nd = bytes(name, "utf-8")[:32]
+    msg.extend(nd)
+    msg.extend([0] * (32 - len(nd)))
+    return msg
+
 def cmd_get_num_files(hdev):
     msg = [PFX_CMD_FILE_DIR, PFX_DIR_REQ_GET_FILE_COUNT]
     return usb_transaction(hdev, msg)
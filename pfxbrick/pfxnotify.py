@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick notification support
+
+import queue
+import threading
+import time
+from pfxbrick.pfx import *
+import pfxbrick.pfxmsg as pm
+
+# names of the notification bits reported in a PFX_MSG_NOTIFICATION message
+notification_names = {
+    PFX_NOTIFICATION_AUDIO_PLAY_DONE: 'Audio play done',
+    PFX_NOTIFICATION_AUDIO_PLAY: 'Audio play',
+    PFX_NOTIFICATION_MOTORA_CURR_SPD: 'Motor A speed',
+    PFX_NOTIFICATION_MOTORA_STOP: 'Motor A stop',
+    PFX_NOTIFICATION_MOTORB_CURR_SPD: 'Motor B speed',
+    PFX_NOTIFICATION_MOTORB_STOP: 'Motor B stop'
+}
+
+
+class PFxNotification:
+    """
+    Unsolicited notification report sent by the PFx Brick.
+
+    Attributes:
+        t (:obj:`float`): time.monotonic() time when the notification was received
+
+        flags (:obj:`int`): PFX_NOTIFICATION_* bits identifying the reported events
+
+        data (:obj:`bytes`): notification data bytes following the flags
+    """
+    __slots__ = ('t', 'flags', 'data')
+
+    def __init__(self, t, msg):
+        self.t = t
+        self.flags = msg[1]
+        self.data = bytes(msg[2:])
+
+    @property
+    def events(self):
+        """
+        [:obj:`str`] names of the reported events
+        """
+        return [name for bit, name in sorted(notification_names.items()) if self.flags & bit]
+
+    def __str__(self):
+        s = '[%02X] %s' % (self.flags, ', '.join(self.events))
+        return s
+
+
+class PFxNotificationReader:
+    """
+    Background reader thread for a PFx Brick USB device.
+    
+    While running, the reader owns the reading side of the device. It
+    separates unsolicited PFX_MSG_NOTIFICATION reports from command
+    responses: responses are handed to the waiting command transaction and
+    notifications are passed to every subscribed callback and asyncio queue.
+    Callbacks are called from the reader thread.
+
+    Attributes:
+        hdev (:obj:`device`): the USB HID device handle
+
+        timeout (:obj:`float`): time in seconds a command waits for its response
+    """
+    def __init__(self, hdev, timeout=1.0):
+        self.hdev = hdev
+        self.timeout = timeout
+        self._responses = queue.Queue()
+        self._queues = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, callback):
+        """
+        Registers a function called with a :py:class:`PFxNotification` for every notification.
+        """
+        pm.notification_listeners.setdefault(id(self.hdev), []).append(lambda msg: callback(PFxNotification(time.monotonic(), msg)))
+
+    def asyncio_queue(self, loop=None, maxsize=0):
+        """
+        Creates an asyncio queue which receives every notification.
+        
+        :param loop: the asyncio event loop the queue belongs to, by default the running event loop
+        :param maxsize: :obj:`int` maximum queue size, notifications are dropped when the queue is full
+        :returns: :obj:`asyncio.Queue` queue of :py:class:`PFxNotification`
+        """
+        import asyncio
+        if loop is None:
+            # raises RuntimeError when called outside a running event loop
+            loop = asyncio.get_running_loop()
+        q = asyncio.Queue(maxsize)
+        def put(n):
+            if not q.full():
+                q.put_nowait(n)
+        self.subscribe(lambda n: loop.call_soon_threadsafe(put, n))
+        return q
+
+    def get_response(self, code):
+        """
+        Waits for the response to a command. Stale responses to earlier
+        commands which timed out are discarded.
+        
+        :param code: :obj:`int` expected response code
+        :returns: the response report, or an empty list on timeout
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            try:
+                res = self._responses.get(timeout=remaining)
+            except queue.Empty:
+                return []
+            if res[0] == code:
+                return res
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    res = self.hdev.read(64, 100)
+                except (IOError, OSError, ValueError):
+                    break
+                if not res:
+                    continue
+                if res[0] == PFX_MSG_NOTIFICATION:
+                    pm.dispatch_notification(self.hdev, res)
+                else:
+                    self._responses.put(res)
+        finally:
+            # transactions read the device directly again once the reader is gone
+            if pm.readers.get(id(self.hdev)) is self:
+                pm.readers.pop(id(self.hdev), None)
+
+    def start(self):
+        """
+        Starts the reader thread.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            pm.readers[id(self.hdev)] = self
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the reader thread and removes all subscriptions.
+        """
+        if self._thread is not None:
+            pm.readers.pop(id(self.hdev), None)
+            pm.notification_listeners.pop(id(self.hdev), None)
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick motor ramp planner
+
+from pfxbrick.pfx import *
+from pfxbrick.pfxaction import PFxAction
+from pfxbrick.pfxconfig import PFxMotor
+
+# motor run durations (in seconds) which can be sent with EVT_MOTOR_SET_SPD_TIMED
+_FIXED_DURATIONS = [0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 300.0]
+
+
+def _speed_code(speed):
+    return PFxAction().set_motor_speed([1], speed).motorParam1
+
+
+class PFxRampPlan:
+    """
+    Result of planning a motor speed profile with :py:class:`PFxRampPlanner`.
+
+    Attributes:
+        events ([(:obj:`float`, :obj:`PFxAction`)]): timeline of actions, ready for :py:class:`PFxSequencer`
+
+        naive_count (:obj:`int`): number of messages a host-side ramp at the planner step rate would send
+
+        saved (:obj:`int`): number of messages saved compared to the host-side ramp
+    """
+    def __init__(self, events, naive_count):
+        self.events = events
+        self.naive_count = naive_count
+        self.saved = naive_count - len(events)
+
+    def __str__(self):
+        s = '%d messages instead of %d, %d saved' % (len(self.events), self.naive_count, self.saved)
+        return s
+
+
+class PFxRampPlanner:
+    """
+    Motor ramp planner which turns a speed profile into a minimal set of actions.
+    
+    A speed profile is a list of (t, speed) keyframes, where t is the time in
+    seconds and speed is the motor speed (-100 to +100).  The speed changes
+    linearly between keyframes.  The planner produces the fewest
+    set_motor_speed actions which reproduce the profile:
+    
+    * ramps whose duration matches the acceleration or deceleration of
+      the motor channel configuration (:py:attr:`PFxMotor.accel` and
+      :py:attr:`PFxMotor.decel`) are sent as a single action and the
+      PFx Brick performs the ramp itself
+    * other ramps are sent as host-side steps, but only when the speed
+      changes by at least one step of motor speed resolution
+    * a constant speed followed by a stop after one of the fixed ICD
+      durations is sent as a single EVT_MOTOR_SET_SPD_TIMED action
+    
+    An example of using this class is as follows::
+    
+        brick.get_config()
+        planner = PFxRampPlanner(brick.config.motors[0])
+        plan = planner.plan([1], [(0, 0), (3, 100), (13, 100), (13, 0)])
+        print(plan)
+        PFxSequencer(brick, plan.events).run()
+    
+    The time taken by the PFx Brick to ramp the speed is modelled as
+    abs(speed change) / 100 * factor * accel_scale seconds, where factor is
+    the motor accel or decel setting.  The default **accel_scale** is an
+    approximation and should be calibrated against the firmware in use.
+
+    Attributes:
+        motor (:obj:`PFxMotor`): motor channel configuration used to model hardware ramps
+
+        step (:obj:`float`): interval in seconds between host-side speed steps
+
+        accel_scale (:obj:`float`): seconds for a full scale speed change per unit of accel/decel factor
+
+        tolerance (:obj:`float`): allowed fractional timing difference between a ramp and the hardware ramp
+    """
+    def __init__(self, motor=None, step=0.1, accel_scale=0.2, tolerance=0.1):
+        if motor is None:
+            motor = PFxMotor()
+        self.motor = motor
+        self.step = step
+        self.accel_scale = accel_scale
+        self.tolerance = tolerance
+
+    def ramp_time(self, s0, s1):
+        """
+        Returns the modelled time the PFx Brick takes to ramp between two speeds.
+        
+        :param s0: :obj:`int` starting speed (-100 to +100)
+        :param s1: :obj:`int` final speed (-100 to +100)
+        :returns: :obj:`float` ramp time in seconds
+        """
+        if abs(s1) > abs(s0):
+            factor = self.motor.accel
+        else:
+            factor = self.motor.decel
+        return abs(s1 - s0) / 100.0 * factor * self.accel_scale
+
+    def plan(self, ch, profile):
+        """
+        Plans the actions for a speed profile.
+        
+        :param ch: [:obj:`int`] a list of motor channels (1-4)
+        :param profile: [(:obj:`float`, :obj:`int`)] list of (t, speed) keyframes
+        :returns: :obj:`PFxRampPlan` the planned actions
+        """
+        points = []
+        for t, s in sorted(profile, key=lambda p: p[0]):
+            if points and points[-1][1] * s < 0:
+                # split ramps through zero so that each part is a pure
+                # acceleration or deceleration
+                t0, s0 = points[-1]
+                tz = t0 + (t - t0) * abs(s0) / (abs(s0) + abs(s))
+                points.append((tz, 0))
+            points.append((float(t), s))
+        if not points:
+            return PFxRampPlan([], 0)
+
+        commands = []
+        def emit(t, s):
+            if commands and commands[-1][0] == t:
+                # a command at the same time supersedes the previous one
+                commands.pop()
+            if not commands or _speed_code(commands[-1][1]) != _speed_code(s):
+                commands.append((t, s))
+
+        emit(*points[0])
+        for (t0, s0), (t1, s1) in zip(points, points[1:]):
+            if _speed_code(s0) == _speed_code(s1):
+                continue
+            dur = t1 - t0
+            if dur <= self.step or abs(self.ramp_time(s0, s1) - dur) <= max(self.step, self.tolerance * dur):
+                emit(t0, s1)
+            else:
+                n = int(dur / self.step)
+                for k in range(1, n + 1):
+                    t = t0 + k * self.step
+                    emit(t, s0 + (s1 - s0) * (t - t0) / dur)
+                emit(t1, s1)
+
+        events = []
+        i = 0
+        while i < len(commands):
+            t, s = commands[i]
+            if i + 1 < len(commands) and _speed_code(s) != _speed_code(0) and _speed_code(commands[i+1][1]) == _speed_code(0):
+                run = commands[i+1][0] - t
+                fixed = min(_FIXED_DURATIONS, key=lambda d: abs(d - run))
+                if abs(fixed - run) <= self.tolerance * self.step:
+                    events.append((t, PFxAction().set_motor_speed(ch, s, fixed)))
+                    i += 2
+                    continue
+            events.append((t, PFxAction().set_motor_speed(ch, s)))
+            i += 1
+
+        naive_count = int(round((points[-1][0] - points[0][0]) / self.step)) + 1
+        return PFxRampPlan(events, naive_count)
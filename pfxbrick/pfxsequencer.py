@@ -0,0 +1,183 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick timed action sequencer
+
+import math
+import time
+
+
+def wait_until(target, spin=0.002):
+    """
+    Waits until the time.perf_counter() clock reaches a target time. The
+    wait sleeps until **spin** seconds before the target and busy waits
+    for the remainder, since sleeping alone is not precise enough.
+    
+    :param target: :obj:`float` target time.perf_counter() value
+    :param spin: :obj:`float` busy wait time in seconds
+    """
+    while True:
+        remaining = target - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > spin:
+            time.sleep(remaining - spin)
+
+
+class PFxSequenceStats:
+    """
+    Timing statistics reported by :py:meth:`PFxSequencer.run`.
+    
+    Timing errors are the difference between the estimated time each
+    action reached the PFx Brick and its scheduled time on the timeline.
+    Positive values are late, negative values are early.
+
+    Attributes:
+        count (:obj:`int`): number of actions sent
+
+        mean (:obj:`float`): mean timing error in seconds
+
+        stdev (:obj:`float`): standard deviation (jitter) of the timing error in seconds
+
+        worst (:obj:`float`): largest absolute timing error in seconds
+
+        late (:obj:`int`): number of actions which could not be sent on time
+
+        rtt (:obj:`float`): final estimate of the USB round trip time in seconds
+    """
+    def __init__(self, errors=[], late=0, rtt=0.0):
+        self.count = len(errors)
+        self.mean = 0.0
+        self.stdev = 0.0
+        self.worst = 0.0
+        self.late = late
+        self.rtt = rtt
+        if errors:
+            self.mean = sum(errors) / len(errors)
+            self.stdev = math.sqrt(sum((e - self.mean) ** 2 for e in errors) / len(errors))
+            self.worst = max(abs(e) for e in errors)
+
+    def __str__(self):
+        s = '%d actions, mean error %.2f ms, jitter %.2f ms, worst %.2f ms, %d late, RTT %.2f ms' % (
+            self.count, self.mean * 1000, self.stdev * 1000, self.worst * 1000, self.late, self.rtt * 1000)
+        return s
+
+
+class PFxSequencer:
+    """
+    Timeline sequencer for precisely timed actions.
+    
+    A timeline is a list of (t, action) events where t is the time in
+    seconds from the start of the sequence and action is a :py:class:`PFxAction`
+    or a pre-encoded payload from :py:class:`PFxActionCache`. Events are
+    scheduled against a monotonic clock relative to the start of the sequence,
+    so that delays in sending one event do not accumulate into the following
+    events.  Each event is sent early by half of the measured USB round
+    trip time so that it arrives at the PFx Brick at its scheduled time.
+    
+    An example of using this class is as follows::
+    
+        seq = PFxSequencer(brick)
+        seq.add(0.0, PFxAction().light_on([1]))
+        seq.add(0.5, PFxAction().light_off([1]))
+        stats = seq.run()
+        print(stats)
+
+    Attributes:
+        brick (:obj:`PFxBrick`): the PFx Brick which receives the actions
+
+        events ([(:obj:`float`, :obj:`PFxAction`)]): the timeline of events
+
+        rtt (:obj:`float`): current estimate of the USB round trip time in seconds, None until measured
+
+        smoothing (:obj:`float`): weight (0 - 1) given to each new round trip time measurement
+
+        spin (:obj:`float`): time in seconds before each event where sleeping stops and busy waiting begins
+    """
+    def __init__(self, brick, events=None, smoothing=0.2, spin=0.002):
+        self.brick = brick
+        self.events = []
+        self.rtt = None
+        self.smoothing = smoothing
+        self.spin = spin
+        if events is not None:
+            for t, action in events:
+                self.add(t, action)
+
+    def add(self, t, action):
+        """
+        Adds an action to the timeline.
+        
+        :param t: :obj:`float` time in seconds from the start of the sequence
+        :param action: :obj:`PFxAction` or pre-encoded action payload
+        :returns: :obj:`PFxSequencer` self
+        """
+        self.events.append((float(t), action))
+        return self
+
+    def calibrate(self, count=5):
+        """
+        Measures the USB round trip time with silent PFX_CMD_GET_ICD_REV
+        transactions, which have no effect on the PFx Brick.
+        
+        :param count: :obj:`int` number of transactions to measure
+        :returns: :obj:`float` round trip time estimate in seconds
+        """
+        for i in range(count):
+            t0 = time.perf_counter()
+            self.brick.get_icd_rev(silent=True)
+            self._update_rtt(time.perf_counter() - t0)
+        return self.rtt
+
+    def _update_rtt(self, sample):
+        if self.rtt is None:
+            self.rtt = sample
+        else:
+            self.rtt += self.smoothing * (sample - self.rtt)
+
+
+    def run(self):
+        """
+        Sends every action of the timeline at its scheduled time.
+        
+        :returns: :obj:`PFxSequenceStats` timing statistics of the run
+        """
+        if self.rtt is None:
+            self.calibrate()
+        errors = []
+        late = 0
+        # start one round trip from now so that events at t=0 can be sent on time
+        start = time.perf_counter() + self.rtt
+        for t, action in sorted(self.events, key=lambda e: e[0]):
+            due = start + t
+            send_at = due - self.rtt / 2
+            if time.perf_counter() > send_at:
+                late += 1
+            else:
+                wait_until(send_at, self.spin)
+            t0 = time.perf_counter()
+            self.brick.test_action(action)
+            t1 = time.perf_counter()
+            self._update_rtt(t1 - t0)
+            errors.append((t0 + (t1 - t0) / 2) - due)
+        return PFxSequenceStats(errors, late, self.rtt)
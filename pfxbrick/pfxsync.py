@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick synchronized multi-brick action dispatch
+
+import threading
+import time
+from pfxbrick.pfxsequencer import wait_until
+
+
+class PFxSyncResult:
+    """
+    Result of a synchronized dispatch with :py:meth:`PFxSyncDispatcher.dispatch`.
+
+    Attributes:
+        arrivals ([:obj:`float`]): estimated time.perf_counter() time each PFx Brick received its action
+
+        skew (:obj:`float`): difference in seconds between the earliest and latest estimated arrival
+    """
+    def __init__(self, arrivals):
+        self.arrivals = arrivals
+        self.skew = 0.0
+        if arrivals:
+            self.skew = max(arrivals) - min(arrivals)
+
+    def __str__(self):
+        s = '%d PFx Bricks, skew %.2f ms' % (len(self.arrivals), self.skew * 1000)
+        return s
+
+
+class PFxSyncDispatcher:
+    """
+    Synchronized action dispatch to several PFx Bricks.
+    
+    Actions are sent to each PFx Brick from its own thread.  Every thread
+    sends early by half of the round trip time measured for its PFx Brick
+    so that the actions arrive at all PFx Bricks at the same moment rather
+    than one round trip apart.  The round trip time of every PFx Brick is
+    re-measured with every dispatch.
+    
+    An example of using this class is as follows::
+    
+        sync = PFxSyncDispatcher(bricks)
+        sync.measure()
+        res = sync.dispatch(PFxAction().play_audio_file(1))
+        print(res)
+
+    Attributes:
+        bricks ([:obj:`PFxBrick`]): the PFx Bricks which receive the actions
+
+        rtt ([:obj:`float`]): round trip time estimate in seconds for each PFx Brick, None until measured
+
+        smoothing (:obj:`float`): weight (0 - 1) given to each new round trip time measurement
+
+        margin (:obj:`float`): time in seconds allowed for the threads to start before sending
+    """
+    def __init__(self, bricks, smoothing=0.2, margin=0.01):
+        self.bricks = list(bricks)
+        self.rtt = [None] * len(self.bricks)
+        self.smoothing = smoothing
+        self.margin = margin
+        self._lock = threading.Lock()
+
+    def _update_rtt(self, i, sample):
+        with self._lock:
+            if self.rtt[i] is None:
+                self.rtt[i] = sample
+            else:
+                self.rtt[i] += self.smoothing * (sample - self.rtt[i])
+
+    def _run(self, fn):
+        threads = [threading.Thread(target=fn, args=(i,)) for i in range(len(self.bricks))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def measure(self, count=5):
+        """
+        Measures the round trip time of every PFx Brick in parallel with
+        silent PFX_CMD_GET_ICD_REV transactions.
+        
+        :param count: :obj:`int` number of transactions to measure per PFx Brick
+        :returns: [:obj:`float`] round trip time estimates in seconds
+        """
+        def probe(i):
+            for n in range(count):
+                t0 = time.perf_counter()
+                self.bricks[i].get_icd_rev(silent=True)
+                self._update_rtt(i, time.perf_counter() - t0)
+        self._run(probe)
+        return list(self.rtt)
+
+    def dispatch(self, actions):
+        """
+        Sends actions to all PFx Bricks so that they arrive at the same time.
+        
+        :param actions: a :obj:`PFxAction` (or pre-encoded payload) for all PFx Bricks, or a list with one action per PFx Brick
+        :returns: :obj:`PFxSyncResult` estimated arrival times and skew
+        """
+        if not isinstance(actions, (list, tuple)):
+            actions = [actions] * len(self.bricks)
+        if None in self.rtt:
+            self.measure()
+        arrivals = [0.0] * len(self.bricks)
+        due = time.perf_counter() + max(self.rtt) / 2 + self.margin
+        def send(i):
+            wait_until(due - self.rtt[i] / 2)
+            t0 = time.perf_counter()
+            self.bricks[i].test_action(actions[i])
+            t1 = time.perf_counter()
+            self._update_rtt(i, t1 - t0)
+            arrivals[i] = t0 + (t1 - t0) / 2
+        self._run(send)
+        return PFxSyncResult(arrivals)
@@ -0,0 +1,292 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick auto-reconnect watchdog
+
+import copy
+import threading
+import time
+from collections import deque
+from pfxbrick.pfx import *
+from pfxbrick.pfxfiles import PFxFile
+from pfxbrick.pfxmsg import cmd_get_icd_rev, cmd_get_dir_entry_id
+
+# exceptions raised by hidapi when a device has been unplugged or has reset
+LOST_ERRORS = (OSError, ValueError)
+
+
+def brick_connected(serial_no):
+    """
+    Checks if a PFx Brick with the given USB serial number is on the USB bus.
+    """
+    import hid
+    for dev in hid.enumerate(PFX_USB_VENDOR_ID, PFX_USB_PRODUCT_ID):
+        if dev['serial_number'] == serial_no:
+            return True
+    return False
+
+
+def restart_put_file(brick, fileID, fn, show_progress=False):
+    """
+    Copies a file to the PFx Brick from the beginning, first removing any
+    file with the same ID such as a partial copy left by an interrupted transfer.
+    """
+    res = cmd_get_dir_entry_id(brick.hid, fileID)
+    if res:
+        d = PFxFile()
+        d.from_bytes(res)
+        if d.id == fileID:
+            brick.remove_file(fileID)
+    brick.put_file(fileID, fn, show_progress)
+
+
+class PFxWatchdog:
+    """
+    Watchdog which keeps a PFx Brick session alive across unplugging and resets.
+    
+    A background thread pings the PFx Brick every **interval** seconds. When
+    the device stops responding, for example after being unplugged or after
+    an EVT_COMMAND_RESTART, the session is closed and the USB bus is
+    re-enumerated every **retry_interval** seconds for the same serial
+    number.  Once the PFx Brick is re-opened, the session state is restored:
+    the name and configuration are written back if they differ from the
+    host's copy, then commands queued with :py:meth:`submit` while the
+    brick was lost are replayed in order.
+    
+    The PFx Brick file system cannot resume a partially written file, so
+    interrupted transfers made with :py:meth:`put_file` and
+    :py:meth:`get_file` are restarted from the beginning.
+    
+    While the PFx Brick is lost it is closed, so calling its methods
+    directly rather than through :py:meth:`submit` raises OSError or
+    ValueError until the watchdog has re-opened it.  A transaction in
+    progress in another thread completes before the brick is closed.
+    
+    An example of using this class is as follows::
+    
+        watchdog = PFxWatchdog(brick)
+        watchdog.start()
+        watchdog.submit(PFxBrick.test_action, action)
+        watchdog.put_file(7, 'horn.wav')
+        ...
+        watchdog.stop()
+
+    Attributes:
+        brick (:obj:`PFxBrick`): the watched PFx Brick
+
+        serial_no (:obj:`str`): USB serial number of the watched PFx Brick
+
+        interval (:obj:`float`): time in seconds between pings while connected
+
+        retry_interval (:obj:`float`): time in seconds between reconnect attempts
+
+        device (:obj:`object`): device with the hidapi device interface to re-open instead of searching the USB bus, e.g. a :py:class:`PFxEmulator`
+
+        connected (:obj:`boolean`): whether the PFx Brick is currently connected
+
+        losses (:obj:`int`): number of times the PFx Brick was lost
+
+        last_recovery (:obj:`float`): time in seconds the last recovery took, None before the first recovery
+    """
+    def __init__(self, brick, interval=0.1, retry_interval=0.05, device=None):
+        self.brick = brick
+        self.serial_no = brick.usb_serno_str
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.device = device
+        self.connected = brick.is_open
+        self.losses = 0
+        self.last_recovery = None
+        self._lost_at = None
+        self._name = None
+        self._config = None
+        self._pending = deque()
+        self._callbacks = []
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, callback):
+        """
+        Registers a function called as callback(event) with event 'lost' or 'restored'.
+        """
+        self._callbacks.append(callback)
+
+    def _notify(self, event):
+        for callback in list(self._callbacks):
+            # a failing callback must not stop the watchdog thread
+            try:
+                callback(event)
+            except Exception as e:
+                print("Error in PFx Brick watchdog callback: %s" % (e))
+
+    def save_session(self):
+        """
+        Records the name and configuration to restore, reading them from the PFx Brick.
+        Changes made with the brick's set_name and set_config methods are
+        picked up automatically when the brick is lost.
+        """
+        with self._lock:
+            self._name = self.brick.get_name()
+            self.brick.get_config()
+            self._config = copy.deepcopy(self.brick.config)
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Calls method(brick, \\*args, \\*\\*kwargs), or queues the call for replay
+        if the PFx Brick is lost.  Queued calls are replayed in order, so a
+        call is also queued while earlier calls are still pending.
+        
+        :param method: function or unbound :py:class:`PFxBrick` method
+        :returns: the method result, or None if the call was queued
+        """
+        with self._lock:
+            if self.connected and not self._pending:
+                try:
+                    return method(self.brick, *args, **kwargs)
+                except LOST_ERRORS:
+                    self._pending.append((method, args, kwargs))
+                    self._lost()
+            else:
+                self._pending.append((method, args, kwargs))
+        return None
+
+    def put_file(self, fileID, fn, show_progress=False):
+        """
+        Copies a file to the PFx Brick, restarting the transfer if it is interrupted.
+        """
+        return self.submit(restart_put_file, fileID, fn, show_progress)
+
+    def get_file(self, fileID, fn=None, show_progress=False):
+        """
+        Copies a file from the PFx Brick, restarting the transfer if it is interrupted.
+        """
+        return self.submit(type(self.brick).get_file, fileID, fn, show_progress)
+
+    @property
+    def pending(self):
+        """
+        :obj:`int` number of calls queued for replay
+        """
+        return len(self._pending)
+
+    def ping(self):
+        """
+        Checks if the PFx Brick responds.
+        
+        :returns: :obj:`boolean` True if the PFx Brick responded
+        """
+        try:
+            return bool(cmd_get_icd_rev(self.brick.hid, silent=True))
+        except LOST_ERRORS:
+            return False
+
+    def _lost(self):
+        self.connected = False
+        self.losses += 1
+        self._lost_at = time.monotonic()
+        if self._config is not None:
+            # the PFx Brick cannot be read any more, use the last values read
+            self._name = self.brick.peek('name', self._name)
+            self._config = copy.deepcopy(self.brick.config)
+        reader = self.brick._reader
+        if reader is not None:
+            reader.stop()
+            self.brick._reader = None
+        self.brick.close()
+        self._notify('lost')
+
+    def _restore(self):
+        brick = self.brick
+        if self._name is not None:
+            if brick.get_name() != self._name:
+                brick.set_name(self._name)
+        if self._config is not None:
+            saved = copy.deepcopy(self._config)
+            brick.get_config()
+            if brick.config.to_bytes() != saved.to_bytes():
+                brick.config = saved
+                saved.mark_dirty()
+                brick.set_config()
+        while self._pending:
+            method, args, kwargs = self._pending[0]
+            method(brick, *args, **kwargs)
+            self._pending.popleft()
+
+    def _open(self):
+        try:
+            if self.device is None:
+                return self.brick.open(self.serial_no)
+            return self.brick.open(device=self.device)
+        except LOST_ERRORS:
+            # the device went away again while being opened
+            return False
+
+    def _reconnect(self):
+        if self.device is None and not brick_connected(self.serial_no):
+            return False
+        with self._lock:
+            if not self._open():
+                return False
+            try:
+                self._restore()
+            except LOST_ERRORS:
+                self.brick.close()
+                return False
+            self.connected = True
+            if self._lost_at is not None:
+                self.last_recovery = time.monotonic() - self._lost_at
+        self._notify('restored')
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.connected:
+                if not self.ping():
+                    with self._lock:
+                        if self.connected:
+                            self._lost()
+                    continue
+                self._stop.wait(self.interval)
+            elif not self._reconnect():
+                self._stop.wait(self.retry_interval)
+
+    def start(self):
+        """
+        Saves the session state and starts watching in a background thread.
+        """
+        if self._thread is None:
+            if self.connected:
+                self.save_session()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the watchdog.  Queued calls which were not replayed are kept.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -8,12 +8,12 @@ import sys
 import setuptools
 
 PACKAGE_NAME = 'pfxbrick'
-MINIMUM_PYTHON_VERSION = '3.6'
+MINIMUM_PYTHON_VERSION = (3, 7)
 
 def check_python_version():
     """Exit when the Python version is too low."""
-    if sys.version < MINIMUM_PYTHON_VERSION:
-        sys.exit("Python {0}+ is required.".format(MINIMUM_PYTHON_VERSION))
+    if sys.version_info < MINIMUM_PYTHON_VERSION:
+        sys.exit("Python {0}.{1}+ is required.".format(*MINIMUM_PYTHON_VERSION))
 
 
 def read_package_variable(key, filename='__init__.py'):
@@ -54,9 +54,16 @@ setuptools.setup(
         'Development Status :: 3 - Alpha',
         'Natural Language :: English',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License'
     ],
-    install_requires=['hidapi']
+    python_requires='>=3.7',
+    install_requires=['hidapi'],
+    entry_points={
+        'console_scripts': [
+            'pfxbrick=pfxbrick.pfxcli:main',
+            'pfxbrick-broker=pfxbrick.pfxbroker:main'
+        ]
+    }
 )
@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick command batching tests
+
+import unittest
+
+from pfxbrick import PFxBrick, PFxAction
+from pfxbrick.pfx import *
+from pfxbrick.pfxhelpers import address_to_evtch
+from pfxbrick.pfxemulator import PFxEmulator
+
+
+def speed_action(speed):
+    return PFxAction().set_motor_speed([1], speed)
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.device = PFxEmulator('BA7C4000')
+        self.brick = PFxBrick()
+        self.brick.open(device=self.device)
+
+    def tearDown(self):
+        self.brick.close()
+
+    def test_event_fires_action_queued_before_it(self):
+        a, b = speed_action(20), speed_action(80)
+        evt, ch = address_to_evtch(0x38)
+        with self.brick.batch():
+            self.brick.set_action_by_address(0x38, a)
+            self.brick.send_event(evt, ch)
+            self.brick.set_action_by_address(0x38, b)
+            self.brick.send_event(evt, ch)
+        self.assertEqual(self.device.actions, [a.to_bytes(), b.to_bytes()])
+        self.assertEqual(bytes(self.device.lut[0x38]), b.to_bytes())
+
+    def test_preload_and_trigger_in_order(self):
+        actions = [speed_action(10 * i) for i in range(1, 7)]
+        with self.brick.batch():
+            for a in actions:
+                self.brick.preload_action(a)
+                self.brick.trigger(a)
+        self.assertEqual(self.device.actions, [a.to_bytes() for a in actions])
+
+    def test_supersede(self):
+        responses = []
+        n = self.device.transactions
+        with self.brick.batch() as batch:
+            self.brick.set_name('First')
+            self.brick.set_name('Second')
+            batch.add('test', [PFX_CMD_GET_STATUS], lambda res: responses.append(1))
+            batch.add('test', [PFX_CMD_GET_STATUS], lambda res: responses.append(2))
+        self.assertEqual(self.device.transactions - n, 2)
+        self.assertEqual(batch.superseded, 2)
+        self.assertEqual(responses, [1, 2])
+        self.assertEqual(self.brick.peek('name'), 'Second')
+        self.assertEqual(self.device.name.rstrip(b'\0'), b'Second')
+
+    def test_discard_invalidates_config(self):
+        self.brick.get_config()
+        try:
+            with self.brick.batch():
+                self.brick.config.settings.volumeBeep = 10
+                self.brick.set_config()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertNotIn('config', self.brick._cache)
+        n = self.device.transactions
+        self.brick.set_config()
+        self.assertEqual(self.device.transactions - n, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick broker tests
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from pfxbrick import PFxBrick, PFxAction
+from pfxbrick.pfxbroker import PFxBroker, PFxBrokerDevice, broker_bricks
+from pfxbrick.pfxemulator import PFxEmulator
+
+
+class TestBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'broker.sock')
+        self.devices = [PFxEmulator('B0000000'), PFxEmulator('B0000001')]
+        self.broker = PFxBroker(path=self.path, devices=self.devices)
+
+    def tearDown(self):
+        self.broker.stop()
+        shutil.rmtree(self.dir)
+
+    def client(self, serial):
+        brick = PFxBrick()
+        brick.open(serial, device=PFxBrokerDevice(self.path))
+        return brick
+
+    def test_list(self):
+        self.assertTrue(self.broker.start())
+        self.assertEqual(sorted(broker_bricks(self.path)), ['B0000000', 'B0000001'])
+
+    def test_regular_file_not_removed(self):
+        with open(self.path, 'w') as f:
+            f.write('not a socket')
+        self.assertFalse(self.broker.start())
+        self.assertTrue(os.path.isfile(self.path))
+        self.broker.stop()
+        self.assertTrue(os.path.isfile(self.path))
+
+    def test_stale_socket_replaced(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(self.path)
+        s.close()
+        self.assertTrue(self.broker.start())
+        self.assertEqual(len(broker_bricks(self.path)), 2)
+        self.broker.stop()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_concurrent_clients(self):
+        self.assertTrue(self.broker.start())
+        errors = []
+        def work(serial, n):
+            try:
+                brick = self.client(serial)
+                for i in range(20):
+                    address = 8 * n + (i % 8)
+                    brick.set_action_by_address(address, PFxAction().set_motor_speed([1], i))
+                    if not brick.get_status() or brick.serial_no != serial:
+                        errors.append('%s: bad status' % (serial))
+                brick.close()
+            except Exception as e:
+                errors.append('%s: %s' % (serial, str(e)))
+        threads = [threading.Thread(target=work, args=(serial, n)) for serial in ('B0000000', 'B0000001') for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(30)
+        self.assertEqual(errors, [])
+        for device in self.devices:
+            for n in range(4):
+                for i in range(12, 20):
+                    address = 8 * n + (i % 8)
+                    self.assertEqual(bytes(device.lut[address]), PFxAction().set_motor_speed([1], i).to_bytes())
+
+    def test_failed_request_is_answered(self):
+        self.assertTrue(self.broker.start())
+        brick = self.client('B0000000')
+        device = self.devices[0]
+        def fail(buf):
+            raise RuntimeError('device failure')
+        device.write = fail
+        result = []
+        def status():
+            try:
+                result.append(brick.get_status())
+            except OSError as e:
+                result.append(e)
+        t = threading.Thread(target=status, daemon=True)
+        t.start()
+        t.join(10)
+        self.assertFalse(t.is_alive())
+        self.assertIsInstance(result[0], OSError)
+        # the worker still serves requests
+        del device.write
+        self.assertTrue(brick.get_status())
+        brick.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# pfxbrick command line tool tests
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pfxbrick.pfxcli as cli
+from pfxbrick import PFxBrick, PFxAction
+from pfxbrick.pfx import *
+from pfxbrick.pfxemulator import PFxEmulator
+from pfxbrick.pfxfleet import PFxFleet
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fleet = PFxFleet([])
+        self.devices = {}
+        for i in range(3):
+            serial = 'C11%05X' % (i)
+            device = PFxEmulator(serial, name='Brick %d' % (i))
+            brick = PFxBrick()
+            brick.open(device=device)
+            self.fleet.bricks[serial] = brick
+            self.devices[serial] = device
+        self.serials = sorted(self.devices)
+        self.out = io.StringIO()
+        self._out, cli._out = cli._out, self.out
+
+    def tearDown(self):
+        cli._out = self._out
+        self.fleet.close()
+        shutil.rmtree(self.dir)
+
+    def command(self, *argv):
+        self.out.seek(0)
+        self.out.truncate()
+        args = cli.build_parser().parse_args(list(argv))
+        ok = args.func(self.fleet, args)
+        records = [json.loads(line) for line in self.out.getvalue().splitlines()]
+        return ok, {r['serial']: r for r in records}
+
+    def test_config_set(self):
+        ok, records = self.command('config', 'set', 'audio.bass=7', 'lights.startupBrightness[2]=0x1FF')
+        self.assertTrue(ok)
+        for serial, device in self.devices.items():
+            self.assertEqual(records[serial]['changed'], ['lights.startupBrightness', 'audio.bass'])
+            # the value written is what the one byte setting can hold
+            self.assertEqual(records[serial]['values'], {'audio.bass': 7, 'lights.startupBrightness[2]': 0xFF})
+
+    def test_config_set_masked_bits(self):
+        for brick in self.fleet.bricks.values():
+            brick.get_config()
+        n = {serial: device.transactions for serial, device in self.devices.items()}
+        # bit 1 belongs to volumeBeep, not to the statusLED setting
+        ok, records = self.command('config', 'set', 'settings.statusLED=%d' % (PFX_CFG_VOLBEEP_MASK))
+        self.assertTrue(ok)
+        for serial, device in self.devices.items():
+            self.assertEqual(records[serial]['changed'], [])
+            self.assertEqual(records[serial]['values'], {'settings.statusLED': 0})
+            # the cached configuration was verified and nothing was written
+            self.assertEqual(device.transactions - n[serial], 1)
+
+    def test_restore_golden_keeps_names(self):
+        golden = self.serials[0]
+        self.fleet.bricks[golden].config.audio.treble = 9
+        self.fleet.bricks[golden].config.mark_dirty()
+        self.fleet.bricks[golden].set_config()
+        fn = os.path.join(self.dir, 'backup.json')
+        self.assertTrue(self.command('backup', fn)[0])
+        ok, records = self.command('restore', fn, '--golden', golden)
+        self.assertTrue(ok)
+        for i, serial in enumerate(self.serials):
+            self.assertEqual(records[serial]['from'], golden)
+            self.assertEqual(self.devices[serial].name.rstrip(b'\0'), b'Brick %d' % (i))
+            self.assertEqual(self.devices[serial].config, self.devices[golden].config)
+        ok, records = self.command('restore', fn, '--golden', golden, '--with-name')
+        self.assertTrue(ok)
+        for serial in self.serials:
+            self.assertEqual(self.devices[serial].name.rstrip(b'\0'), b'Brick 0')
+
+    def test_lut_dump_and_load(self):
+        for i, serial in enumerate(self.serials):
+            self.fleet.bricks[serial].set_action_by_address(5, PFxAction().set_motor_speed([1], 10 * (i + 1)))
+        ok, records = self.command('lut', 'dump')
+        self.assertTrue(ok)
+        fn = os.path.join(self.dir, 'lut.jsonl')
+        with open(fn, 'w') as f:
+            for serial in self.serials[:2]:
+                f.write(json.dumps(records[serial]) + '\n')
+        for device in self.devices.values():
+            device.lut[5][:] = bytes(16)
+        for brick in self.fleet.bricks.values():
+            brick._cache.pop('lut', None)
+        ok, records = self.command('lut', 'load', fn)
+        self.assertFalse(ok)
+        for i, serial in enumerate(self.serials[:2]):
+            self.assertTrue(records[serial]['ok'])
+            self.assertEqual(bytes(self.devices[serial].lut[5]), PFxAction().set_motor_speed([1], 10 * (i + 1)).to_bytes())
+        self.assertFalse(records[self.serials[2]]['ok'])
+
+
+if __name__ == '__main__':
+    unittest.main()
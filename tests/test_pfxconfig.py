@@ -0,0 +1,166 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick configuration codec tests
+
+import random
+import unittest
+
+from pfxbrick import PFxBrick
+from pfxbrick.pfx import *
+from pfxbrick.pfxconfig import PFxConfig, config_values, read_codec, write_codec
+from pfxbrick.pfxemulator import PFxEmulator
+
+ITERATIONS = 3000
+
+
+def bit(byte, mask):
+    return (byte & mask) == mask
+
+def legacy_from_bytes(config, msg):
+    # the hand-indexed PFX_CMD_GET_CONFIG layout used before PFxConfigCodec
+    lights, settings, audio = config.lights, config.settings, config.audio
+    lights.startupBrightness[0:6] = list(msg[1:7])
+    settings.notchCount = msg[7]
+    settings.notchBounds[0:7] = list(msg[8:15])
+    settings.irAutoOff = msg[26]
+    settings.bleAutoOff = msg[27]
+    settings.bleMotorWhenDisconnect = msg[28]
+    settings.bleAdvertPower = msg[29]
+    settings.bleSessionPower = msg[30]
+    lights.startupBrightness[6] = msg[31]
+    lights.startupBrightness[7] = msg[32]
+    lights.pfBrightnessA = msg[33]
+    lights.pfBrightnessB = msg[34]
+    audio.bass = msg[35]
+    audio.treble = msg[36]
+    settings.statusLED = int(msg[37] & PFX_CFG_STATLED_MASK)
+    settings.volumeBeep = int(msg[37] & PFX_CFG_VOLBEEP_MASK)
+    settings.autoPowerDown = int(msg[37] & PFX_CFG_POWERSAVE_MASK)
+    settings.lockoutMode = int(msg[37] & PFX_CFG_LOCK_MODE_MASK)
+    audio.audioDRC = int(msg[37] & PFX_CFG_AUDIO_DRC_MASK)
+    for i, motor in enumerate(config.motors):
+        b = msg[38 + 6 * i:44 + 6 * i]
+        motor.invert = bit(b[0], PFX_CFG_MOTOR_INVERT)
+        motor.torqueComp = bit(b[0], PFX_CFG_MOTOR_TRQCOMP)
+        motor.tlgMode = bit(b[0], PFX_CFG_MOTOR_TLGMODE)
+        motor.vmin, motor.vmid, motor.vmax, motor.accel, motor.decel = b[1:6]
+    audio.defaultVolume = msg[62]
+    lights.defaultBrightness = msg[63]
+
+def legacy_to_bytes(config):
+    # the hand-indexed PFX_CMD_SET_CONFIG layout used before PFxConfigCodec
+    settings, lights, audio = config.settings, config.lights, config.audio
+    msg = [settings.notchCount]
+    msg.extend(settings.notchBounds[0:7])
+    msg.extend([0] * 11)
+    msg.extend([settings.irAutoOff, settings.bleAutoOff, settings.bleMotorWhenDisconnect,
+                settings.bleAdvertPower, settings.bleSessionPower, audio.bass, audio.treble])
+    v = PFX_CFG_STATLED_OFF if settings.statusLED == PFX_CFG_STATLED_OFF else PFX_CFG_STATLED_ON
+    v |= PFX_CFG_VOLBEEP_ON if settings.volumeBeep == PFX_CFG_VOLBEEP_ON else PFX_CFG_VOLBEEP_OFF
+    v |= settings.autoPowerDown
+    v |= settings.lockoutMode
+    v |= PFX_CFG_AUDIO_DRC_ON if audio.audioDRC == PFX_CFG_AUDIO_DRC_ON else PFX_CFG_AUDIO_DRC_OFF
+    msg.append(v)
+    for motor in config.motors:
+        c = 0
+        if motor.invert:
+            c |= PFX_CFG_MOTOR_INVERT
+        if motor.torqueComp:
+            c |= PFX_CFG_MOTOR_TRQCOMP
+        if motor.tlgMode:
+            c |= PFX_CFG_MOTOR_TLGMODE
+        msg.append(c)
+        msg.extend([motor.vmin, motor.vmid, motor.vmax, motor.accel, motor.decel])
+    msg.extend([audio.defaultVolume, lights.defaultBrightness])
+    msg.extend(lights.startupBrightness[0:8])
+    msg.extend([lights.pfBrightnessA, lights.pfBrightnessB])
+    return bytes(msg)
+
+def random_payloads(seed, count=ITERATIONS):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield bytes([PFX_CMD_GET_CONFIG | 0x80]) + bytes(rng.getrandbits(8) for j in range(63))
+
+
+class PFxConfigCodecTest(unittest.TestCase):
+
+    def test_decode_matches_legacy_layout(self):
+        for msg in random_payloads(1):
+            config = PFxConfig()
+            config.from_bytes(msg)
+            legacy = PFxConfig()
+            legacy_from_bytes(legacy, msg)
+            self.assertEqual(config_values(config), config_values(legacy))
+
+    def test_encode_matches_legacy_layout(self):
+        for msg in random_payloads(2):
+            config = PFxConfig()
+            legacy_from_bytes(config, msg)
+            self.assertEqual(bytes(config.to_bytes()), legacy_to_bytes(config))
+
+    def test_round_trip(self):
+        for msg in random_payloads(3):
+            config = PFxConfig()
+            config.from_bytes(msg)
+            for codec in (read_codec, write_codec):
+                decoded = codec.decode(PFxConfig(), codec.encode(config))
+                self.assertEqual(config_values(decoded), config_values(config))
+                self.assertEqual(codec.encode(decoded), codec.encode(config))
+
+    def test_dirty_tracking(self):
+        for msg in random_payloads(5, 200):
+            config = PFxConfig()
+            config.from_bytes(msg)
+            self.assertFalse(config.is_dirty())
+            self.assertEqual(config.dirty_fields(), [])
+            # bits outside a setting's mask are not written, so are no change
+            config.settings.statusLED |= ~PFX_CFG_STATLED_MASK & 0xFF
+            self.assertFalse(config.is_dirty())
+            config.motors[2].accel = (config.motors[2].accel + 1) & 0xFF
+            config.lights.startupBrightness[3] ^= 0x80
+            self.assertEqual(config.dirty_fields(), ['lights.startupBrightness', 'motors[2].accel'])
+            config.mark_clean()
+            self.assertFalse(config.is_dirty())
+            config.mark_dirty()
+            self.assertTrue(config.is_dirty())
+
+    def test_emulated_brick_round_trip(self):
+        device = PFxEmulator('C0DEC000')
+        brick = PFxBrick()
+        brick.open(device=device)
+        for msg in random_payloads(4, 200):
+            brick.config.from_bytes(msg)
+            brick.config.mark_dirty()
+            brick.set_config()
+            expected = config_values(brick.config)
+            # read back from the emulator rather than the host's cached copy
+            brick._cache.pop('config', None)
+            brick.config = PFxConfig()
+            brick.get_config()
+            self.assertEqual(config_values(brick.config), expected)
+        brick.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick on-demand property tests
+
+import io
+import contextlib
+import unittest
+
+from pfxbrick import PFxBrick
+from pfxbrick.pfxemulator import PFxEmulator
+
+
+def no_response(max_length, timeout_ms=0):
+    return []
+
+
+class TestFields(unittest.TestCase):
+
+    def setUp(self):
+        self.device = PFxEmulator('F1E1D000', name='Layout')
+        self.brick = PFxBrick()
+        self.brick.open(device=self.device)
+
+    def tearDown(self):
+        self.brick.close()
+
+    def test_status_read_once(self):
+        self.brick.expire_fields()
+        n = self.device.transactions
+        self.brick.product_id, self.brick.serial_no, self.brick.status, self.brick.error
+        self.assertEqual(self.device.transactions - n, 1)
+
+    def test_failed_read_not_repeated(self):
+        self.brick.expire_fields()
+        self.device.read = no_response
+        n = self.device.transactions
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.brick.print_status()
+            self.brick.print_status()
+        self.assertEqual(self.device.transactions - n, 1)
+        self.assertFalse(self.brick.get_status(max_age=10))
+
+    def test_peek_without_device(self):
+        self.assertEqual(self.brick.peek('name', None), None)
+        name = self.brick.get_name()
+        self.brick.field_ttl['name'] = 0
+        self.device.close()
+        n = self.device.transactions
+        self.assertEqual(self.brick.peek('name'), name)
+        self.assertEqual(self.device.transactions, n)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#
+# PFx Brick fleet snapshot, restore and rollout tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pfxbrick import PFxBrick, PFxConfig
+from pfxbrick.pfx import *
+from pfxbrick.pfxconfig import read_codec
+from pfxbrick.pfxemulator import PFxEmulator
+from pfxbrick.pfxfleet import PFxFleet, PFxSnapshot
+
+
+class TestFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.fleet = PFxFleet([])
+        self.devices = {}
+        for i in range(6):
+            serial = 'F1EE%04X' % (i)
+            device = PFxEmulator(serial, name='Brick %d' % (i))
+            brick = PFxBrick()
+            brick.open(device=device)
+            self.fleet.bricks[serial] = brick
+            self.devices[serial] = device
+        self.serials = sorted(self.devices)
+
+    def tearDown(self):
+        self.fleet.close()
+
+    def accel(self, serial):
+        config = read_codec.decode(PFxConfig(), self.devices[serial].config)
+        return config.motors[0].accel
+
+    def test_rollout(self):
+        def change(brick):
+            brick.config.motors[0].accel = 9
+        result = self.fleet.rollout(change, canary=1, batch_size=2, serials=self.serials)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.updated, self.serials)
+        self.assertEqual([self.accel(s) for s in self.serials], [9] * 6)
+
+    def test_rollout_failure_rolls_back(self):
+        failing = self.serials[3]
+        def change(brick):
+            if brick.usb_serno_str == failing:
+                raise RuntimeError('change failed')
+            brick.config.motors[0].accel = 9
+        result = self.fleet.rollout(change, canary=1, batch_size=2, serials=self.serials)
+        self.assertFalse(result.ok)
+        self.assertEqual(result.failed, [failing])
+        self.assertEqual(result.updated, [])
+        # the waves were [0], [1, 2] and [3, 4], the last wave never started
+        self.assertEqual(sorted(result.rolled_back), self.serials[:5])
+        self.assertEqual([self.accel(s) for s in self.serials], [0] * 6)
+
+    def test_restore_writes_differences(self):
+        serial = self.serials[0]
+        brick = self.fleet.bricks[serial]
+        device = self.devices[serial]
+        sent = []
+        write = device.write
+        def record(buf):
+            if buf[1] in (PFX_CMD_SET_NAME, PFX_CMD_SET_CONFIG, PFX_CMD_SET_EVENT_ACTION):
+                sent.append(buf[1])
+            return write(buf)
+        device.write = record
+        snap = PFxSnapshot.from_brick(brick)
+        self.fleet.restore(brick, snap)
+        self.assertEqual(sent, [])
+        device.name = b'Renamed'
+        device.lut[5][0] = 0x11
+        self.fleet.restore(brick, snap)
+        self.assertEqual(sent, [PFX_CMD_SET_NAME, PFX_CMD_SET_EVENT_ACTION])
+        self.assertEqual(device.name, b'Brick 0')
+        self.assertEqual(device.lut[5][0], 0)
+
+    def test_save_load(self):
+        d = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(d, 'fleet.json')
+            self.fleet.snapshot()
+            self.fleet.save(fn)
+            fleet = PFxFleet([])
+            snapshots = fleet.load(fn)
+        finally:
+            shutil.rmtree(d)
+        self.assertEqual(sorted(snapshots), self.serials)
+        for serial, snap in snapshots.items():
+            self.assertEqual(snap.to_dict(), self.fleet.snapshots[serial].to_dict())
+        diffs = fleet.diff(self.serials[0])
+        self.assertEqual(sorted(diffs), self.serials[1:])
+        self.assertEqual(diffs[self.serials[1]], [('name', 'Brick 1', 'Brick 0')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# PFx Brick state and IR monitor tests
+
+import io
+import contextlib
+import time
+import unittest
+
+from pfxbrick import PFxBrick
+from pfxbrick.pfxmonitor import PFxStateMonitor
+from pfxbrick.pfxirmonitor import PFxIRMonitor
+from pfxbrick.pfxemulator import PFxEmulator
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+class TestStateMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.device = PFxEmulator('5A7E0000')
+        self.brick = PFxBrick()
+        self.brick.open(device=self.device)
+        self.monitor = PFxStateMonitor(self.brick, min_interval=0.005, max_interval=0.02)
+        self.changes = []
+        self.monitor.subscribe(lambda state, previous: self.changes.append(state))
+
+    def tearDown(self):
+        self.monitor.stop()
+        self.brick.close()
+
+    def test_poll_reports_changes(self):
+        self.assertTrue(self.monitor.poll())
+        self.assertFalse(self.monitor.poll())
+        self.device.state[4] = 200
+        self.assertTrue(self.monitor.poll())
+        self.assertEqual(len(self.changes), 2)
+        self.assertEqual(self.changes[-1].light_brightness[0], 200)
+        self.assertEqual(self.monitor.polls, 3)
+
+    def test_failing_callback(self):
+        def fail(state, previous):
+            raise RuntimeError('callback failure')
+        self.monitor.unsubscribe(self.monitor._callbacks[0])
+        self.monitor.subscribe(fail)
+        self.monitor.subscribe(lambda state, previous: self.changes.append(state))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.monitor.start()
+            self.assertTrue(wait_for(lambda: len(self.changes) == 1))
+            self.device.state[12] = 90
+            self.assertTrue(wait_for(lambda: len(self.changes) == 2))
+        self.assertEqual(self.changes[-1].volume, 90)
+
+    def test_lost_device(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.monitor.start()
+            self.assertTrue(wait_for(lambda: len(self.changes) == 1))
+            self.device.close()
+            self.assertTrue(wait_for(lambda: self.monitor.errors >= 3))
+            self.assertTrue(self.monitor._thread.is_alive())
+            self.device.open()
+            self.device.state[0] = 0x20
+            self.assertTrue(wait_for(lambda: len(self.changes) == 2))
+        # the loss is reported once
+        self.assertEqual(out.getvalue().count('cannot access'), 1)
+
+
+class TestIRMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.device = PFxEmulator('1A000000')
+        self.brick = PFxBrick()
+        self.brick.open(device=self.device)
+        # a message received before monitoring starts
+        self.device.last_ir[:] = bytes([0x09, 0x11, 0x22, 0x33, 0x44])
+        self.monitor = PFxIRMonitor(self.brick, interval=0.001)
+
+    def tearDown(self):
+        self.brick.close()
+
+    def test_stored_message_not_reported(self):
+        self.assertIsNone(self.monitor.poll())
+        self.assertIsNone(self.monitor.poll())
+        self.assertEqual(self.monitor.counts, [0, 0, 0, 0])
+        self.assertEqual(self.monitor.last.address, 0x09)
+
+    def test_new_messages(self):
+        self.monitor.poll()
+        self.device.last_ir[:] = bytes([0x0A, 0x11, 0x22, 0x33, 0x45])
+        msg = self.monitor.poll()
+        self.assertEqual((msg.address, msg.ch), (0x0A, 2))
+        self.assertIsNone(self.monitor.poll())
+        # the toggle bit makes a second press of the same button a new message
+        self.device.last_ir[:] = bytes([0x0A, 0x11, 0x22, 0x33, 0x44])
+        self.assertIsNotNone(self.monitor.poll())
+        self.assertEqual(self.monitor.counts, [0, 0, 2, 0])
+        self.assertEqual(self.monitor.rates(msg.t), [0, 0, 2 / self.monitor.window, 0])
+
+    def test_stream(self):
+        self.assertEqual(list(self.monitor.stream(duration=0.05)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
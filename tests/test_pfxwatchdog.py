@@ -0,0 +1,123 @@
+#! /usr/bin/env python3
+#
+# Copyright (C) 2018  Fx Bricks Inc.
+# This file is part of the pfxbrick python module.
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+#
+# PFx Brick watchdog tests
+
+import io
+import contextlib
+import threading
+import time
+import unittest
+
+from pfxbrick import PFxBrick, PFxAction
+from pfxbrick.pfxwatchdog import PFxWatchdog
+from pfxbrick.pfxemulator import PFxEmulator
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+class TestWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.device = PFxEmulator('3D0C0000', name='Watched')
+        self.brick = PFxBrick()
+        self.brick.open(device=self.device)
+        self.watchdog = PFxWatchdog(self.brick, interval=0.005, retry_interval=0.005, device=self.device)
+        self.events = []
+        self.watchdog.subscribe(self.events.append)
+
+    def tearDown(self):
+        self.watchdog.stop()
+        self.brick.close()
+
+    def test_reconnect_restores_session(self):
+        self.brick.get_config()
+        self.brick.config.motors[1].accel = 7
+        self.brick.set_config()
+        self.watchdog.start()
+        # the PFx Brick loses its settings while unplugged
+        self.device.unplug()
+        self.device.factory_reset()
+        self.assertTrue(wait_for(lambda: self.events == ['lost']))
+        self.assertFalse(self.brick.is_open)
+        action = PFxAction().light_on([1])
+        self.assertIsNone(self.watchdog.submit(PFxBrick.test_action, action))
+        self.assertEqual(self.watchdog.pending, 1)
+        self.device.plug()
+        self.assertTrue(wait_for(lambda: self.events == ['lost', 'restored']))
+        self.assertEqual(self.watchdog.pending, 0)
+        self.assertEqual(self.device.name, b'Watched')
+        self.assertEqual(self.device.actions, [action.to_bytes()])
+        self.brick.get_config()
+        self.assertEqual(self.brick.config.motors[1].accel, 7)
+        self.assertEqual(self.watchdog.losses, 1)
+        self.assertIsNotNone(self.watchdog.last_recovery)
+
+    def test_failing_callback(self):
+        def fail(event):
+            raise RuntimeError('callback failure')
+        self.watchdog._callbacks.insert(0, fail)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.watchdog.start()
+            self.device.unplug()
+            self.assertTrue(wait_for(lambda: self.events == ['lost']))
+            self.device.plug()
+            self.assertTrue(wait_for(lambda: self.events == ['lost', 'restored']))
+        self.assertTrue(self.watchdog._thread.is_alive())
+        self.assertEqual(out.getvalue().count('watchdog callback'), 2)
+
+    def test_close_waits_for_transaction(self):
+        # a direct call in another thread either completes or fails cleanly
+        # while the watchdog closes the brick
+        self.watchdog.start()
+        errors = []
+        done = threading.Event()
+        def run():
+            while not done.is_set():
+                try:
+                    self.brick.get_icd_rev(silent=True)
+                except (OSError, ValueError):
+                    pass
+                except Exception as e:
+                    errors.append(e)
+        thread = threading.Thread(target=run)
+        thread.start()
+        for i in range(5):
+            self.device.unplug()
+            self.assertTrue(wait_for(lambda: not self.watchdog.connected))
+            self.device.plug()
+            self.assertTrue(wait_for(lambda: self.watchdog.connected))
+        done.set()
+        thread.join()
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()